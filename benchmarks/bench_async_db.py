@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Benchmark: concurrent update throughput with blocking vs executor-backed db calls.
+
+Simulates N updates arriving at once. Each update does what a typical handler
+does: one database query and one Telegram API call. In "blocking" mode the
+query runs directly on the event loop (the old handler behaviour); in "async"
+mode it goes through db.aio.run, the facade the handlers now await.
+
+By default the query is simulated with time.sleep so the script runs without
+a database. Pass --database to issue real `SELECT pg_sleep(...)` queries
+through the connection pool (requires DATABASE_URL).
+
+Usage:
+    python benchmarks/bench_async_db.py [--updates 200] [--query-ms 20] [--api-ms 50] [--database]
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+# Add parent directory to path to import project modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def _fake_query(seconds):
+    time.sleep(seconds)
+
+def _real_query(seconds):
+    from db.base import get_connection
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_sleep(%s)", (seconds,))
+
+async def _handle_update(query, query_s, api_s, use_executor):
+    from db import aio as db_aio
+    if use_executor:
+        await db_aio.run(query, query_s)
+    else:
+        query(query_s)
+    # Stand-in for update.message.reply_text(...)
+    await asyncio.sleep(api_s)
+
+async def _run(updates, query, query_s, api_s, use_executor):
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        _handle_update(query, query_s, api_s, use_executor) for _ in range(updates)
+    ))
+    return time.perf_counter() - started
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--updates", type=int, default=200, help="concurrent updates to simulate")
+    parser.add_argument("--query-ms", type=float, default=20.0, help="latency of one db query")
+    parser.add_argument("--api-ms", type=float, default=50.0, help="latency of one Telegram API call")
+    parser.add_argument("--database", action="store_true", help="use real pg_sleep queries via the pool")
+    args = parser.parse_args()
+
+    if not args.database:
+        # config.py refuses to import without these; the fake query never connects
+        os.environ.setdefault("BOT_TOKEN", "benchmark")
+        os.environ.setdefault("DATABASE_URL", "postgresql://benchmark@localhost/benchmark")
+
+    import config
+    from db import aio as db_aio
+    query = _real_query if args.database else _fake_query
+    query_s, api_s = args.query_ms / 1000, args.api_ms / 1000
+
+    print(f"{args.updates} concurrent updates, query {args.query_ms:.0f} ms, "
+          f"API call {args.api_ms:.0f} ms, db workers {config.DB_POOL_MAX_SIZE}")
+    results = {}
+    for label, use_executor in (("blocking", False), ("async", True)):
+        elapsed = asyncio.run(_run(args.updates, query, query_s, api_s, use_executor))
+        results[label] = elapsed
+        print(f"  {label:<9} {elapsed:7.2f} s  {args.updates / elapsed:8.1f} updates/s")
+    print(f"  speedup   {results['blocking'] / results['async']:7.2f}x")
+    db_aio.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Benchmark: loading the course and lesson catalog at startup.
+
+Times the three ways the first get_catalog() can get its data:
+  yaml      - pure-Python yaml.safe_load of both files plus validation
+              (the loader the bot used before the snapshot)
+  cyaml     - the same with libyaml's CSafeLoader, what a start after a
+              change of the files now does (falls back to yaml without libyaml)
+  snapshot  - reading the compiled snapshot, what every other start does
+
+Each mode is run --runs times; the median is reported. The snapshot is
+written to a temporary file, the real CATALOG_SNAPSHOT_FILE is not touched.
+
+Usage:
+    python benchmarks/bench_catalog_startup.py [--runs 50]
+"""
+
+import argparse
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+# Add parent directory to path to import project modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault('BOT_TOKEN', '0:benchmark')
+os.environ.setdefault('DATABASE_URL', 'postgresql://localhost/benchmark')
+
+import yaml
+
+from utils import catalog as catalog_module
+
+def _pure_yaml(runs):
+    """build_catalog with the pure-Python loader swapped in."""
+    loader = catalog_module._YamlLoader
+    catalog_module._YamlLoader = yaml.SafeLoader
+    try:
+        return _from_yaml(runs)
+    finally:
+        catalog_module._YamlLoader = loader
+
+def _from_yaml(runs):
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        catalog = catalog_module.build_catalog(snapshot_file='')
+        catalog_module.validate_catalog(catalog)
+        timings.append(time.perf_counter() - started)
+    return timings
+
+def _from_snapshot(runs, snapshot_file):
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        catalog = catalog_module.build_catalog(snapshot_file=snapshot_file)
+        timings.append(time.perf_counter() - started)
+        assert catalog.compiled
+    return timings
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark catalog loading at startup")
+    parser.add_argument('--runs', type=int, default=50, help="Loads per mode")
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    with tempfile.TemporaryDirectory() as directory:
+        snapshot_file = os.path.join(directory, 'catalog.pickle')
+        catalog = catalog_module.build_catalog(snapshot_file='')
+        catalog = catalog_module.compile_catalog(catalog, snapshot_file)
+
+        results = {
+            'yaml': _pure_yaml(args.runs),
+            'cyaml': _from_yaml(args.runs),
+            'snapshot': _from_snapshot(args.runs, snapshot_file),
+        }
+
+    print(f"{len(catalog.courses)} courses, {len(catalog.lessons)} lessons, "
+          f"libyaml: {catalog_module._YamlLoader is not yaml.SafeLoader}")
+    baseline = statistics.median(results['yaml'])
+    for mode, timings in results.items():
+        median = statistics.median(timings)
+        print(f"{mode:>8}: {median * 1000:7.2f} ms median, saves {(baseline - median) * 1000:6.2f} ms "
+              f"({baseline / median:.1f}x)")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Benchmark: parallel redemptions of one referral coupon.
+
+Fires N concurrent redemptions at a single coupon with a small activation
+limit, the way a campaign link hits the bot. Each redemption does what
+handle_confirm_selection does: create a booking and take a coupon activation
+in one unit of work.
+
+"atomic" mode uses reserve_referral_activation. "legacy" mode replays the
+old flow (validate_referral_code-style check in one call, unconditional
+increment in another) to show the oversubscription it allowed.
+
+Exits with status 1 if the atomic mode ever exceeds the limit. Requires
+DATABASE_URL; everything the benchmark creates is deleted afterwards.
+
+Usage:
+    python benchmarks/bench_referral_redemptions.py [--redemptions 500] [--activations 50] [--mode both]
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+# Add parent directory to path to import project modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+from db.base import init_pool, close_pool, get_connection, connection_scope, setup_database
+from db import aio as db_aio
+from db.aio import bookings as db_bookings
+from db.aio import referrals as db_referrals
+
+# Synthetic user ids, far outside the range of real Telegram ids in use
+BASE_USER_ID = 9_100_000_000
+
+def _legacy_check(coupon_id, session=None):
+    with connection_scope(session) as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                f"SELECT current_activations < max_activations FROM {config.REFERRAL_TABLE_NAME} WHERE id = %s",
+                (coupon_id,)
+            )
+            return cur.fetchone()[0]
+
+def _legacy_apply(coupon_id, user_id, booking_id, session=None):
+    with connection_scope(session) as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                f"INSERT INTO {config.REFERRAL_USAGE_TABLE_NAME} (coupon_id, user_id, booking_id) VALUES (%s, %s, %s)",
+                (coupon_id, user_id, booking_id)
+            )
+            cur.execute(
+                f"UPDATE {config.REFERRAL_TABLE_NAME} SET current_activations = current_activations + 1 WHERE id = %s",
+                (coupon_id,)
+            )
+
+async def _redeem(mode, coupon_id, course_id, user_id):
+    """One redemption; returns True if the user got the discount."""
+    if mode == "legacy":
+        if not await db_aio.run(_legacy_check, coupon_id):
+            return False
+        async with db_aio.transaction() as session:
+            booking_id = await db_bookings.create_booking(user_id, "bench", "bench", course_id, "BENCH", 10, session=session)
+            await session.run(_legacy_apply, coupon_id, user_id, booking_id, session=session.session)
+        return True
+
+    try:
+        async with db_aio.transaction() as session:
+            booking_id = await db_bookings.create_booking(user_id, "bench", "bench", course_id, "BENCH", 10, session=session)
+            status = await db_referrals.reserve_referral_activation(coupon_id, user_id, booking_id, session=session)
+            if status != "reserved":
+                raise db_referrals.ReferralUnavailable(status)
+    except db_referrals.ReferralUnavailable:
+        return False
+    return True
+
+def _create_coupon(activations):
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                f"""INSERT INTO {config.REFERRAL_TABLE_NAME} (code, name, discount_percent, max_activations, created_by)
+                    VALUES ('BENCH' || md5(random()::text), 'benchmark', 10, %s, 0) RETURNING id""",
+                (activations,)
+            )
+            coupon_id = cur.fetchone()[0]
+            cur.execute("SELECT id FROM courses ORDER BY id LIMIT 1")
+            course_id = cur.fetchone()[0]
+        conn.commit()
+    return coupon_id, course_id
+
+def _collect_and_cleanup(coupon_id, user_ids):
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(f"SELECT current_activations FROM {config.REFERRAL_TABLE_NAME} WHERE id = %s", (coupon_id,))
+            counter = cur.fetchone()[0]
+            cur.execute(f"SELECT COUNT(*) FROM {config.REFERRAL_USAGE_TABLE_NAME} WHERE coupon_id = %s", (coupon_id,))
+            usages = cur.fetchone()[0]
+            cur.execute(f"DELETE FROM {config.REFERRAL_USAGE_TABLE_NAME} WHERE coupon_id = %s", (coupon_id,))
+            cur.execute(f"DELETE FROM {config.REFERRAL_TABLE_NAME} WHERE id = %s", (coupon_id,))
+            cur.execute("DELETE FROM bookings WHERE user_id = ANY(%s)", (user_ids,))
+        conn.commit()
+    return counter, usages
+
+async def _run(mode, redemptions, activations):
+    coupon_id, course_id = await db_aio.run(_create_coupon, activations)
+    user_ids = [BASE_USER_ID + i for i in range(redemptions)]
+    started = time.perf_counter()
+    results = await asyncio.gather(*(_redeem(mode, coupon_id, course_id, uid) for uid in user_ids))
+    elapsed = time.perf_counter() - started
+    counter, usages = await db_aio.run(_collect_and_cleanup, coupon_id, user_ids)
+    return sum(results), counter, usages, elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--redemptions", type=int, default=500, help="parallel redemptions to fire")
+    parser.add_argument("--activations", type=int, default=50, help="coupon activation limit")
+    parser.add_argument("--mode", choices=("atomic", "legacy", "both"), default="both")
+    args = parser.parse_args()
+
+    init_pool()
+    setup_database()
+    modes = ("legacy", "atomic") if args.mode == "both" else (args.mode,)
+    print(f"{args.redemptions} parallel redemptions of a coupon with {args.activations} activations, "
+          f"pool size {config.DB_POOL_MAX_SIZE}")
+    exceeded = False
+    for mode in modes:
+        granted, counter, usages, elapsed = asyncio.run(_run(mode, args.redemptions, args.activations))
+        over = max(granted, counter, usages) > args.activations
+        print(f"  {mode:<7} granted {granted:5d}  counter {counter:5d}  usage rows {usages:5d}  "
+              f"{elapsed:6.2f} s  {args.redemptions / elapsed:7.1f} redemptions/s  "
+              f"{'LIMIT EXCEEDED' if over else 'ok'}")
+        if mode == "atomic" and over:
+            exceeded = True
+    db_aio.shutdown()
+    close_pool()
+    sys.exit(1 if exceeded else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Benchmark: CPU cost of the /start handler.
+
+Calls start_command with a fake update whose reply_text does nothing, so
+what is measured is the handler's own work: the event enqueue, the screen
+lookup and the reply call. "cached" mode is the handler as it runs in the
+bot; "render" mode rebuilds the text and keyboard from the catalog on every
+call, the way the handler did before the screen was cached.
+
+Events are queued as usual but never written, so no database is needed.
+The catalog snapshot is written to a temporary file, the real
+CATALOG_SNAPSHOT_FILE is not touched.
+
+Usage:
+    python benchmarks/bench_start_command.py [--calls 20000] [--mode both]
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+# Add parent directory to path to import project modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault('BOT_TOKEN', '0:benchmark')
+os.environ.setdefault('DATABASE_URL', 'postgresql://localhost/benchmark')
+
+from datetime import datetime, timezone
+
+import config
+from db import events as db_events_sync
+from handlers import command_handlers
+from utils.catalog import get_catalog
+
+async def _reply_text(*args, **kwargs):
+    return None
+
+def _fake_update(user_id):
+    user = SimpleNamespace(id=user_id, username=f"user{user_id}", first_name="Bench")
+    message = SimpleNamespace(from_user=user, reply_text=_reply_text)
+    return SimpleNamespace(message=message)
+
+def _render_every_time():
+    return command_handlers._render_start_screen(get_catalog(), datetime.now(timezone.utc))
+
+async def _run(calls):
+    context = SimpleNamespace(args=[], user_data={})
+    updates = [_fake_update(1_000 + i) for i in range(calls)]
+    # Прогрев: каталог и первый экран строятся вне замера
+    await command_handlers.start_command(updates[0], context)
+    started = time.process_time()
+    for update in updates:
+        await command_handlers.start_command(update, context)
+    return time.process_time() - started
+
+def _bench(args):
+    catalog = get_catalog()
+    print(f"Catalog v{catalog.version}: {len(catalog.active_courses)} active courses, "
+          f"{len(catalog.active_lessons())} active lessons")
+
+    modes = ['cached', 'render'] if args.mode == 'both' else [args.mode]
+    cached_screen = command_handlers._start_screen
+    for mode in modes:
+        command_handlers._start_screen = cached_screen if mode == 'cached' else _render_every_time
+        elapsed = asyncio.run(_run(args.calls))
+        print(f"{mode:>6}: {args.calls} calls, {elapsed:.2f} s CPU, "
+              f"{elapsed / args.calls * 1e6:.1f} µs/call")
+    command_handlers._start_screen = cached_screen
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the CPU cost of /start")
+    parser.add_argument('--calls', type=int, default=20000, help="Handler calls per mode")
+    parser.add_argument('--mode', choices=['cached', 'render', 'both'], default='both')
+    args = parser.parse_args()
+
+    # События остаются в очереди, но не пишутся в базу
+    db_events_sync._buffer._write = lambda batch: None
+    logging.disable(logging.INFO)
+
+    with tempfile.TemporaryDirectory() as directory:
+        config.CATALOG_SNAPSHOT_FILE = os.path.join(directory, 'catalog.pickle')
+        _bench(args)
+
+if __name__ == '__main__':
+    main()
@@ -6,13 +6,26 @@ from telegram.ext import (
     CommandHandler,
     CallbackQueryHandler,
     MessageHandler,
+    TypeHandler,
     filters,
 )
+from telegram import Update
 
 import config
-from db.base import setup_database
+from db.base import setup_database, init_pool, close_pool
+from db import aio as db_aio
+from db import events as db_events
+from db.aio import blocked_chats as db_blocked
 from handlers import command_handlers, callback_handlers, message_handlers
-from utils.notifications import schedule_all_lesson_notifications
+from utils.notifications import (
+    schedule_all_lesson_notifications,
+    reschedule_changed_lessons,
+    run_lesson_reminder_job,
+    REMINDER_JOB_TYPE,
+)
+from utils.broadcasts import run_broadcast_job, BROADCAST_JOB_TYPE
+from utils.catalog import reload_catalog_if_changed
+from utils.scheduler import scheduler
 
 # Настройка логирования
 logging.basicConfig(
@@ -20,14 +33,43 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+async def reload_blocked_chats_job(context):
+    """Периодически перечитывает чаты, заблокировавшие бота (в том числе записанные другими экземплярами)."""
+    try:
+        count = await db_blocked.reload_blocked_chats()
+        logger.info(f"Loaded {count} blocked chats")
+    except Exception as e:
+        logger.error(f"Error reloading blocked chats: {e}")
 
+async def reload_catalog_job(context):
+    """Перечитывает каталог курсов и уроков при изменении файлов и переставляет напоминания измененных уроков."""
+    try:
+        reloaded = await asyncio.to_thread(reload_catalog_if_changed)
+    except Exception as e:
+        logger.error(f"Error reloading catalog: {e}")
+        return
+    if reloaded is None:
+        return
+    previous, catalog = reloaded
+    changed = await reschedule_changed_lessons(context.application, previous.lessons, catalog.lessons)
+    if changed:
+        logger.info(f"Rescheduled reminders of {changed} changed lessons")
 
-
+async def clear_blocked_chat(update: Update, context):
+    """Любой входящий апдейт от пользователя значит, что бот снова может ему писать."""
+    user = update.effective_user
+    if user is None or not db_blocked.is_blocked(user.id):
+        return
+    try:
+        await db_blocked.clear_blocked(user.id)
+    except Exception as e:
+        logger.error(f"Error clearing blocked chat {user.id}: {e}")
 
 def main() -> None:
     """Основная функция для запуска бота."""
     # 1. СНАЧАЛА настраиваем базу данных. Это создаст все таблицы.
     try:
+        init_pool()
         setup_database()
         logger.info("Database setup was successful.")
         
@@ -38,12 +80,20 @@ def main() -> None:
     # 2. Создаем приложение бота
     application = Application.builder().token(config.BOT_TOKEN).build()
 
+    # Входящий апдейт снимает отметку о блокировке бота; группа -1 видит все апдейты
+    application.add_handler(TypeHandler(Update, clear_blocked_chat), group=-1)
+
     # 3. Регистрируем обработчики команд
     application.add_handler(CommandHandler("start", command_handlers.start_command))
     application.add_handler(CommandHandler("reset", command_handlers.reset_command))
     application.add_handler(CommandHandler("stats", command_handlers.stats_command))
     application.add_handler(CommandHandler("create_referral", command_handlers.create_referral_command))
     application.add_handler(CommandHandler("referral_stats", command_handlers.referral_stats_command))
+    application.add_handler(CommandHandler("reminders_plan", command_handlers.reminders_plan_command))
+    application.add_handler(CommandHandler("reminder_lag", command_handlers.reminder_lag_command))
+    application.add_handler(CommandHandler("broadcast", command_handlers.broadcast_command))
+    application.add_handler(CommandHandler("broadcast_start", command_handlers.broadcast_start_command))
+    application.add_handler(CommandHandler("broadcast_cancel", command_handlers.broadcast_cancel_command))
     
     # 4. Регистрируем обработчик callback'ов от кнопок
     # Важно: здесь должен быть ОДИН обработчик-маршрутизатор
@@ -60,18 +110,49 @@ def main() -> None:
         message_handlers.any_message_handler
     ))
 
-    # 7. Планируем уведомления для всех активных уроков при старте
+    # 7. Планировщик задач и напоминания для всех активных уроков при старте
+    scheduler.register(REMINDER_JOB_TYPE, run_lesson_reminder_job)
+    scheduler.register(BROADCAST_JOB_TYPE, run_broadcast_job)
+
     async def startup_callback(application):
-        """Планирует уведомления для всех активных уроков при старте бота."""
+        """Запускает планировщик и ставит напоминания для всех активных уроков при старте бота."""
         logger.info("Bot started, scheduling lesson notifications...")
+        # Заблокированные чаты нужны до первой рассылки планировщика
+        await reload_blocked_chats_job(None)
+        # Задачи, пропущенные за время простоя, выполняются на первой итерации планировщика
+        await scheduler.start(application)
         try:
             await schedule_all_lesson_notifications(application)
             logger.info("All lesson notifications scheduled successfully")
         except Exception as e:
             logger.error(f"Error scheduling notifications: {e}")
 
+        # Заблокированные чаты загружены выше, дальше перечитываются по расписанию
+        application.job_queue.run_repeating(
+            reload_blocked_chats_job,
+            interval=config.BLOCKED_CHATS_RELOAD_INTERVAL,
+            first=config.BLOCKED_CHATS_RELOAD_INTERVAL,
+            name="blocked_chats_reload"
+        )
+        # Правки data/*.yaml подхватываются без перезапуска
+        if config.CATALOG_RELOAD_INTERVAL > 0:
+            application.job_queue.run_repeating(
+                reload_catalog_job,
+                interval=config.CATALOG_RELOAD_INTERVAL,
+                first=config.CATALOG_RELOAD_INTERVAL,
+                name="catalog_reload"
+            )
+
+    async def shutdown_callback(application):
+        """Останавливает планировщик, дожидается запросов к базе, сбрасывает буфер событий и закрывает пул."""
+        await scheduler.stop()
+        db_aio.shutdown()
+        db_events.shutdown_event_buffer()
+        close_pool()
+
     # Добавляем callback для выполнения при старте
     application.post_init = startup_callback
+    application.post_shutdown = shutdown_callback
 
     # 8. Запускаем бота
     logger.info("Starting bot polling...")
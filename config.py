@@ -1,4 +1,5 @@
 import os
+import socket
 from dotenv import load_dotenv
 
 # Load .env file for local development if it exists
@@ -19,6 +20,80 @@ DATABASE_URL = os.getenv("DATABASE_URL")
 if not DATABASE_URL:
     raise ValueError("No DATABASE_URL found in environment variables")
 
+# Connection pool shared by all db modules
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", 1))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", 10))
+# Connections idle longer than this are pinged with SELECT 1 before reuse
+DB_POOL_HEALTHCHECK_IDLE_SECONDS = float(os.getenv("DB_POOL_HEALTHCHECK_IDLE_SECONDS", 30))
+# How long a caller waits for a free pooled connection before giving up
+DB_POOL_CHECKOUT_TIMEOUT = float(os.getenv("DB_POOL_CHECKOUT_TIMEOUT", 10))
+
+# --- Event Logging Buffer ---
+# Events are queued in memory and written in batches by a background thread
+EVENT_BUFFER_MAX_SIZE = int(os.getenv("EVENT_BUFFER_MAX_SIZE", 10000))
+EVENT_BUFFER_BATCH_SIZE = int(os.getenv("EVENT_BUFFER_BATCH_SIZE", 500))
+EVENT_BUFFER_FLUSH_INTERVAL = float(os.getenv("EVENT_BUFFER_FLUSH_INTERVAL", 1.0))
+
+# --- Telegram Fan-out (reminders, broadcasts) ---
+# Bot API limits: about 30 messages/s overall and 1 message/s per chat.
+# The limit is per bot token: with several instances, divide the rate between them
+TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", 25))
+TELEGRAM_PER_CHAT_INTERVAL = float(os.getenv("TELEGRAM_PER_CHAT_INTERVAL", 1.0))
+FANOUT_CONCURRENCY = int(os.getenv("FANOUT_CONCURRENCY", 20))
+FANOUT_MAX_RETRIES = int(os.getenv("FANOUT_MAX_RETRIES", 3))
+# Delivered messages are recorded in the database in batches
+FANOUT_BATCH_SIZE = int(os.getenv("FANOUT_BATCH_SIZE", 100))
+FANOUT_FLUSH_INTERVAL = float(os.getenv("FANOUT_FLUSH_INTERVAL", 1.0))
+
+# --- Admin Broadcasts ---
+# Broadcasts send at most this many messages/s, leaving the rest of the global rate to reminders
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", 10))
+# Recipients per chunk; progress is checkpointed after each chunk, so a restart re-sends at most one
+BROADCAST_CHUNK_SIZE = int(os.getenv("BROADCAST_CHUNK_SIZE", 200))
+# Throughput and ETA in the admin chat are updated at most this often, seconds
+BROADCAST_REPORT_INTERVAL = float(os.getenv("BROADCAST_REPORT_INTERVAL", 30))
+
+# --- Multiple Instances ---
+# Identifies this process in work claims; must differ between running instances
+INSTANCE_ID = os.getenv("INSTANCE_ID") or f"{socket.gethostname()}:{os.getpid()}"
+# Reminder recipients are claimed in chunks; a claim not completed within the
+# lease (crashed instance) becomes available to other instances again
+NOTIFICATION_CLAIM_BATCH = int(os.getenv("NOTIFICATION_CLAIM_BATCH", 200))
+NOTIFICATION_CLAIM_LEASE = int(os.getenv("NOTIFICATION_CLAIM_LEASE", 300))
+# Scheduled jobs sharing one lesson's fan-out; set to the number of instances
+REMINDER_PARALLEL_JOBS = int(os.getenv("REMINDER_PARALLEL_JOBS", 1))
+
+# --- Scheduled Jobs ---
+# The scheduler sleeps until the next due job, but never longer than this
+SCHEDULER_MAX_SLEEP = float(os.getenv("SCHEDULER_MAX_SLEEP", 60))
+SCHEDULER_MAX_ATTEMPTS = int(os.getenv("SCHEDULER_MAX_ATTEMPTS", 3))
+# Delay before the first retry of a failed job, doubled on each attempt
+SCHEDULER_RETRY_DELAY = float(os.getenv("SCHEDULER_RETRY_DELAY", 30))
+# A job still 'running' after this long is assumed orphaned by a dead instance
+SCHEDULER_STALE_JOB_SECONDS = int(os.getenv("SCHEDULER_STALE_JOB_SECONDS", 900))
+# Reminders are sent this long before a lesson; a late (catch-up) reminder
+# still goes out until this long after the lesson has started
+LESSON_REMINDER_LEAD_MINUTES = int(os.getenv("LESSON_REMINDER_LEAD_MINUTES", 15))
+LESSON_REMINDER_LATE_LIMIT_MINUTES = int(os.getenv("LESSON_REMINDER_LATE_LIMIT_MINUTES", 60))
+# Reminders of other lessons due within this window go to the same user in one message; 0 disables
+REMINDER_COALESCE_WINDOW_MINUTES = int(os.getenv("REMINDER_COALESCE_WINDOW_MINUTES", 30))
+
+# --- Referral Coupon Cache ---
+# Coupons (and codes known not to exist) are cached by code for /start deep links
+COUPON_CACHE_TTL = float(os.getenv("COUPON_CACHE_TTL", 60))
+COUPON_CACHE_MAX_ENTRIES = int(os.getenv("COUPON_CACHE_MAX_ENTRIES", 10000))
+
+# data/courses.yaml and data/lessons.yaml are checked for changes this often, seconds; 0 disables hot reload
+CATALOG_RELOAD_INTERVAL = float(os.getenv("CATALOG_RELOAD_INTERVAL", 30))
+# Validated catalog compiled to a binary snapshot, reused on startup while the YAML files hash the same
+CATALOG_SNAPSHOT_FILE = os.getenv(
+    "CATALOG_SNAPSHOT_FILE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", ".catalog_snapshot.pickle")
+)
+
+# Chats that blocked the bot: reloaded from the database to pick up other instances' records
+BLOCKED_CHATS_RELOAD_INTERVAL = int(os.getenv("BLOCKED_CHATS_RELOAD_INTERVAL", 600))
+
 # --- Payment Details & Rates (Can be set in Railway's environment variables) ---
 TBANK_CARD_NUMBER = os.getenv("TBANK_CARD_NUMBER", "1234 5678 9012 3456")
 TBANK_CARD_HOLDER = os.getenv("TBANK_CARD_HOLDER", "Имя Фамилия")
@@ -47,7 +122,12 @@ REFERRAL_DISCOUNTS = {
     100: {"default_activations": 1, "description": "100% скидка (бесплатно)"},
 }
 
-# Admin IDs who can create referral codes (empty = any admin)
+# Bulk mode of /create_referral (e.g. `/create_referral 20 1 x500`)
+REFERRAL_BULK_MAX_CODES = int(os.getenv("REFERRAL_BULK_MAX_CODES", 1000))
+REFERRAL_BULK_BATCH_SIZE = int(os.getenv("REFERRAL_BULK_BATCH_SIZE", 500))
+
+# Admin IDs who can create referral codes (empty = any admin).
+# Broadcast and reminder report commands need this list; when it is empty they only work in TARGET_CHAT_ID
 REFERRAL_ADMIN_IDS = []
 if os.getenv("REFERRAL_ADMIN_IDS"):
     REFERRAL_ADMIN_IDS = [int(id.strip()) for id in os.getenv("REFERRAL_ADMIN_IDS").split(",")]
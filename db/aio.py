@@ -0,0 +1,172 @@
+# db/aio.py
+"""
+Async facade over the synchronous db modules.
+
+Handlers run on the single asyncio loop of python-telegram-bot, so psycopg2
+calls must not execute on it directly. Every public function of the db
+modules is exposed here as a coroutine function that runs the original call
+on a bounded thread pool sized to the connection pool.
+
+Usage:
+    from db.aio import bookings as db_bookings
+    booking = await db_bookings.get_active_booking_by_user(user.id)
+    async for chunk in db_broadcasts.iter_segment_recipients(segment, arg, after_user_id):
+        ...
+
+Several writes that must commit together share a unit of work:
+    async with db_aio.transaction() as session:
+        booking_id = await db_bookings.create_booking(..., session=session)
+        db_events.log_event(..., session=session)
+"""
+import asyncio
+import functools
+import inspect
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import config
+from db import base as _base
+from db import blocked_chats as _blocked_chats
+from db import broadcasts as _broadcasts
+from db import bookings as _bookings
+from db import events as _events
+from db import free_lessons as _free_lessons
+from db import referrals as _referrals
+from db import reminder_runs as _reminder_runs
+from db import scheduled_jobs as _scheduled_jobs
+
+logger = logging.getLogger(__name__)
+
+# More workers than pooled connections would only queue inside the pool
+_executor = ThreadPoolExecutor(max_workers=config.DB_POOL_MAX_SIZE, thread_name_prefix="db")
+
+async def run(func, *args, **kwargs):
+    """Runs a blocking db call on the db executor and awaits its result."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(func, *args, **kwargs))
+
+class AsyncSession:
+    """
+    Async unit of work around db.base.transaction().
+
+    The transaction holds one pooled connection for its whole lifetime, so
+    its calls run on a thread of its own rather than on the shared executor:
+    a session waiting for a free worker while every worker waits for a pooled
+    connection would never finish. For the same reason, db calls inside the
+    `async with` block should all pass the session: a call without it needs
+    a second pooled connection while the first one is held.
+    """
+
+    def __init__(self):
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-session")
+        self._scope = None
+        self.session = None
+
+    async def run(self, func, *args, **kwargs):
+        """Runs a blocking db call on the session's thread."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+
+    async def __aenter__(self):
+        self._scope = _base.transaction()
+        try:
+            self.session = await self.run(self._scope.__enter__)
+        except BaseException:
+            self._executor.shutdown(wait=False)
+            raise
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        try:
+            return await self.run(self._scope.__exit__, exc_type, exc, tb)
+        finally:
+            self._executor.shutdown(wait=False)
+
+def transaction():
+    """Opens an async unit of work: `async with db_aio.transaction() as session:`."""
+    return AsyncSession()
+
+def _unwrap_session(kwargs):
+    """Replaces an AsyncSession argument with its db.base.Session; returns the AsyncSession."""
+    async_session = kwargs.get('session')
+    if isinstance(async_session, AsyncSession):
+        kwargs['session'] = async_session.session
+        return async_session
+    return None
+
+_EXHAUSTED = object()
+
+def _make_async(func):
+    """Wraps a blocking function into a coroutine function that uses the db executor."""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        async_session = _unwrap_session(kwargs)
+        if async_session is not None:
+            return await async_session.run(func, *args, **kwargs)
+        return await run(func, *args, **kwargs)
+    return wrapper
+
+def _make_async_iter(func):
+    """Wraps a blocking generator into an async generator that pulls each item on the db executor."""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        async_session = _unwrap_session(kwargs)
+        runner = async_session.run if async_session is not None else run
+        generator = func(*args, **kwargs)
+        try:
+            while True:
+                item = await runner(next, generator, _EXHAUSTED)
+                if item is _EXHAUSTED:
+                    return
+                yield item
+        finally:
+            # Closing runs the generator's cleanup off the loop too
+            await runner(generator.close)
+    return wrapper
+
+def _make_passthrough(func):
+    """Keeps a non-blocking function synchronous, only translating its session argument."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        _unwrap_session(kwargs)
+        return func(*args, **kwargs)
+    return wrapper
+
+class _AsyncModule:
+    """
+    Mirrors a db module: its public functions become awaitable.
+
+    Generator functions become async generators (`async for chunk in ...`).
+    Names listed in `passthrough` never block on the database (pure helpers,
+    buffered writes) and are exposed unchanged, as are the module's
+    constants and classes.
+    """
+
+    def __init__(self, module, passthrough=()):
+        self.__name__ = module.__name__
+        for name, value in vars(module).items():
+            if name.startswith('_'):
+                continue
+            if inspect.isfunction(value) and value.__module__ == module.__name__:
+                if name in passthrough:
+                    setattr(self, name, _make_passthrough(value))
+                elif inspect.isgeneratorfunction(value):
+                    setattr(self, name, _make_async_iter(value))
+                else:
+                    setattr(self, name, _make_async(value))
+            elif name.isupper() or (inspect.isclass(value) and value.__module__ == module.__name__):
+                setattr(self, name, value)
+
+blocked_chats = _AsyncModule(_blocked_chats, passthrough=('is_blocked',))
+bookings = _AsyncModule(_bookings)
+broadcasts = _AsyncModule(_broadcasts)
+events = _AsyncModule(_events, passthrough=('log_event', 'shutdown_event_buffer'))
+free_lessons = _AsyncModule(_free_lessons, passthrough=('validate_email',))
+referrals = _AsyncModule(_referrals)
+reminder_runs = _AsyncModule(_reminder_runs)
+scheduled_jobs = _AsyncModule(_scheduled_jobs, passthrough=('job_group',))
+
+def shutdown():
+    """Waits for in-flight db calls and stops the executor."""
+    _executor.shutdown(wait=True)
+    logger.info("Database executor stopped")
@@ -1,195 +1,198 @@
 # db/base.py
 import logging
+import threading
+import time
+from contextlib import contextmanager
 import psycopg2
-from psycopg2.extras import DictCursor
+from psycopg2 import pool as pg_pool
 import config
 
 logger = logging.getLogger(__name__)
 
-def get_db_connection():
-    """Establishes a connection to the PostgreSQL database."""
-    try:
-        conn = psycopg2.connect(config.DATABASE_URL)
-        return conn
-    except psycopg2.OperationalError as e:
-        logger.critical(f"Could not connect to PostgreSQL database: {e}")
-        raise
+_pool = None
+_pool_lock = threading.Lock()
+# ThreadedConnectionPool raises instead of waiting when exhausted, so callers
+# queue on this semaphore for a free slot
+_pool_slots = None
+# id(conn) -> time.monotonic() of the last checkin, used to decide when to ping
+_last_used = {}
+# Set by close_pool: shutdown code must not reopen the pool through the lazy init in _checkout
+_closed = False
+
+def init_pool(minconn=None, maxconn=None):
+    """Creates the shared connection pool if it does not exist yet."""
+    global _pool, _pool_slots, _closed
+    with _pool_lock:
+        _closed = False
+        if _pool is not None:
+            return _pool
+        minconn = config.DB_POOL_MIN_SIZE if minconn is None else minconn
+        maxconn = config.DB_POOL_MAX_SIZE if maxconn is None else maxconn
+        try:
+            _pool = pg_pool.ThreadedConnectionPool(minconn, maxconn, config.DATABASE_URL)
+        except psycopg2.OperationalError as e:
+            logger.critical(f"Could not connect to PostgreSQL database: {e}")
+            raise
+        _pool_slots = threading.BoundedSemaphore(maxconn)
+        logger.info(f"Database connection pool ready (min={minconn}, max={maxconn})")
+        return _pool
+
+def close_pool():
+    """Closes every pooled connection. Safe to call more than once."""
+    global _pool, _closed
+    with _pool_lock:
+        _closed = True
+        if _pool is None:
+            return
+        _pool.closeall()
+        _pool = None
+        _last_used.clear()
+        logger.info("Database connection pool closed")
 
-def check_column_exists(cursor, table_name, column_name):
-    """Check if a column exists in a table."""
-    cursor.execute("""
-        SELECT column_name 
-        FROM information_schema.columns 
-        WHERE table_name = %s AND column_name = %s
-    """, (table_name, column_name))
-    return cursor.fetchone() is not None
-
-def run_migrations():
-    """Run database migrations for lesson types and course streams."""
-    conn = get_db_connection()
+def pool_closed():
+    """True after close_pool() until the pool is explicitly initialized again."""
+    return _closed
+
+def _is_healthy(conn):
+    """Cheap liveness check: closed flag first, SELECT 1 only for long-idle connections."""
+    if conn.closed:
+        return False
+    last_used = _last_used.get(id(conn))
+    # Freshly opened connections have never been checked in and need no ping
+    if last_used is None or time.monotonic() - last_used < config.DB_POOL_HEALTHCHECK_IDLE_SECONDS:
+        return True
     try:
-        with conn.cursor(cursor_factory=DictCursor) as cur:
-            logger.info("Running database migrations...")
-            
-            # Add lesson_type column to free_lesson_registrations
-            if not check_column_exists(cur, 'free_lesson_registrations', 'lesson_type'):
-                logger.info("Adding lesson_type column to free_lesson_registrations...")
-                cur.execute("""
-                    ALTER TABLE free_lesson_registrations 
-                    ADD COLUMN lesson_type VARCHAR(50) DEFAULT 'cursor_lesson'
-                """)
-                
-                # Update existing registrations to 'vibecoding_lesson'
-                cur.execute("""
-                    UPDATE free_lesson_registrations 
-                    SET lesson_type = 'vibecoding_lesson' 
-                    WHERE lesson_type = 'cursor_lesson'
-                """)
-                updated_count = cur.rowcount
-                logger.info(f"Added lesson_type column and updated {updated_count} existing registrations to 'vibecoding_lesson'")
-            
-            # Add course_stream column to bookings
-            if not check_column_exists(cur, 'bookings', 'course_stream'):
-                logger.info("Adding course_stream column to bookings...")
-                cur.execute("""
-                    ALTER TABLE bookings 
-                    ADD COLUMN course_stream VARCHAR(50) DEFAULT '4th_stream'
-                """)
-                
-                # Update existing bookings to '3rd_stream'
-                cur.execute("""
-                    UPDATE bookings 
-                    SET course_stream = '3rd_stream' 
-                    WHERE course_stream = '4th_stream'
-                """)
-                updated_bookings = cur.rowcount
-                logger.info(f"Added course_stream column and updated {updated_bookings} existing bookings to '3rd_stream'")
-            
-            # Migration: Change UNIQUE constraint from user_id to (user_id, lesson_type)
-            cur.execute("""
-                SELECT constraint_name 
-                FROM information_schema.table_constraints 
-                WHERE table_name = 'free_lesson_registrations' 
-                AND constraint_type = 'UNIQUE'
-                AND constraint_name LIKE '%user_id%'
-            """)
-            old_constraint = cur.fetchone()
-            
-            if old_constraint:
-                logger.info(f"Removing old UNIQUE constraint on user_id: {old_constraint['constraint_name']}")
-                cur.execute(f"""
-                    ALTER TABLE free_lesson_registrations 
-                    DROP CONSTRAINT {old_constraint['constraint_name']}
-                """)
-                logger.info("Old UNIQUE constraint removed")
-            
-            # Check if new composite constraint exists
-            cur.execute("""
-                SELECT 1 FROM pg_constraint 
-                WHERE conname = 'free_lesson_registrations_user_id_lesson_type_key'
-            """)
-            
-            if not cur.fetchone():
-                logger.info("Adding composite UNIQUE constraint (user_id, lesson_type)")
-                cur.execute("""
-                    ALTER TABLE free_lesson_registrations 
-                    ADD CONSTRAINT free_lesson_registrations_user_id_lesson_type_key 
-                    UNIQUE (user_id, lesson_type)
-                """)
-                logger.info("Composite UNIQUE constraint added successfully")
-            
-        conn.commit()
-        logger.info("Database migrations completed successfully!")
-        
-    except Exception as e:
-        logger.error(f"Error during migrations: {e}")
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1")
         conn.rollback()
+        return True
+    except psycopg2.Error as e:
+        logger.warning(f"Discarding broken pooled connection: {e}")
+        return False
+
+def _checkout():
+    """Takes a healthy connection from the pool, replacing broken ones."""
+    db_pool = _pool or init_pool()
+    slots = _pool_slots
+    if not slots.acquire(timeout=config.DB_POOL_CHECKOUT_TIMEOUT):
+        raise psycopg2.OperationalError("Timed out waiting for a free database connection")
+    try:
+        # One retry per pooled slot is enough to flush out every stale connection
+        for _ in range(config.DB_POOL_MAX_SIZE + 1):
+            conn = db_pool.getconn()
+            if _is_healthy(conn):
+                return conn
+            _last_used.pop(id(conn), None)
+            db_pool.putconn(conn, close=True)
+    except Exception:
+        slots.release()
         raise
-    finally:
+    slots.release()
+    raise psycopg2.OperationalError("Could not obtain a healthy database connection from the pool")
+
+def _checkin(conn, discard=False):
+    """Returns a connection to the pool, rolling back anything left open."""
+    db_pool, slots = _pool, _pool_slots
+    if db_pool is None:
         conn.close()
+        return
+    try:
+        _return_to_pool(db_pool, conn, discard)
+    finally:
+        slots.release()
 
-def setup_database():
-    """Ensures all required tables exist in the database."""
-    conn = get_db_connection()
+def _return_to_pool(db_pool, conn, discard):
+    """Puts a connection back, closing it instead if it is broken or discarded."""
+    if not discard and not conn.closed:
+        try:
+            if conn.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+        except psycopg2.Error:
+            discard = True
+    if discard or conn.closed:
+        _last_used.pop(id(conn), None)
+        db_pool.putconn(conn, close=True)
+        return
+    _last_used[id(conn)] = time.monotonic()
+    db_pool.putconn(conn)
+
+@contextmanager
+def get_connection():
+    """
+    Context manager that lends a pooled connection.
+
+    Callers commit explicitly; anything uncommitted is rolled back when the
+    block exits, and the connection is returned to the pool.
+    """
+    conn = _checkout()
+    discard = False
     try:
-        with conn.cursor() as cur:
-            # 1. Таблица бронирований
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS bookings (
-                    id SERIAL PRIMARY KEY,
-                    user_id BIGINT NOT NULL,
-                    username TEXT,
-                    first_name TEXT,
-                    course_id INTEGER REFERENCES courses(id),
-                    confirmed INTEGER DEFAULT 0,
-                    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
-                    referral_code TEXT,
-                    discount_percent INTEGER DEFAULT 0,
-                    course_stream VARCHAR(50) DEFAULT '4th_stream'
-                );
-            """)
-
-            # 3. Таблица реферальных купонов
-            cur.execute(f"""
-                CREATE TABLE IF NOT EXISTS {config.REFERRAL_TABLE_NAME} (
-                    id SERIAL PRIMARY KEY,
-                    code TEXT UNIQUE NOT NULL,
-                    name TEXT,
-                    discount_percent INTEGER NOT NULL,
-                    max_activations INTEGER NOT NULL,
-                    current_activations INTEGER DEFAULT 0,
-                    created_by BIGINT NOT NULL,
-                    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
-                    is_active INTEGER DEFAULT 1
-                );
-            """)
-
-            # 4. Таблица использования рефералов
-            cur.execute(f"""
-                CREATE TABLE IF NOT EXISTS {config.REFERRAL_USAGE_TABLE_NAME} (
-                    id SERIAL PRIMARY KEY,
-                    coupon_id INTEGER NOT NULL REFERENCES {config.REFERRAL_TABLE_NAME}(id),
-                    user_id BIGINT NOT NULL,
-                    booking_id INTEGER REFERENCES bookings(id),
-                    used_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
-                    UNIQUE(coupon_id, user_id)
-                );
-            """)
-
-            # 5. Таблица событий для статистики
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS events (
-                    id SERIAL PRIMARY KEY,
-                    user_id BIGINT NOT NULL,
-                    event_type VARCHAR(50) NOT NULL,
-                    details JSONB,
-                    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
-                );
-            """)
-
-            # 6. Таблица регистраций на бесплатный урок
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS free_lesson_registrations (
-                    id SERIAL PRIMARY KEY,
-                    user_id BIGINT NOT NULL,
-                    username TEXT,
-                    first_name TEXT,
-                    email TEXT NOT NULL,
-                    registered_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
-                    notification_sent BOOLEAN DEFAULT FALSE,
-                    lesson_type VARCHAR(50) DEFAULT 'cursor_lesson',
-                    UNIQUE(user_id, lesson_type)
-                );
-            """)
-
-        conn.commit()
-        logger.info("Database setup complete. All tables are verified.")
-    except Exception as e:
-        logger.error(f"Error during table creation/check: {e}")
-        conn.rollback()
+        yield conn
+    except psycopg2.OperationalError:
+        discard = True
+        raise
+    except Exception:
+        if not conn.closed:
+            conn.rollback()
         raise
     finally:
-        conn.close()
-    
-    # Run migrations after table setup
-    run_migrations()
\ No newline at end of file
+        _checkin(conn, discard=discard)
+
+class Session:
+    """
+    Unit of work: one pooled connection and one open transaction shared by
+    several db calls. Obtained from transaction(); db functions that accept a
+    `session` argument run on its connection and leave committing to it.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        # Writes queued by db modules (e.g. events) until just before commit
+        self.deferred = {}
+        self._before_commit = []
+
+    def before_commit(self, callback):
+        """Registers callback(session), called inside the transaction right before COMMIT."""
+        self._before_commit.append(callback)
+
+    def _commit(self):
+        callbacks, self._before_commit = self._before_commit, []
+        for callback in callbacks:
+            callback(self)
+        self.deferred.clear()
+        self.conn.commit()
+
+@contextmanager
+def transaction(session=None):
+    """
+    Opens a unit of work, or joins `session` if one is already open.
+
+    The outermost block commits everything on success and rolls everything
+    back on an exception; nested blocks neither commit nor roll back.
+
+        with transaction() as session:
+            booking_id = bookings.create_booking(..., session=session)
+            referrals.reserve_referral_activation(..., session=session)
+    """
+    if session is not None:
+        yield session
+        return
+    with get_connection() as conn:
+        session = Session(conn)
+        yield session
+        session._commit()
+
+@contextmanager
+def connection_scope(session=None):
+    """
+    Connection for a single db function: the session's connection if one is
+    given, otherwise a pooled connection committed when the block succeeds.
+    """
+    with transaction(session) as current:
+        yield current.conn
+
+def setup_database():
+    """Brings the schema up to date. A single query when no migrations are pending."""
+    # Imported here: migration modules themselves import db.base
+    from db.migrations import migrate
+    migrate()
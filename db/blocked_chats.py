@@ -0,0 +1,64 @@
+# db/blocked_chats.py
+"""
+Registry of chats the bot cannot deliver to (the user blocked the bot or
+deleted the account).
+
+A chat is recorded when a send fails with Forbidden and forgotten when the
+user writes to the bot again. Outbound paths check is_blocked(), which only
+reads an in-process set, and skip the Telegram call. The set is reloaded
+from the table periodically so chats recorded by other instances are
+picked up.
+"""
+import logging
+import threading
+
+from db.base import get_connection
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_blocked = set()
+
+def is_blocked(chat_id):
+    """True if sends to the chat are known to fail. Does not touch the database."""
+    return chat_id in _blocked
+
+def mark_blocked(chat_id, reason=None):
+    """Records a chat as undeliverable."""
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                INSERT INTO blocked_chats (chat_id, reason)
+                VALUES (%s, %s)
+                ON CONFLICT (chat_id) DO UPDATE SET
+                    reason = EXCLUDED.reason,
+                    blocked_at = CURRENT_TIMESTAMP
+            """, (chat_id, reason))
+            conn.commit()
+    with _lock:
+        _blocked.add(chat_id)
+    logger.info(f"Chat {chat_id} marked as blocked: {reason}")
+
+def clear_blocked(chat_id):
+    """Forgets a blocked chat, e.g. after an inbound update from it. Returns True if it was recorded."""
+    with _lock:
+        _blocked.discard(chat_id)
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("DELETE FROM blocked_chats WHERE chat_id = %s", (chat_id,))
+            cleared = cur.rowcount > 0
+            conn.commit()
+    if cleared:
+        logger.info(f"Chat {chat_id} is reachable again")
+    return cleared
+
+def reload_blocked_chats():
+    """Replaces the in-process set with the chats recorded in the database. Returns their number."""
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT chat_id FROM blocked_chats")
+            chat_ids = {row[0] for row in cur.fetchall()}
+    with _lock:
+        _blocked.clear()
+        _blocked.update(chat_ids)
+    return len(chat_ids)
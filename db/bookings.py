@@ -1,28 +1,49 @@
 # db/bookings.py
+import json
+from enum import Enum
 from psycopg2.extras import DictCursor
-from db.base import get_db_connection
-from db import events as db_events
+from db.base import get_connection, connection_scope
 
-def create_booking(user_id, username, first_name, course_id, referral_code, discount_percent, course_stream='4th_stream'):
+# Значения bookings.confirmed
+STATUS_PENDING = 0
+STATUS_PAYMENT_UPLOADED = 1
+STATUS_APPROVED = 2
+STATUS_CANCELLED = -1
+
+STATUS_NAMES = {
+    STATUS_PENDING: 'pending',
+    STATUS_PAYMENT_UPLOADED: 'payment_uploaded',
+    STATUS_APPROVED: 'approved',
+    STATUS_CANCELLED: 'cancelled'
+}
+
+# Target status -> statuses a booking may move to it from
+ALLOWED_TRANSITIONS = {
+    STATUS_PAYMENT_UPLOADED: (STATUS_PENDING,),
+    STATUS_APPROVED: (STATUS_PENDING, STATUS_PAYMENT_UPLOADED),
+    STATUS_CANCELLED: (STATUS_PENDING, STATUS_PAYMENT_UPLOADED),
+}
+
+class TransitionResult(Enum):
+    """Outcome of transition_booking_status."""
+    APPLIED = 'applied'    # status changed and the change was logged
+    ALREADY = 'already'    # booking was already in the target status, nothing written
+    INVALID = 'invalid'    # booking not found or its status does not allow the transition
+
+def create_booking(user_id, username, first_name, course_id, referral_code, discount_percent, course_stream='4th_stream', session=None):
     """Creates a new booking record with course stream tracking and returns the new booking ID."""
-    conn = get_db_connection()
-    try:
+    with connection_scope(session) as conn:
         with conn.cursor(cursor_factory=DictCursor) as cursor:
             cursor.execute(
                 """INSERT INTO bookings (user_id, username, first_name, course_id, referral_code, discount_percent, course_stream)
                    VALUES (%s, %s, %s, %s, %s, %s, %s) RETURNING id""",
                 (user_id, username, first_name, course_id, referral_code, discount_percent, course_stream)
             )
-            booking_id = cursor.fetchone()['id']
-            conn.commit()
-            return booking_id
-    finally:
-        conn.close()
+            return cursor.fetchone()['id']
 
 def get_pending_booking_by_user(user_id):
     """Retrieves the most recent pending booking for a user."""
-    conn = get_db_connection()
-    try:
+    with get_connection() as conn:
         with conn.cursor(cursor_factory=DictCursor) as cursor:
             cursor.execute("""
                 SELECT b.id, c.name as course_name, b.confirmed as status, 
@@ -33,13 +54,10 @@ def get_pending_booking_by_user(user_id):
                 ORDER BY b.created_at DESC LIMIT 1
             """, (user_id,))
             return cursor.fetchone()
-    finally:
-        conn.close()
 
 def get_active_booking_by_user(user_id):
     """Retrieves the most recent active booking (pending or approved) for a user."""
-    conn = get_db_connection()
-    try:
+    with get_connection() as conn:
         with conn.cursor(cursor_factory=DictCursor) as cursor:
             cursor.execute("""
                 SELECT b.id, b.course_id, b.confirmed as status, 
@@ -50,59 +68,91 @@ def get_active_booking_by_user(user_id):
                 ORDER BY b.created_at DESC LIMIT 1
             """, (user_id,))
             return cursor.fetchone()
-    finally:
-        conn.close()
 
-def update_booking_status(booking_id, status_code):
-    """Updates the 'confirmed' status of a specific booking."""
-    conn = get_db_connection()
-    try:
+def transition_booking_status(booking_id, new_status, expected=None, session=None):
+    """
+    Moves a booking to new_status if its current status allows it.
+
+    A single statement locks the row, applies the conditional UPDATE and
+    writes the booking_status_changed event in the same transaction, so a
+    repeated click cannot apply the same transition twice.
+
+    Args:
+        booking_id: ID of the booking
+        new_status: One of the STATUS_* values present in ALLOWED_TRANSITIONS
+        expected: Optional status the booking must currently have; defaults
+            to any status allowed by ALLOWED_TRANSITIONS
+        session: Optional unit of work (db.base.transaction) to run in
+
+    Returns:
+        (TransitionResult, booking) where booking is a dict with id, user_id,
+        username, first_name, course_id and status, or None if not found.
+    """
+    allowed = ALLOWED_TRANSITIONS[new_status]
+    if expected is not None:
+        if expected not in allowed:
+            raise ValueError(f"Transition {STATUS_NAMES.get(expected)} -> {STATUS_NAMES.get(new_status)} is not allowed")
+        allowed = (expected,)
+
+    with connection_scope(session) as conn:
         with conn.cursor(cursor_factory=DictCursor) as cursor:
-            # Получаем данные бронирования перед обновлением
-            cursor.execute(
-                "SELECT user_id, username, first_name, confirmed FROM bookings WHERE id = %s", 
-                (booking_id,)
-            )
-            booking_data = cursor.fetchone()
-            
-            if not booking_data:
-                return False
-                
-            old_status = booking_data['confirmed']
-            cursor.execute("UPDATE bookings SET confirmed = %s WHERE id = %s", (status_code, booking_id))
-            
-            if cursor.rowcount > 0:
-                # Логируем изменение статуса
-                status_names = {
-                    0: 'pending',
-                    1: 'payment_uploaded', 
-                    2: 'approved',
-                    -1: 'cancelled'
-                }
-                
-                db_events.log_event(
-                    booking_data['user_id'],
-                    'booking_status_changed',
-                    details={
-                        'booking_id': booking_id,
-                        'old_status': old_status,
-                        'new_status': status_code,
-                        'old_status_name': status_names.get(old_status, 'unknown'),
-                        'new_status_name': status_names.get(status_code, 'unknown')
-                    },
-                    username=booking_data['username'],
-                    first_name=booking_data['first_name']
+            cursor.execute("""
+                WITH current AS (
+                    SELECT id, user_id, username, first_name, course_id, confirmed
+                    FROM bookings
+                    WHERE id = %(booking_id)s
+                    FOR UPDATE
+                ), updated AS (
+                    UPDATE bookings b
+                    SET confirmed = %(new_status)s
+                    FROM current c
+                    WHERE b.id = c.id AND c.confirmed = ANY(%(allowed)s)
+                    RETURNING b.id, c.confirmed AS old_status
+                ), logged AS (
+                    INSERT INTO events (user_id, event_type, details)
+                    SELECT c.user_id, 'booking_status_changed', jsonb_strip_nulls(jsonb_build_object(
+                        'booking_id', c.id,
+                        'old_status', u.old_status,
+                        'new_status', %(new_status)s,
+                        'old_status_name', COALESCE(%(status_names)s::jsonb ->> u.old_status::text, 'unknown'),
+                        'new_status_name', COALESCE(%(status_names)s::jsonb ->> CAST(%(new_status)s AS text), 'unknown'),
+                        'username', NULLIF(c.username, ''),
+                        'first_name', NULLIF(c.first_name, '')
+                    ))
+                    FROM updated u JOIN current c ON c.id = u.id
                 )
-                
-            conn.commit()
-            return cursor.rowcount > 0
-    finally:
-        conn.close()
+                SELECT c.id, c.user_id, c.username, c.first_name, c.course_id, c.confirmed,
+                       u.id IS NOT NULL AS applied
+                FROM current c
+                LEFT JOIN updated u ON u.id = c.id
+            """, {
+                'booking_id': booking_id,
+                'new_status': new_status,
+                'allowed': list(allowed),
+                'status_names': json.dumps(STATUS_NAMES)
+            })
+            row = cursor.fetchone()
 
-def get_booking_details(booking_id):
+    if row is None:
+        return TransitionResult.INVALID, None
+
+    booking = {
+        'id': row['id'],
+        'user_id': row['user_id'],
+        'username': row['username'],
+        'first_name': row['first_name'],
+        'course_id': row['course_id'],
+        'status': new_status if row['applied'] else row['confirmed']
+    }
+    if row['applied']:
+        return TransitionResult.APPLIED, booking
+    if row['confirmed'] == new_status:
+        return TransitionResult.ALREADY, booking
+    return TransitionResult.INVALID, booking
+
+def get_booking_details(booking_id, session=None):
     """Retrieves details for a specific booking."""
-    conn = get_db_connection()
-    try:
+    with connection_scope(session) as conn:
         with conn.cursor(cursor_factory=DictCursor) as cursor:
             cursor.execute("""
                 SELECT b.course_id, b.user_id, b.username, b.first_name, b.confirmed, c.name as course_name
@@ -111,13 +161,10 @@ def get_booking_details(booking_id):
                 WHERE b.id = %s
             """, (booking_id,))
             return cursor.fetchone()
-    finally:
-        conn.close()
 
 def get_bookings_by_stream(course_stream):
     """Gets bookings filtered by course stream."""
-    conn = get_db_connection()
-    try:
+    with get_connection() as conn:
         with conn.cursor(cursor_factory=DictCursor) as cursor:
             cursor.execute("""
                 SELECT b.*, c.name as course_name
@@ -128,13 +175,10 @@ def get_bookings_by_stream(course_stream):
             """, (course_stream,))
             results = cursor.fetchall()
             return [dict(row) for row in results]
-    finally:
-        conn.close()
 
 def get_booking_stats_by_stream():
     """Gets booking statistics grouped by course stream."""
-    conn = get_db_connection()
-    try:
+    with get_connection() as conn:
         with conn.cursor(cursor_factory=DictCursor) as cursor:
             cursor.execute("""
                 SELECT 
@@ -150,13 +194,10 @@ def get_booking_stats_by_stream():
             """)
             results = cursor.fetchall()
             return [dict(row) for row in results]
-    finally:
-        conn.close()
 
 def get_all_bookings_with_stream():
     """Gets all bookings with course stream information for admin interface."""
-    conn = get_db_connection()
-    try:
+    with get_connection() as conn:
         with conn.cursor(cursor_factory=DictCursor) as cursor:
             cursor.execute("""
                 SELECT 
@@ -176,6 +217,4 @@ def get_all_bookings_with_stream():
                 ORDER BY b.created_at DESC
             """)
             results = cursor.fetchall()
-            return [dict(row) for row in results]
-    finally:
-        conn.close()
\ No newline at end of file
+            return [dict(row) for row in results]
\ No newline at end of file
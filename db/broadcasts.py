@@ -0,0 +1,184 @@
+# db/broadcasts.py
+"""
+Admin broadcasts to segments of users.
+
+A segment is a named SQL query over the existing tables returning user_id
+values. Recipients are read in user_id order, one keyset query per chunk,
+and the progress row keeps the last user_id handled, so a broadcast
+interrupted by a restart resumes right after it.
+"""
+import logging
+from collections import namedtuple
+from psycopg2.extras import DictCursor
+
+import config
+from db.base import get_connection, connection_scope
+from db import bookings
+
+logger = logging.getLogger(__name__)
+
+# Значения broadcasts.status
+STATUS_DRAFT = 'draft'
+STATUS_RUNNING = 'running'
+STATUS_DONE = 'done'
+STATUS_CANCELLED = 'cancelled'
+
+# query returns a user_id column and may use %(arg)s when arg_name is set
+Segment = namedtuple('Segment', 'description arg_name query')
+
+SEGMENTS = {
+    'cancelled_bookings': Segment(
+        "все, у кого есть отмененная бронь",
+        None,
+        f"SELECT user_id FROM bookings WHERE confirmed = {bookings.STATUS_CANCELLED}",
+    ),
+    'students': Segment(
+        "все с подтвержденной оплатой",
+        None,
+        f"SELECT user_id FROM bookings WHERE confirmed = {bookings.STATUS_APPROVED}",
+    ),
+    'lesson_registrants': Segment(
+        "все записавшиеся на урок",
+        'lesson_type',
+        "SELECT user_id FROM free_lesson_registrations WHERE lesson_type = %(arg)s",
+    ),
+    'lesson_no_booking': Segment(
+        "записавшиеся на урок, у которых нет ни одной брони",
+        'lesson_type',
+        """SELECT r.user_id FROM free_lesson_registrations r
+           WHERE r.lesson_type = %(arg)s
+             AND NOT EXISTS (SELECT 1 FROM bookings b WHERE b.user_id = r.user_id)""",
+    ),
+}
+
+def _segment(name):
+    segment = SEGMENTS.get(name)
+    if segment is None:
+        raise ValueError(f"Unknown segment '{name}'")
+    return segment
+
+def count_segment(segment_name, arg=None):
+    """Number of distinct users in a segment."""
+    segment = _segment(segment_name)
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(f"SELECT COUNT(DISTINCT user_id) FROM ({segment.query}) s", {'arg': arg})
+            return cur.fetchone()[0]
+
+def iter_segment_recipients(segment_name, arg=None, after_user_id=0, chunk_size=None):
+    """
+    Yields the distinct user_ids of a segment greater than `after_user_id`,
+    ascending, as lists of at most `chunk_size`. Each chunk is its own keyset
+    query on a connection that goes back to the pool before the chunk is
+    yielded, so a slow broadcast holds no connection between chunks.
+    """
+    segment = _segment(segment_name)
+    chunk_size = chunk_size or config.BROADCAST_CHUNK_SIZE
+    while True:
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(f"""
+                    SELECT DISTINCT user_id FROM ({segment.query}) s
+                    WHERE user_id > %(after)s
+                    ORDER BY user_id
+                    LIMIT %(limit)s
+                """, {'arg': arg, 'after': after_user_id, 'limit': chunk_size})
+                chunk = [row[0] for row in cur.fetchall()]
+        if not chunk:
+            break
+        yield chunk
+        if len(chunk) < chunk_size:
+            break
+        after_user_id = chunk[-1]
+
+def create_broadcast(segment_name, arg, source_chat_id, source_message_id, created_by, session=None):
+    """Creates a draft broadcast of a copied message with its recipient count; returns the broadcast dict."""
+    total = count_segment(segment_name, arg)
+    with connection_scope(session) as conn:
+        with conn.cursor(cursor_factory=DictCursor) as cur:
+            cur.execute("""
+                INSERT INTO broadcasts (segment, segment_arg, source_chat_id, source_message_id,
+                                        created_by, total_recipients)
+                VALUES (%s, %s, %s, %s, %s, %s)
+                RETURNING *
+            """, (segment_name, arg, source_chat_id, source_message_id, created_by, total))
+            broadcast = dict(cur.fetchone())
+            cur.execute("INSERT INTO broadcast_progress (broadcast_id) VALUES (%s)", (broadcast['id'],))
+            return broadcast
+
+def get_broadcast(broadcast_id):
+    """Returns a broadcast joined with its progress, or None."""
+    with get_connection() as conn:
+        with conn.cursor(cursor_factory=DictCursor) as cur:
+            cur.execute("""
+                SELECT b.*, p.last_user_id, p.sent, p.failed, p.skipped, p.report_message_id, p.updated_at
+                FROM broadcasts b
+                JOIN broadcast_progress p ON p.broadcast_id = b.id
+                WHERE b.id = %s
+            """, (broadcast_id,))
+            row = cur.fetchone()
+            return dict(row) if row else None
+
+def get_recent_broadcasts(limit=10):
+    """Latest broadcasts with their progress, newest first."""
+    with get_connection() as conn:
+        with conn.cursor(cursor_factory=DictCursor) as cur:
+            cur.execute("""
+                SELECT b.*, p.sent, p.failed, p.skipped
+                FROM broadcasts b
+                JOIN broadcast_progress p ON p.broadcast_id = b.id
+                ORDER BY b.id DESC
+                LIMIT %s
+            """, (limit,))
+            return [dict(row) for row in cur.fetchall()]
+
+def set_broadcast_status(broadcast_id, new_status, expected):
+    """
+    Moves a broadcast to `new_status` if its status is one of `expected`.
+    Returns True if it changed.
+    """
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                UPDATE broadcasts
+                SET status = %s,
+                    started_at = CASE WHEN %s = 'running' THEN COALESCE(started_at, CURRENT_TIMESTAMP) ELSE started_at END,
+                    finished_at = CASE WHEN %s IN ('done', 'cancelled') THEN CURRENT_TIMESTAMP ELSE finished_at END
+                WHERE id = %s AND status = ANY(%s)
+            """, (new_status, new_status, new_status, broadcast_id, list(expected)))
+            changed = cur.rowcount > 0
+            conn.commit()
+            return changed
+
+def save_progress(broadcast_id, last_user_id, sent, failed, skipped):
+    """
+    Checkpoints a handled chunk: moves last_user_id forward and adds the
+    chunk's counters. Returns the broadcast's current status, so a runner
+    notices a cancellation.
+    """
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                WITH progress AS (
+                    UPDATE broadcast_progress
+                    SET last_user_id = GREATEST(last_user_id, %s),
+                        sent = sent + %s, failed = failed + %s, skipped = skipped + %s,
+                        updated_at = CURRENT_TIMESTAMP
+                    WHERE broadcast_id = %s
+                    RETURNING broadcast_id
+                )
+                SELECT b.status FROM broadcasts b JOIN progress ON progress.broadcast_id = b.id
+            """, (last_user_id, sent, failed, skipped, broadcast_id))
+            row = cur.fetchone()
+            conn.commit()
+            return row[0] if row else None
+
+def set_report_message(broadcast_id, message_id):
+    """Remembers the admin chat message that shows the broadcast's progress."""
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                "UPDATE broadcast_progress SET report_message_id = %s WHERE broadcast_id = %s",
+                (message_id, broadcast_id)
+            )
+            conn.commit()
@@ -0,0 +1,82 @@
+# db/coupon_cache.py
+"""
+In-process TTL cache in front of referral coupon lookups.
+
+Entries are keyed by code and hold the coupon row together with the ids of
+the users who already used it, or a negative entry for a code that does not
+exist. A flood of /start deep links then costs at most one query per code
+per COUPON_CACHE_TTL, whether the code exists or not; codes created by other
+instances or by hand are seen as soon as their negative entry expires.
+
+The cache only serves the /start preview. Activations are always taken by
+reserve_referral_activation, which invalidates the coupon's entry.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+import config
+
+logger = logging.getLogger(__name__)
+
+# Marker for "code does not exist" entries
+MISSING = object()
+
+_lock = threading.Lock()
+# code -> (expires_at, coupon dict or MISSING), oldest first
+_entries = OrderedDict()
+# coupon id -> code, to invalidate by id after a reservation
+_codes_by_id = {}
+
+def get(code):
+    """Returns the cached coupon dict, MISSING, or None when nothing fresh is cached."""
+    with _lock:
+        entry = _entries.get(code)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            _drop(code)
+            return None
+        return value
+
+def put(code, coupon):
+    """
+    Caches a coupon dict for `code` (with `used_by`, the ids of users who
+    already used it), or a negative entry when coupon is None.
+    """
+    value = MISSING if coupon is None else dict(coupon)
+    with _lock:
+        _drop(code)
+        _entries[code] = (time.monotonic() + config.COUPON_CACHE_TTL, value)
+        if value is not MISSING:
+            _codes_by_id[value['id']] = code
+        while len(_entries) > config.COUPON_CACHE_MAX_ENTRIES:
+            _drop(next(iter(_entries)))
+
+def invalidate(coupon_id):
+    """Drops the cached entry of a coupon, e.g. after its activations changed."""
+    with _lock:
+        code = _codes_by_id.get(coupon_id)
+        if code is not None:
+            _drop(code)
+
+def add_codes(codes):
+    """Registers newly created codes: they lose any negative entry."""
+    with _lock:
+        for code in codes:
+            entry = _entries.get(code)
+            if entry is not None and entry[1] is MISSING:
+                _drop(code)
+
+def clear():
+    """Forgets all cached coupons."""
+    with _lock:
+        _entries.clear()
+        _codes_by_id.clear()
+
+def _drop(code):
+    entry = _entries.pop(code, None)
+    if entry is not None and entry[1] is not MISSING:
+        _codes_by_id.pop(entry[1]['id'], None)
@@ -1,41 +1,183 @@
 # db/events.py
+import atexit
 import logging
 import json
-from psycopg2.extras import DictCursor
-from db.base import get_db_connection
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+from psycopg2.extras import DictCursor, execute_values
+from db.base import get_connection, pool_closed
+import config
 
 logger = logging.getLogger(__name__)
 
-def log_event(user_id, event_type, details=None, username=None, first_name=None):
-    """Logs a user event to the events table for statistics."""
-    conn = get_db_connection()
-    try:
-        with conn.cursor() as cursor:
-            # Создаем details словарь если его нет
-            if details is None:
-                details = {}
-            
-            # Добавляем username и first_name если они переданы
-            if username:
-                details['username'] = username
-            if first_name:
-                details['first_name'] = first_name
-            
-            details_json = json.dumps(details) if details else None
-            cursor.execute(
-                "INSERT INTO events (user_id, event_type, details) VALUES (%s, %s, %s)",
-                (user_id, event_type, details_json)
-            )
-        conn.commit()
-    except Exception as e:
-        logger.error(f"Failed to log event {event_type} for user {user_id}: {e}")
-    finally:
-        conn.close()
+class EventBuffer:
+    """
+    Bounded in-process queue of events, written to the events table in bulk.
+
+    Producers only append to the queue. A background thread flushes a batch
+    with one multi-row INSERT when it reaches batch_size rows or when the
+    oldest queued event has waited flush_interval seconds. put() never blocks:
+    producers run on the event loop thread, so when the queue is full the event
+    is dropped and counted, and memory stays bounded even if the database stalls.
+    """
+
+    def __init__(self, max_size, batch_size, flush_interval):
+        self._queue = queue.Queue(maxsize=max_size)
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._stop = threading.Event()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self.dropped = 0
+
+    def put(self, row):
+        """Queues one (user_id, event_type, details_json, created_at) row. Returns False if dropped."""
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(row)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            # Во время всплеска не пишем строку лога на каждое событие
+            if self.dropped % 1000 == 1:
+                logger.warning(f"Event buffer full, dropped {row[1]} event for user {row[0]} (dropped so far: {self.dropped})")
+            return False
+
+    def stop(self, timeout=10):
+        """Stops the writer thread after flushing everything still queued."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        # Events queued after the thread exited (or if it never started)
+        self._drain()
+
+    def _ensure_started(self):
+        if self._thread is not None or self._stop.is_set():
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="event-buffer", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch:
+                self._write(batch)
+            elif self._stop.is_set():
+                return
+
+    def _next_batch(self):
+        try:
+            first = self._queue.get(timeout=self._flush_interval)
+        except queue.Empty:
+            return []
+        batch = [first]
+        deadline = time.monotonic() + self._flush_interval
+        while len(batch) < self._batch_size:
+            remaining = 0 if self._stop.is_set() else deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _drain(self):
+        if pool_closed():
+            # Выход после закрытия пула: не открываем новый ради остатка очереди
+            dropped = 0
+            while True:
+                try:
+                    self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                dropped += 1
+            if dropped:
+                self.dropped += dropped
+                logger.warning(f"Database pool is closed, dropped {dropped} queued events")
+            return
+        while True:
+            batch = []
+            while len(batch) < self._batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if not batch:
+                return
+            self._write(batch)
+
+    def _write(self, batch):
+        try:
+            with get_connection() as conn:
+                _insert_events(conn, batch)
+                conn.commit()
+        except Exception as e:
+            logger.error(f"Failed to write {len(batch)} buffered events: {e}")
+
+def _insert_events(conn, rows):
+    """Writes (user_id, event_type, details_json, created_at) rows with one multi-row INSERT."""
+    with conn.cursor() as cursor:
+        execute_values(
+            cursor,
+            "INSERT INTO events (user_id, event_type, details, created_at) VALUES %s",
+            rows,
+            page_size=len(rows)
+        )
+
+def _session_events(session):
+    """Event rows queued on a unit of work, written in its transaction right before COMMIT."""
+    rows = session.deferred.get('events')
+    if rows is None:
+        rows = session.deferred['events'] = []
+        session.before_commit(lambda s: _insert_events(s.conn, rows))
+    return rows
+
+_buffer = EventBuffer(
+    max_size=config.EVENT_BUFFER_MAX_SIZE,
+    batch_size=config.EVENT_BUFFER_BATCH_SIZE,
+    flush_interval=config.EVENT_BUFFER_FLUSH_INTERVAL,
+)
+
+def shutdown_event_buffer():
+    """
+    Flushes queued events to the database. Called on bot shutdown before
+    close_pool() and again at exit, where events queued after the pool was
+    closed are dropped.
+    """
+    _buffer.stop()
+
+atexit.register(shutdown_event_buffer)
+
+def log_event(user_id, event_type, details=None, username=None, first_name=None, session=None):
+    """
+    Queues a user event for the events table; the write happens in the background.
+
+    With a session the event is written in that unit of work's transaction
+    instead, so it is committed (or rolled back) together with its writes.
+    """
+    # Создаем details словарь если его нет
+    if details is None:
+        details = {}
+
+    # Добавляем username и first_name если они переданы
+    if username:
+        details['username'] = username
+    if first_name:
+        details['first_name'] = first_name
+
+    details_json = json.dumps(details) if details else None
+    row = (user_id, event_type, details_json, datetime.now(timezone.utc))
+    if session is not None:
+        _session_events(session).append(row)
+    else:
+        _buffer.put(row)
 
 def get_stats_summary():
     """Retrieves a summary of statistics for the /stats command."""
-    conn = get_db_connection()
-    try:
+    with get_connection() as conn:
         with conn.cursor(cursor_factory=DictCursor) as cursor:
             # Уникальные пользователи за сегодня
             cursor.execute("""
@@ -74,6 +216,4 @@ def get_stats_summary():
                 "users_week": users_week,
                 "bookings_today": bookings_today,
                 "confirmed_week": confirmed_week
-            }
-    finally:
-        conn.close()
\ No newline at end of file
+            }
\ No newline at end of file
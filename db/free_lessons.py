@@ -2,7 +2,7 @@
 import logging
 import re
 from psycopg2.extras import DictCursor
-from db.base import get_db_connection
+from db.base import get_connection, connection_scope
 from utils.lessons import get_all_lesson_types
 
 logger = logging.getLogger(__name__)
@@ -12,8 +12,12 @@ def validate_email(email):
     pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
     return re.match(pattern, email) is not None
 
-def create_free_lesson_registration(user_id, username, first_name, email, lesson_type='cursor_lesson', lesson_date=None):
-    """Creates a new free lesson registration with lesson type and date."""
+def create_free_lesson_registration(user_id, username, first_name, email, lesson_type='cursor_lesson', lesson_date=None, session=None):
+    """
+    Creates a new free lesson registration with lesson type and date.
+    Registering again for the same date refreshes the row and forgets the
+    reminder stages already delivered to it, so they are sent again.
+    """
     if not validate_email(email):
         logger.warning(f"Invalid email format: {email}")
         return False
@@ -24,185 +28,268 @@ def create_free_lesson_registration(user_id, username, first_name, email, lesson
         logger.warning(f"Invalid lesson_type: {lesson_type}. Using default 'cursor_lesson'")
         lesson_type = 'cursor_lesson'
     
-    conn = get_db_connection()
     try:
-        with conn.cursor(cursor_factory=DictCursor) as cur:
-            cur.execute("""
-                INSERT INTO free_lesson_registrations (user_id, username, first_name, email, lesson_type, lesson_date)
-                VALUES (%s, %s, %s, %s, %s, %s)
-                ON CONFLICT (user_id, lesson_type, lesson_date) DO UPDATE SET
-                    username = EXCLUDED.username,
-                    first_name = EXCLUDED.first_name,
-                    email = EXCLUDED.email,
-                    registered_at = CURRENT_TIMESTAMP,
-                    notification_sent = FALSE
-                RETURNING id;
-            """, (user_id, username, first_name, email, lesson_type, lesson_date))
+        with connection_scope(session) as conn:
+            with conn.cursor(cursor_factory=DictCursor) as cur:
+                cur.execute("""
+                    INSERT INTO free_lesson_registrations (user_id, username, first_name, email, lesson_type, lesson_date)
+                    VALUES (%s, %s, %s, %s, %s, %s)
+                    ON CONFLICT (user_id, lesson_type, lesson_date) DO UPDATE SET
+                        username = EXCLUDED.username,
+                        first_name = EXCLUDED.first_name,
+                        email = EXCLUDED.email,
+                        registered_at = CURRENT_TIMESTAMP,
+                        notification_sent = FALSE
+                    RETURNING id;
+                """, (user_id, username, first_name, email, lesson_type, lesson_date))
             
-            registration_id = cur.fetchone()['id']
-            conn.commit()
-            logger.info(f"Free lesson registration created/updated for user {user_id}, lesson_type: {lesson_type}, lesson_date: {lesson_date}, registration ID: {registration_id}")
-            return registration_id
+                registration_id = cur.fetchone()['id']
+                # Повторная запись начинает напоминания заново, как и notification_sent
+                cur.execute(
+                    "DELETE FROM lesson_reminder_deliveries WHERE registration_id = %s",
+                    (registration_id,)
+                )
+                logger.info(f"Free lesson registration created/updated for user {user_id}, lesson_type: {lesson_type}, lesson_date: {lesson_date}, registration ID: {registration_id}")
+                return registration_id
     except Exception as e:
+        if session is not None:
+            raise
         logger.error(f"Error creating free lesson registration: {e}")
-        conn.rollback()
         return False
-    finally:
-        conn.close()
 
 def get_registration_by_user(user_id):
     """Gets free lesson registration by user ID."""
-    conn = get_db_connection()
     try:
-        with conn.cursor(cursor_factory=DictCursor) as cur:
-            cur.execute("""
-                SELECT * FROM free_lesson_registrations 
-                WHERE user_id = %s
-            """, (user_id,))
+        with get_connection() as conn:
+            with conn.cursor(cursor_factory=DictCursor) as cur:
+                cur.execute("""
+                    SELECT * FROM free_lesson_registrations 
+                    WHERE user_id = %s
+                """, (user_id,))
             
-            result = cur.fetchone()
-            return dict(result) if result else None
+                result = cur.fetchone()
+                return dict(result) if result else None
     except Exception as e:
         logger.error(f"Error getting free lesson registration for user {user_id}: {e}")
         return None
-    finally:
-        conn.close()
 
 def is_user_registered(user_id):
     """Checks if user is already registered for free lesson."""
     registration = get_registration_by_user(user_id)
     return registration is not None
 
-def get_all_registrations_for_notification():
-    """Gets all registrations that haven't received notification yet."""
-    conn = get_db_connection()
-    try:
+def claim_pending_reminders(lesson_type, lesson_date, stage, owner, limit, lease_seconds, user_ids=None):
+    """
+    Claims up to `limit` registrations of a lesson date that have not got
+    the reminder `stage` yet, for `owner`; with `user_ids` only those users'
+    registrations.
+
+    A claim is a lesson_reminder_deliveries row without sent_at; rows with
+    failed_at (see mark_reminders_failed) are never claimed again. FOR UPDATE
+    SKIP LOCKED lets several bot instances claim at the same time without
+    blocking on or sharing registrations; claims of someone else younger
+    than `lease_seconds` are skipped. The claim is committed right away, so
+    it holds across the Telegram calls that follow.
+    """
+    date_filter = "AND r.lesson_date = %(lesson_date)s" if lesson_date is not None else ""
+    user_filter = "AND r.user_id = ANY(%(user_ids)s)" if user_ids is not None else ""
+    with get_connection() as conn:
+        with conn.cursor(cursor_factory=DictCursor) as cur:
+            cur.execute(f"""
+                WITH claimable AS (
+                    SELECT r.id FROM free_lesson_registrations r
+                    LEFT JOIN lesson_reminder_deliveries d
+                        ON d.registration_id = r.id AND d.stage = %(stage)s
+                    WHERE r.lesson_type = %(lesson_type)s
+                      {date_filter}
+                      {user_filter}
+                      AND (d.registration_id IS NULL
+                           OR (d.sent_at IS NULL AND d.failed_at IS NULL
+                               AND d.claimed_at < CURRENT_TIMESTAMP - %(lease)s * INTERVAL '1 second'))
+                    ORDER BY r.registered_at
+                    LIMIT %(limit)s
+                    FOR UPDATE OF r SKIP LOCKED
+                ), claimed AS (
+                    INSERT INTO lesson_reminder_deliveries (registration_id, stage, claimed_by, claimed_at)
+                    SELECT id, %(stage)s, %(owner)s, CURRENT_TIMESTAMP FROM claimable
+                    ON CONFLICT (registration_id, stage) DO UPDATE SET
+                        claimed_by = EXCLUDED.claimed_by,
+                        claimed_at = EXCLUDED.claimed_at
+                    WHERE lesson_reminder_deliveries.sent_at IS NULL
+                      AND lesson_reminder_deliveries.failed_at IS NULL
+                      AND lesson_reminder_deliveries.claimed_at < CURRENT_TIMESTAMP - %(lease)s * INTERVAL '1 second'
+                    RETURNING registration_id
+                )
+                SELECT r.id, r.user_id, r.username, r.first_name, r.registered_at
+                FROM claimed
+                JOIN free_lesson_registrations r ON r.id = claimed.registration_id
+                ORDER BY r.registered_at
+            """, {'owner': owner, 'lesson_type': lesson_type, 'lesson_date': lesson_date,
+                  'stage': stage, 'lease': lease_seconds, 'limit': limit,
+                  'user_ids': list(user_ids) if user_ids is not None else None})
+            claimed = [dict(row) for row in cur.fetchall()]
+            conn.commit()
+    return claimed
+
+def count_reminder_recipients(lesson_type, lesson_date, stage):
+    """
+    Counts the registrations of a lesson date that have not got the reminder
+    `stage` yet (nor failed for good), and how many of them are chats known
+    to have blocked the bot.
+
+    Returns:
+        dict with recipients and blocked
+    """
+    with get_connection() as conn:
         with conn.cursor(cursor_factory=DictCursor) as cur:
             cur.execute("""
-                SELECT * FROM free_lesson_registrations 
-                WHERE notification_sent = FALSE
-                ORDER BY registered_at ASC
-            """)
-            
-            results = cur.fetchall()
-            return [dict(row) for row in results]
-    except Exception as e:
-        logger.error(f"Error getting registrations for notification: {e}")
-        return []
-    finally:
-        conn.close()
+                SELECT COUNT(*) AS recipients, COUNT(b.chat_id) AS blocked
+                FROM free_lesson_registrations r
+                LEFT JOIN blocked_chats b ON b.chat_id = r.user_id
+                WHERE r.lesson_type = %(lesson_type)s
+                  AND r.lesson_date = %(lesson_date)s
+                  AND NOT EXISTS (
+                      SELECT 1 FROM lesson_reminder_deliveries d
+                      WHERE d.registration_id = r.id AND d.stage = %(stage)s
+                        AND (d.sent_at IS NOT NULL OR d.failed_at IS NOT NULL)
+                  )
+            """, {'lesson_type': lesson_type, 'lesson_date': lesson_date, 'stage': stage})
+            return dict(cur.fetchone())
 
-def mark_notification_sent(registration_id):
-    """Marks notification as sent for a registration."""
-    conn = get_db_connection()
-    try:
+def mark_reminders_sent(stage, registration_ids, session=None):
+    """
+    Records the reminder `stage` as delivered for several registrations.
+    notification_sent keeps meaning "got at least one reminder" for the stats.
+    Returns the number of deliveries recorded.
+    """
+    if not registration_ids:
+        return 0
+    registration_ids = list(registration_ids)
+    with connection_scope(session) as conn:
         with conn.cursor() as cur:
             cur.execute("""
-                UPDATE free_lesson_registrations 
-                SET notification_sent = TRUE 
-                WHERE id = %s
-            """, (registration_id,))
-            
+                UPDATE lesson_reminder_deliveries
+                SET sent_at = CURRENT_TIMESTAMP
+                WHERE stage = %s AND registration_id = ANY(%s)
+            """, (stage, registration_ids))
+            recorded = cur.rowcount
+            cur.execute("""
+                UPDATE free_lesson_registrations
+                SET notification_sent = TRUE
+                WHERE id = ANY(%s) AND notification_sent = FALSE
+            """, (registration_ids,))
+            return recorded
+
+def mark_reminders_failed(stage, registration_ids):
+    """
+    Records the reminder `stage` as failed for good for claimed registrations
+    that were not delivered (blocked chat, rejected message, retries used up),
+    so later claims skip them. Returns the number of failures recorded.
+    """
+    if not registration_ids:
+        return 0
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                UPDATE lesson_reminder_deliveries
+                SET failed_at = CURRENT_TIMESTAMP
+                WHERE stage = %s AND registration_id = ANY(%s) AND sent_at IS NULL
+            """, (stage, list(registration_ids)))
+            failed = cur.rowcount
             conn.commit()
-            logger.info(f"Marked notification as sent for registration {registration_id}")
-            return True
-    except Exception as e:
-        logger.error(f"Error marking notification as sent for registration {registration_id}: {e}")
-        conn.rollback()
-        return False
-    finally:
-        conn.close()
+            return failed
+
+def move_lesson_date(lesson_type, old_date, new_date):
+    """
+    Moves the registrations of a lesson date to the lesson's new date (the
+    lesson was moved in the catalog) and forgets the reminder stages already
+    delivered for the old date, so the new date's reminders reach them.
+    Users already registered for the new date keep only that registration.
+    Returns the number of registrations moved.
+    """
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                WITH moved AS (
+                    UPDATE free_lesson_registrations r
+                    SET lesson_date = %(new_date)s
+                    WHERE r.lesson_type = %(lesson_type)s AND r.lesson_date = %(old_date)s
+                      AND NOT EXISTS (
+                          SELECT 1 FROM free_lesson_registrations o
+                          WHERE o.user_id = r.user_id AND o.lesson_type = r.lesson_type
+                            AND o.lesson_date = %(new_date)s
+                      )
+                    RETURNING r.id
+                ), cleared AS (
+                    DELETE FROM lesson_reminder_deliveries
+                    WHERE registration_id IN (SELECT id FROM moved)
+                )
+                SELECT COUNT(*) FROM moved
+            """, {'lesson_type': lesson_type, 'old_date': old_date, 'new_date': new_date})
+            moved = cur.fetchone()[0]
+            conn.commit()
+            return moved
 
 def get_registration_count():
     """Gets total count of free lesson registrations."""
-    conn = get_db_connection()
     try:
-        with conn.cursor() as cur:
-            cur.execute("SELECT COUNT(*) FROM free_lesson_registrations")
-            count = cur.fetchone()[0]
-            return count
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT COUNT(*) FROM free_lesson_registrations")
+                count = cur.fetchone()[0]
+                return count
     except Exception as e:
         logger.error(f"Error getting registration count: {e}")
         return 0
-    finally:
-        conn.close()
-
-def get_registrations_by_type(lesson_type):
-    """Gets registrations filtered by lesson type."""
-    valid_lesson_types = get_all_lesson_types()
-    if lesson_type not in valid_lesson_types:
-        logger.warning(f"Invalid lesson_type: {lesson_type}")
-        return []
-    
-    conn = get_db_connection()
-    try:
-        with conn.cursor(cursor_factory=DictCursor) as cur:
-            cur.execute("""
-                SELECT * FROM free_lesson_registrations 
-                WHERE lesson_type = %s
-                ORDER BY registered_at ASC
-            """, (lesson_type,))
-            
-            results = cur.fetchall()
-            return [dict(row) for row in results]
-    except Exception as e:
-        logger.error(f"Error getting registrations by type {lesson_type}: {e}")
-        return []
-    finally:
-        conn.close()
 
 def get_registration_stats():
     """Gets registration statistics grouped by lesson type and date."""
-    conn = get_db_connection()
     try:
-        with conn.cursor(cursor_factory=DictCursor) as cur:
-            cur.execute("""
-                SELECT 
-                    lesson_type,
-                    lesson_date,
-                    COUNT(*) as total_registrations,
-                    COUNT(CASE WHEN notification_sent = TRUE THEN 1 END) as notifications_sent,
-                    COUNT(CASE WHEN notification_sent = FALSE THEN 1 END) as pending_notifications
-                FROM free_lesson_registrations 
-                GROUP BY lesson_type, lesson_date
-                ORDER BY lesson_type, lesson_date
-            """)
+        with get_connection() as conn:
+            with conn.cursor(cursor_factory=DictCursor) as cur:
+                cur.execute("""
+                    SELECT 
+                        lesson_type,
+                        lesson_date,
+                        COUNT(*) as total_registrations,
+                        COUNT(CASE WHEN notification_sent = TRUE THEN 1 END) as notifications_sent,
+                        COUNT(CASE WHEN notification_sent = FALSE THEN 1 END) as pending_notifications
+                    FROM free_lesson_registrations 
+                    GROUP BY lesson_type, lesson_date
+                    ORDER BY lesson_type, lesson_date
+                """)
             
-            results = cur.fetchall()
-            return [dict(row) for row in results]
+                results = cur.fetchall()
+                return [dict(row) for row in results]
     except Exception as e:
         logger.error(f"Error getting registration statistics: {e}")
         return []
-    finally:
-        conn.close()
 
 def get_all_registrations_with_type():
     """Gets all registrations with lesson type information for admin interface."""
-    conn = get_db_connection()
     try:
-        with conn.cursor(cursor_factory=DictCursor) as cur:
-            cur.execute("""
-                SELECT 
-                    id,
-                    user_id,
-                    username,
-                    first_name,
-                    email,
-                    lesson_type,
-                    lesson_date,
-                    registered_at,
-                    notification_sent
-                FROM free_lesson_registrations 
-                ORDER BY registered_at DESC
-            """)
+        with get_connection() as conn:
+            with conn.cursor(cursor_factory=DictCursor) as cur:
+                cur.execute("""
+                    SELECT 
+                        id,
+                        user_id,
+                        username,
+                        first_name,
+                        email,
+                        lesson_type,
+                        lesson_date,
+                        registered_at,
+                        notification_sent
+                    FROM free_lesson_registrations 
+                    ORDER BY registered_at DESC
+                """)
             
-            results = cur.fetchall()
-            return [dict(row) for row in results]
+                results = cur.fetchall()
+                return [dict(row) for row in results]
     except Exception as e:
         logger.error(f"Error getting all registrations with type: {e}")
         return []
-    finally:
-        conn.close()
 
 def is_user_registered_for_lesson_type(user_id, lesson_type='cursor_lesson'):
     """Checks if user is registered for specific lesson type."""
@@ -211,21 +298,19 @@ def is_user_registered_for_lesson_type(user_id, lesson_type='cursor_lesson'):
         logger.warning(f"Invalid lesson_type: {lesson_type}")
         return False
     
-    conn = get_db_connection()
     try:
-        with conn.cursor(cursor_factory=DictCursor) as cur:
-            cur.execute("""
-                SELECT id FROM free_lesson_registrations 
-                WHERE user_id = %s AND lesson_type = %s
-            """, (user_id, lesson_type))
+        with get_connection() as conn:
+            with conn.cursor(cursor_factory=DictCursor) as cur:
+                cur.execute("""
+                    SELECT id FROM free_lesson_registrations 
+                    WHERE user_id = %s AND lesson_type = %s
+                """, (user_id, lesson_type))
             
-            result = cur.fetchone()
-            return result is not None
+                result = cur.fetchone()
+                return result is not None
     except Exception as e:
         logger.error(f"Error checking registration for user {user_id} and lesson type {lesson_type}: {e}")
         return False
-    finally:
-        conn.close()
 
 def get_registration_by_user_and_type(user_id, lesson_type='cursor_lesson'):
     """Gets free lesson registration by user ID and lesson type."""
@@ -234,21 +319,19 @@ def get_registration_by_user_and_type(user_id, lesson_type='cursor_lesson'):
         logger.warning(f"Invalid lesson_type: {lesson_type}")
         return None
     
-    conn = get_db_connection()
     try:
-        with conn.cursor(cursor_factory=DictCursor) as cur:
-            cur.execute("""
-                SELECT * FROM free_lesson_registrations 
-                WHERE user_id = %s AND lesson_type = %s
-            """, (user_id, lesson_type))
+        with get_connection() as conn:
+            with conn.cursor(cursor_factory=DictCursor) as cur:
+                cur.execute("""
+                    SELECT * FROM free_lesson_registrations 
+                    WHERE user_id = %s AND lesson_type = %s
+                """, (user_id, lesson_type))
             
-            result = cur.fetchone()
-            return dict(result) if result else None
+                result = cur.fetchone()
+                return dict(result) if result else None
     except Exception as e:
         logger.error(f"Error getting registration for user {user_id} and lesson type {lesson_type}: {e}")
         return None
-    finally:
-        conn.close()
 
 def is_user_registered_for_lesson_date(user_id, lesson_type, lesson_date):
     """Checks if user is registered for specific lesson type and date."""
@@ -257,21 +340,19 @@ def is_user_registered_for_lesson_date(user_id, lesson_type, lesson_date):
         logger.warning(f"Invalid lesson_type: {lesson_type}")
         return False
     
-    conn = get_db_connection()
     try:
-        with conn.cursor(cursor_factory=DictCursor) as cur:
-            cur.execute("""
-                SELECT id FROM free_lesson_registrations 
-                WHERE user_id = %s AND lesson_type = %s AND lesson_date = %s
-            """, (user_id, lesson_type, lesson_date))
+        with get_connection() as conn:
+            with conn.cursor(cursor_factory=DictCursor) as cur:
+                cur.execute("""
+                    SELECT id FROM free_lesson_registrations 
+                    WHERE user_id = %s AND lesson_type = %s AND lesson_date = %s
+                """, (user_id, lesson_type, lesson_date))
             
-            result = cur.fetchone()
-            return result is not None
+                result = cur.fetchone()
+                return result is not None
     except Exception as e:
         logger.error(f"Error checking registration for user {user_id}, lesson type {lesson_type}, date {lesson_date}: {e}")
         return False
-    finally:
-        conn.close()
 
 def get_registrations_for_lesson_date(lesson_type, lesson_date):
     """Gets all registrations for a specific lesson type and date."""
@@ -280,19 +361,17 @@ def get_registrations_for_lesson_date(lesson_type, lesson_date):
         logger.warning(f"Invalid lesson_type: {lesson_type}")
         return []
     
-    conn = get_db_connection()
     try:
-        with conn.cursor(cursor_factory=DictCursor) as cur:
-            cur.execute("""
-                SELECT * FROM free_lesson_registrations 
-                WHERE lesson_type = %s AND lesson_date = %s
-                ORDER BY registered_at ASC
-            """, (lesson_type, lesson_date))
+        with get_connection() as conn:
+            with conn.cursor(cursor_factory=DictCursor) as cur:
+                cur.execute("""
+                    SELECT * FROM free_lesson_registrations 
+                    WHERE lesson_type = %s AND lesson_date = %s
+                    ORDER BY registered_at ASC
+                """, (lesson_type, lesson_date))
             
-            results = cur.fetchall()
-            return [dict(row) for row in results]
+                results = cur.fetchall()
+                return [dict(row) for row in results]
     except Exception as e:
         logger.error(f"Error getting registrations for lesson type {lesson_type}, date {lesson_date}: {e}")
-        return []
-    finally:
-        conn.close()
\ No newline at end of file
+        return []
\ No newline at end of file
@@ -0,0 +1,127 @@
+"""
+Base tables, plus the column and constraint fixes that used to run on
+every startup for databases created by older versions of the bot.
+"""
+import logging
+import config
+from db.migrations import check_column_exists, unique_constraints
+
+logger = logging.getLogger(__name__)
+
+def upgrade(cur):
+    # 1. Таблица бронирований
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS bookings (
+            id SERIAL PRIMARY KEY,
+            user_id BIGINT NOT NULL,
+            username TEXT,
+            first_name TEXT,
+            course_id INTEGER REFERENCES courses(id),
+            confirmed INTEGER DEFAULT 0,
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+            referral_code TEXT,
+            discount_percent INTEGER DEFAULT 0,
+            course_stream VARCHAR(50) DEFAULT '4th_stream'
+        );
+    """)
+
+    # 3. Таблица реферальных купонов
+    cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS {config.REFERRAL_TABLE_NAME} (
+            id SERIAL PRIMARY KEY,
+            code TEXT UNIQUE NOT NULL,
+            name TEXT,
+            discount_percent INTEGER NOT NULL,
+            max_activations INTEGER NOT NULL,
+            current_activations INTEGER DEFAULT 0,
+            created_by BIGINT NOT NULL,
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+            is_active INTEGER DEFAULT 1
+        );
+    """)
+
+    # 4. Таблица использования рефералов
+    cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS {config.REFERRAL_USAGE_TABLE_NAME} (
+            id SERIAL PRIMARY KEY,
+            coupon_id INTEGER NOT NULL REFERENCES {config.REFERRAL_TABLE_NAME}(id),
+            user_id BIGINT NOT NULL,
+            booking_id INTEGER REFERENCES bookings(id),
+            used_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE(coupon_id, user_id)
+        );
+    """)
+
+    # 5. Таблица событий для статистики
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS events (
+            id SERIAL PRIMARY KEY,
+            user_id BIGINT NOT NULL,
+            event_type VARCHAR(50) NOT NULL,
+            details JSONB,
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+        );
+    """)
+
+    # 6. Таблица регистраций на бесплатный урок
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS free_lesson_registrations (
+            id SERIAL PRIMARY KEY,
+            user_id BIGINT NOT NULL,
+            username TEXT,
+            first_name TEXT,
+            email TEXT NOT NULL,
+            registered_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+            notification_sent BOOLEAN DEFAULT FALSE,
+            lesson_type VARCHAR(50) DEFAULT 'cursor_lesson',
+            UNIQUE(user_id, lesson_type)
+        );
+    """)
+
+    # Add lesson_type column to free_lesson_registrations
+    if not check_column_exists(cur, 'free_lesson_registrations', 'lesson_type'):
+        logger.info("Adding lesson_type column to free_lesson_registrations...")
+        cur.execute("""
+            ALTER TABLE free_lesson_registrations 
+            ADD COLUMN lesson_type VARCHAR(50) DEFAULT 'cursor_lesson'
+        """)
+
+        # Update existing registrations to 'vibecoding_lesson'
+        cur.execute("""
+            UPDATE free_lesson_registrations 
+            SET lesson_type = 'vibecoding_lesson' 
+            WHERE lesson_type = 'cursor_lesson'
+        """)
+        logger.info(f"Added lesson_type column and updated {cur.rowcount} existing registrations to 'vibecoding_lesson'")
+
+    # Add course_stream column to bookings
+    if not check_column_exists(cur, 'bookings', 'course_stream'):
+        logger.info("Adding course_stream column to bookings...")
+        cur.execute("""
+            ALTER TABLE bookings 
+            ADD COLUMN course_stream VARCHAR(50) DEFAULT '4th_stream'
+        """)
+
+        # Update existing bookings to '3rd_stream'
+        cur.execute("""
+            UPDATE bookings 
+            SET course_stream = '3rd_stream' 
+            WHERE course_stream = '4th_stream'
+        """)
+        logger.info(f"Added course_stream column and updated {cur.rowcount} existing bookings to '3rd_stream'")
+
+    # Change the original UNIQUE (user_id) to UNIQUE (user_id, lesson_type)
+    cur.execute("""
+        ALTER TABLE free_lesson_registrations
+        DROP CONSTRAINT IF EXISTS free_lesson_registrations_user_id_key
+    """)
+    # A database already on one registration per date (0002 or patched by hand)
+    # may hold two dates of one workshop per user: leave its constraints to 0002
+    constraints = unique_constraints(cur, 'free_lesson_registrations').values()
+    if {'user_id', 'lesson_type'} not in constraints and {'user_id', 'lesson_type', 'lesson_date'} not in constraints:
+        logger.info("Adding composite UNIQUE constraint (user_id, lesson_type)")
+        cur.execute("""
+            ALTER TABLE free_lesson_registrations 
+            ADD CONSTRAINT free_lesson_registrations_user_id_lesson_type_key 
+            UNIQUE (user_id, lesson_type)
+        """)
@@ -0,0 +1,34 @@
+"""
+Per-date lesson registrations.
+
+create_free_lesson_registration upserts on (user_id, lesson_type, lesson_date),
+so the table needs the lesson_date column and a unique constraint on exactly
+those columns. The older UNIQUE (user_id, lesson_type) would reject a second
+date of the same workshop and is dropped. Constraints are matched by their
+columns, not by name, so databases patched by hand are handled too.
+"""
+import logging
+
+from db.migrations import unique_constraints
+
+logger = logging.getLogger(__name__)
+
+def upgrade(cur):
+    cur.execute("""
+        ALTER TABLE free_lesson_registrations
+        ADD COLUMN IF NOT EXISTS lesson_date DATE
+    """)
+
+    constraints = unique_constraints(cur, 'free_lesson_registrations')
+    for name, columns in constraints.items():
+        if columns == {'user_id', 'lesson_type'}:
+            logger.info(f"Dropping UNIQUE constraint {name} (user_id, lesson_type)")
+            cur.execute(f"ALTER TABLE free_lesson_registrations DROP CONSTRAINT {name}")
+
+    if {'user_id', 'lesson_type', 'lesson_date'} not in constraints.values():
+        logger.info("Adding UNIQUE constraint (user_id, lesson_type, lesson_date)")
+        cur.execute("""
+            ALTER TABLE free_lesson_registrations
+            ADD CONSTRAINT free_lesson_registrations_user_id_lesson_type_lesson_date_key
+            UNIQUE (user_id, lesson_type, lesson_date)
+        """)
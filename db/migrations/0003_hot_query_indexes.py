@@ -0,0 +1,29 @@
+"""
+Composite and partial indexes for the hot queries, built concurrently.
+"""
+import config
+from db.migrations import ensure_indexes
+
+TRANSACTIONAL = False
+
+# (name, table, columns and predicate). Partial indexes keep only the rows
+# those queries can actually return.
+INDEXES = [
+    # get_active_booking_by_user — runs on every incoming message
+    ("idx_bookings_user_active", "bookings", "(user_id, created_at DESC) WHERE confirmed IN (0, 1, 2)"),
+    # get_pending_booking_by_user — payment photo upload
+    ("idx_bookings_user_pending", "bookings", "(user_id, created_at DESC) WHERE confirmed = 0"),
+    # get_stats_summary (bookings today) and admin listings ordered by date
+    ("idx_bookings_created_at", "bookings", "(created_at)"),
+    # get_stats_summary (approved payments for the week)
+    ("idx_bookings_approved_created_at", "bookings", "(created_at) WHERE confirmed = 2"),
+    # get_bookings_by_stream
+    ("idx_bookings_stream_created_at", "bookings", "(course_stream, created_at DESC)"),
+    # get_stats_summary unique users: covers the date range and the DISTINCT column
+    ("idx_events_created_at_user", "events", "(created_at, user_id)"),
+    # get_referral_stats — latest coupons first
+    ("idx_referral_coupons_created_at", config.REFERRAL_TABLE_NAME, "(created_at DESC)"),
+]
+
+def upgrade(cur):
+    ensure_indexes(cur, INDEXES)
@@ -0,0 +1,29 @@
+"""
+Durable scheduled jobs (lesson reminders and later other timed work).
+
+A job is identified by (job_type, job_key), so rescheduling the same reminder
+moves the existing row instead of adding a second one. The partial index
+serves the scheduler's "next due pending job" query.
+"""
+
+def upgrade(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS scheduled_jobs (
+            id SERIAL PRIMARY KEY,
+            job_type TEXT NOT NULL,
+            job_key TEXT NOT NULL,
+            payload JSONB NOT NULL DEFAULT '{}'::jsonb,
+            run_at TIMESTAMP WITH TIME ZONE NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            last_error TEXT,
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+            started_at TIMESTAMP WITH TIME ZONE,
+            completed_at TIMESTAMP WITH TIME ZONE,
+            UNIQUE (job_type, job_key)
+        );
+    """)
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_scheduled_jobs_pending_run_at
+        ON scheduled_jobs (run_at) WHERE status = 'pending'
+    """)
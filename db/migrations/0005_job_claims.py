@@ -0,0 +1,13 @@
+"""
+Instance that claimed a scheduled job.
+
+scheduled_jobs records which instance claimed a job, so a restarted
+instance requeues only its own interrupted jobs, not the ones other
+instances are still running.
+"""
+
+def upgrade(cur):
+    cur.execute("""
+        ALTER TABLE scheduled_jobs
+        ADD COLUMN IF NOT EXISTS claimed_by TEXT
+    """)
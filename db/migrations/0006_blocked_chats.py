@@ -0,0 +1,17 @@
+"""
+Chats the bot cannot deliver to.
+
+A row is written when Telegram answers a send with Forbidden (the user
+blocked the bot or deleted the account) and deleted when the user writes
+to the bot again. The table is small and always read whole, so the
+primary key is its only index.
+"""
+
+def upgrade(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS blocked_chats (
+            chat_id BIGINT PRIMARY KEY,
+            reason TEXT,
+            blocked_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+        );
+    """)
@@ -0,0 +1,54 @@
+"""
+Per-stage reminder delivery tracking.
+
+A lesson can have several reminders (e.g. 24h, 1h and 10m before it), so a
+single notification_sent flag per registration is no longer enough: each
+(registration, stage) pair gets a row when an instance claims it, sent_at
+when Telegram accepted the message and failed_at when the send failed for
+good (blocked chat, bad request, retries exhausted), so it is not claimed
+again. The primary key serves the claim query's lookup of a registration's
+stage.
+
+Reminders already sent under the single-reminder scheme are recorded as
+the 'default' stage (the stage of lessons without a reminders list), so
+they are not sent a second time. Reminders filter registrations by lesson
+type and date, read oldest first. Every step is idempotent: the
+migration runs outside a transaction because indexes are built
+concurrently.
+"""
+import logging
+
+from db.migrations import ensure_indexes
+
+logger = logging.getLogger(__name__)
+
+TRANSACTIONAL = False
+
+INDEXES = [
+    # claim_pending_reminders / count_reminder_recipients
+    ("idx_free_lessons_type_date_registered", "free_lesson_registrations",
+     "(lesson_type, lesson_date, registered_at)"),
+]
+
+def upgrade(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS lesson_reminder_deliveries (
+            registration_id INTEGER NOT NULL REFERENCES free_lesson_registrations(id) ON DELETE CASCADE,
+            stage TEXT NOT NULL,
+            claimed_by TEXT,
+            claimed_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+            sent_at TIMESTAMP WITH TIME ZONE,
+            failed_at TIMESTAMP WITH TIME ZONE,
+            PRIMARY KEY (registration_id, stage)
+        );
+    """)
+    cur.execute("""
+        INSERT INTO lesson_reminder_deliveries (registration_id, stage, claimed_at, sent_at)
+        SELECT id, 'default', registered_at, registered_at
+        FROM free_lesson_registrations
+        WHERE notification_sent = TRUE
+        ON CONFLICT (registration_id, stage) DO NOTHING
+    """)
+    if cur.rowcount:
+        logger.info(f"Recorded {cur.rowcount} reminders sent before per-stage tracking")
+    ensure_indexes(cur, INDEXES)
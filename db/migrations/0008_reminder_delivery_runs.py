@@ -0,0 +1,36 @@
+"""
+Delivery lag of reminder runs.
+
+One row per run of a reminder stage on one instance: counters, the time
+spent from dequeue to Telegram's answer, and the lag histogram
+(utils.delivery_lag) as an integer array. Several instances sending parts
+of one run write one row each; readers merge them by (lesson_type, stage,
+scheduled_at). The index serves "latest runs first".
+"""
+
+def upgrade(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS reminder_delivery_runs (
+            id SERIAL PRIMARY KEY,
+            lesson_type TEXT NOT NULL,
+            stage TEXT NOT NULL,
+            job_key TEXT,
+            instance_id TEXT,
+            scheduled_at TIMESTAMP WITH TIME ZONE NOT NULL,
+            started_at TIMESTAMP WITH TIME ZONE NOT NULL,
+            finished_at TIMESTAMP WITH TIME ZONE NOT NULL,
+            first_delivery_at TIMESTAMP WITH TIME ZONE,
+            last_delivery_at TIMESTAMP WITH TIME ZONE,
+            sent INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            skipped INTEGER NOT NULL DEFAULT 0,
+            retries INTEGER NOT NULL DEFAULT 0,
+            send_seconds REAL NOT NULL DEFAULT 0,
+            lag_histogram INTEGER[] NOT NULL,
+            lag_max_seconds REAL NOT NULL DEFAULT 0
+        );
+    """)
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_reminder_delivery_runs_scheduled_at
+        ON reminder_delivery_runs (scheduled_at DESC)
+    """)
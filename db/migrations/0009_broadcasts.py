@@ -0,0 +1,36 @@
+"""
+Admin broadcasts and their resumable progress.
+
+broadcasts describes what is sent to whom: a segment (see db.broadcasts)
+and the admin's message that is copied to every recipient. broadcast_progress
+is the checkpoint written after every chunk: recipients are handled in
+user_id order, so last_user_id is where a restarted broadcast resumes.
+"""
+
+def upgrade(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            id SERIAL PRIMARY KEY,
+            segment TEXT NOT NULL,
+            segment_arg TEXT,
+            source_chat_id BIGINT NOT NULL,
+            source_message_id BIGINT NOT NULL,
+            created_by BIGINT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'draft',
+            total_recipients INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+            started_at TIMESTAMP WITH TIME ZONE,
+            finished_at TIMESTAMP WITH TIME ZONE
+        );
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS broadcast_progress (
+            broadcast_id INTEGER PRIMARY KEY REFERENCES broadcasts(id) ON DELETE CASCADE,
+            last_user_id BIGINT NOT NULL DEFAULT 0,
+            sent INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            skipped INTEGER NOT NULL DEFAULT 0,
+            report_message_id BIGINT,
+            updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+        );
+    """)
@@ -0,0 +1,210 @@
+# db/migrations/__init__.py
+"""
+Versioned schema migrations.
+
+Each migration is a module in this package named NNNN_description.py with:
+    upgrade(cur)         -- applies the change using the given cursor
+    TRANSACTIONAL = True -- optional; set False for statements that cannot
+                            run inside a transaction (CREATE INDEX CONCURRENTLY)
+
+Applied versions are recorded in schema_migrations. On startup migrate()
+reads that table once and returns immediately when nothing is pending.
+Otherwise it takes a PostgreSQL advisory lock so that several bot replicas
+starting together apply each migration exactly once.
+"""
+import importlib
+import logging
+import os
+import re
+import time
+from collections import namedtuple
+
+import psycopg2
+from psycopg2 import errors as pg_errors
+
+from db.base import get_connection
+
+logger = logging.getLogger(__name__)
+
+# Arbitrary application-wide key for pg_advisory_lock
+MIGRATION_LOCK_ID = 724315001
+MIGRATION_LOCK_POLL_SECONDS = 0.5
+
+_MIGRATION_FILE_RE = re.compile(r'^(\d{4})_(\w+)\.py$')
+
+Migration = namedtuple('Migration', ['version', 'name', 'module'])
+
+def discover_migrations():
+    """Returns all migrations in this package ordered by version."""
+    migrations = []
+    for filename in os.listdir(os.path.dirname(__file__)):
+        match = _MIGRATION_FILE_RE.match(filename)
+        if not match:
+            continue
+        module = importlib.import_module(f"{__name__}.{filename[:-3]}")
+        migrations.append(Migration(int(match.group(1)), match.group(2), module))
+    migrations.sort(key=lambda m: m.version)
+    versions = [m.version for m in migrations]
+    if len(versions) != len(set(versions)):
+        raise RuntimeError(f"Duplicate migration versions: {versions}")
+    return migrations
+
+def check_column_exists(cursor, table_name, column_name):
+    """Check if a column exists in a table."""
+    cursor.execute("""
+        SELECT column_name 
+        FROM information_schema.columns 
+        WHERE table_name = %s AND column_name = %s
+    """, (table_name, column_name))
+    return cursor.fetchone() is not None
+
+def unique_constraints(cursor, table_name):
+    """Returns {constraint_name: frozenset(columns)} of the table's UNIQUE constraints."""
+    cursor.execute("""
+        SELECT c.conname, array_agg(a.attname::text)
+        FROM pg_constraint c
+        JOIN pg_attribute a ON a.attrelid = c.conrelid AND a.attnum = ANY(c.conkey)
+        WHERE c.conrelid = %s::regclass AND c.contype = 'u'
+        GROUP BY c.conname
+    """, (table_name,))
+    return {name: frozenset(columns) for name, columns in cursor.fetchall()}
+
+def ensure_indexes(cur, indexes):
+    """
+    Creates missing indexes from a list of (name, table, definition) without
+    blocking writes. Must run on an autocommit cursor (TRANSACTIONAL = False):
+    CREATE INDEX CONCURRENTLY cannot run inside a transaction. An index left
+    INVALID by an interrupted concurrent build is dropped and rebuilt.
+    """
+    cur.execute("""
+        SELECT c.relname, i.indisvalid
+        FROM pg_class c
+        JOIN pg_index i ON i.indexrelid = c.oid
+        WHERE c.relname = ANY(%s)
+    """, ([name for name, _, _ in indexes],))
+    existing = dict(cur.fetchall())
+
+    for name, table, definition in indexes:
+        if existing.get(name) is True:
+            continue
+        if name in existing:
+            logger.warning(f"Rebuilding invalid index {name}")
+            cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+        logger.info(f"Creating index {name} on {table}")
+        cur.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} {definition}")
+
+def _applied_versions(conn):
+    """Reads applied versions in one query; an empty set if the table does not exist yet."""
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT version FROM schema_migrations")
+            versions = {row[0] for row in cur.fetchall()}
+        conn.rollback()
+        return versions
+    except pg_errors.UndefinedTable:
+        conn.rollback()
+        return set()
+
+def get_migration_status():
+    """Returns (applied, pending) lists of Migration tuples."""
+    migrations = discover_migrations()
+    with get_connection() as conn:
+        applied_versions = _applied_versions(conn)
+    applied = [m for m in migrations if m.version in applied_versions]
+    pending = [m for m in migrations if m.version not in applied_versions]
+    return applied, pending
+
+def _apply(conn, migration):
+    """Applies one migration and records it, atomically when the migration allows it."""
+    transactional = getattr(migration.module, 'TRANSACTIONAL', True)
+    started = time.monotonic()
+    conn.autocommit = not transactional
+    try:
+        with conn.cursor() as cur:
+            migration.module.upgrade(cur)
+            cur.execute(
+                "INSERT INTO schema_migrations (version, name, duration_ms) VALUES (%s, %s, %s)",
+                (migration.version, migration.name, int((time.monotonic() - started) * 1000))
+            )
+        if transactional:
+            conn.commit()
+    except Exception:
+        if transactional:
+            conn.rollback()
+        raise
+    finally:
+        conn.autocommit = False
+    logger.info(f"Applied migration {migration.version:04d}_{migration.name} "
+                f"in {time.monotonic() - started:.2f}s")
+
+def _acquire_lock(conn):
+    """
+    Takes the session-level migration lock, held across the per-migration
+    transactions. Waiters poll pg_try_advisory_lock instead of blocking in
+    pg_advisory_lock: a blocked statement is an open transaction, and
+    CREATE INDEX CONCURRENTLY in the lock holder would wait for it forever.
+    """
+    conn.autocommit = True
+    try:
+        while True:
+            with conn.cursor() as cur:
+                cur.execute("SELECT pg_try_advisory_lock(%s)", (MIGRATION_LOCK_ID,))
+                if cur.fetchone()[0]:
+                    return
+            logger.info("Waiting for another instance to finish migrations...")
+            time.sleep(MIGRATION_LOCK_POLL_SECONDS)
+    finally:
+        conn.autocommit = False
+
+def _release_lock(conn):
+    """Releases the migration lock; a dead connection releases it on its own."""
+    try:
+        conn.rollback()
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_ID,))
+    except psycopg2.Error as e:
+        logger.warning(f"Could not release migration lock: {e}")
+    finally:
+        if not conn.closed:
+            conn.autocommit = False
+
+def migrate():
+    """Applies pending migrations. A single query when the schema is already current."""
+    started = time.monotonic()
+    migrations = discover_migrations()
+    known = {m.version for m in migrations}
+
+    with get_connection() as conn:
+        if known <= _applied_versions(conn):
+            logger.info(f"Database schema is up to date (version {max(known, default=0)}, "
+                        f"checked in {(time.monotonic() - started) * 1000:.0f} ms)")
+            return
+
+        _acquire_lock(conn)
+        try:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS schema_migrations (
+                        version INTEGER PRIMARY KEY,
+                        name TEXT NOT NULL,
+                        applied_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+                        duration_ms INTEGER
+                    );
+                """)
+            conn.commit()
+
+            # Another replica may have applied some of them while we waited for the lock
+            applied = _applied_versions(conn)
+            pending = [m for m in migrations if m.version not in applied]
+            logger.info(f"Applying {len(pending)} pending migrations...")
+            for migration in pending:
+                try:
+                    _apply(conn, migration)
+                except Exception as e:
+                    logger.error(f"Error during migration {migration.version:04d}_{migration.name}: {e}")
+                    raise
+        finally:
+            _release_lock(conn)
+
+    logger.info(f"Database migrations completed in {time.monotonic() - started:.2f}s")
@@ -1,85 +1,164 @@
 # db/referrals.py
 import random
-import string
 import logging
-import psycopg2
-from psycopg2.extras import DictCursor
-from db.base import get_db_connection
+from psycopg2.extras import DictCursor, execute_values
+from db.base import get_connection, connection_scope
+from db import coupon_cache
 import config
 
 logger = logging.getLogger(__name__)
 
-def generate_and_save_referral_code(discount, activations, creator_id):
+# Rounds of regeneration for codes that collided; with the default alphabet
+# and length a second round is already practically never needed
+MAX_GENERATION_ROUNDS = 10
+
+def _random_code():
+    return ''.join(random.choices(config.REFERRAL_CODE_CHARS, k=config.REFERRAL_CODE_LENGTH))
+
+def generate_referral_codes(count, discount, activations, creator_id, session=None):
+    """
+    Generates `count` unique referral codes with the same discount and limit.
+
+    Candidates are inserted in batches of REFERRAL_BULK_BATCH_SIZE with
+    ON CONFLICT (code) DO NOTHING RETURNING code; only codes that collided
+    are regenerated, on the same connection and in the same transaction.
+
+    Returns:
+        List of the created codes, in creation order.
+    """
+    created = []
+    taken = set()
+    with connection_scope(session) as conn:
+        with conn.cursor() as cursor:
+            for _ in range(MAX_GENERATION_ROUNDS):
+                missing = count - len(created)
+                if missing == 0:
+                    return created
+                candidates = set()
+                while len(candidates) < missing:
+                    code = _random_code()
+                    if code not in taken:
+                        candidates.add(code)
+                taken |= candidates
+                rows = execute_values(
+                    cursor,
+                    f"""INSERT INTO {config.REFERRAL_TABLE_NAME} (code, discount_percent, max_activations, created_by)
+                        VALUES %s
+                        ON CONFLICT (code) DO NOTHING
+                        RETURNING code""",
+                    [(code, discount, activations, creator_id) for code in candidates],
+                    page_size=config.REFERRAL_BULK_BATCH_SIZE,
+                    fetch=True
+                )
+                created.extend(row[0] for row in rows)
+                coupon_cache.add_codes(row[0] for row in rows)
+                if len(created) < count:
+                    logger.info(f"{count - len(created)} referral code collisions, regenerating")
+    if len(created) < count:
+        raise RuntimeError(f"Could not generate {count} unique referral codes in {MAX_GENERATION_ROUNDS} rounds")
+    return created
+
+def generate_and_save_referral_code(discount, activations, creator_id, session=None):
     """Generates a unique referral code and saves it to the database."""
-    while True:
-        code = ''.join(random.choices(config.REFERRAL_CODE_CHARS, k=config.REFERRAL_CODE_LENGTH))
-        conn = get_db_connection()
-        try:
-            with conn.cursor() as cursor:
-                cursor.execute(f"SELECT id FROM {config.REFERRAL_TABLE_NAME} WHERE code = %s", (code,))
-                if not cursor.fetchone():
-                    cursor.execute(
-                        f"""INSERT INTO {config.REFERRAL_TABLE_NAME} (code, discount_percent, max_activations, created_by)
-                            VALUES (%s, %s, %s, %s)""",
-                        (code, discount, activations, creator_id)
-                    )
-                    conn.commit()
-                    return code
-        finally:
-            conn.close()
-
-def validate_referral_code(code, user_id):
-    """Validates a referral code and returns its details if valid."""
-    conn = get_db_connection()
-    try:
+    return generate_referral_codes(1, discount, activations, creator_id, session=session)[0]
+
+class ReferralUnavailable(Exception):
+    """Raised inside a unit of work when a coupon can no longer be reserved; carries the reservation status."""
+
+    def __init__(self, status):
+        super().__init__(status)
+        self.status = status
+
+def validate_referral_code(code, user_id, session=None):
+    """
+    Validates a referral code and returns its details if valid.
+
+    This is only a preview for the /start message: the activation itself is
+    taken by reserve_referral_activation when the booking is created. The
+    coupon and the users who already used it come from the coupon cache, or
+    from one query that is then cached (a missing code too).
+    """
+    coupon = coupon_cache.get(code)
+    if coupon is None:
+        with connection_scope(session) as conn:
+            with conn.cursor(cursor_factory=DictCursor) as cursor:
+                cursor.execute(f"""
+                    SELECT c.id, c.name, c.discount_percent, c.max_activations, c.current_activations,
+                           ARRAY(SELECT u.user_id FROM {config.REFERRAL_USAGE_TABLE_NAME} u
+                                 WHERE u.coupon_id = c.id) AS used_by
+                    FROM {config.REFERRAL_TABLE_NAME} c
+                    WHERE c.code = %s AND c.is_active = 1
+                """, (code,))
+                row = cursor.fetchone()
+        if row is not None:
+            row = dict(row)
+            row['used_by'] = frozenset(row['used_by'])
+        coupon_cache.put(code, row)
+        coupon = row if row is not None else coupon_cache.MISSING
+    if coupon is coupon_cache.MISSING:
+        return None, "not_found"
+    if coupon['current_activations'] >= coupon['max_activations']:
+        return None, "expired"
+    if user_id in coupon['used_by']:
+        return None, "already_used"
+    details = dict(coupon)
+    del details['used_by']
+    return details, "valid"
+
+def reserve_referral_activation(coupon_id, user_id, booking_id, session=None):
+    """
+    Atomically takes one activation of a coupon and records its usage.
+
+    A single statement increments current_activations only while it is below
+    max_activations and the user has not used the coupon yet, and inserts the
+    usage row from the UPDATE's RETURNING. Concurrent redemptions queue on the
+    coupon row lock for the duration of that one UPDATE, so the limit can
+    never be exceeded. The lock is held until commit: inside a session, make
+    this the last statement of the unit of work.
+
+    Returns:
+        "reserved", "already_used" or "expired" (also for inactive or unknown coupons).
+    """
+    with connection_scope(session) as conn:
         with conn.cursor(cursor_factory=DictCursor) as cursor:
             cursor.execute(f"""
-                SELECT id, name, discount_percent, max_activations, current_activations
-                FROM {config.REFERRAL_TABLE_NAME}
-                WHERE code = %s AND is_active = 1
-            """, (code,))
-            coupon = cursor.fetchone()
-            if not coupon:
-                return None, "not_found"
-            if coupon['current_activations'] >= coupon['max_activations']:
-                return None, "expired"
-            return coupon, "valid"
-    finally:
-        conn.close()
-
-def apply_referral_discount(coupon_id, user_id, booking_id):
-    """Records the usage of a referral coupon."""
-    conn = get_db_connection()
-    try:
-        with conn.cursor() as cursor:
-            cursor.execute(f"""
-                INSERT INTO {config.REFERRAL_USAGE_TABLE_NAME} (coupon_id, user_id, booking_id)
-                VALUES (%s, %s, %s)
-            """, (coupon_id, user_id, booking_id))
-            cursor.execute(f"""
-                UPDATE {config.REFERRAL_TABLE_NAME}
-                SET current_activations = current_activations + 1
-                WHERE id = %s
-            """, (coupon_id,))
-            conn.commit()
-            return True
-    except psycopg2.Error as e:
-        logger.error(f"Error applying referral discount: {e}")
-        conn.rollback()
-        return False
-    finally:
-        conn.close()
+                WITH used AS (
+                    SELECT 1 FROM {config.REFERRAL_USAGE_TABLE_NAME}
+                    WHERE coupon_id = %(coupon_id)s AND user_id = %(user_id)s
+                ), reserved AS (
+                    UPDATE {config.REFERRAL_TABLE_NAME}
+                    SET current_activations = current_activations + 1
+                    WHERE id = %(coupon_id)s
+                      AND is_active = 1
+                      AND current_activations < max_activations
+                      AND NOT EXISTS (SELECT 1 FROM used)
+                    RETURNING id
+                ), recorded AS (
+                    INSERT INTO {config.REFERRAL_USAGE_TABLE_NAME} (coupon_id, user_id, booking_id)
+                    SELECT id, %(user_id)s, %(booking_id)s FROM reserved
+                    RETURNING id
+                )
+                SELECT EXISTS (SELECT 1 FROM recorded) AS reserved,
+                       EXISTS (SELECT 1 FROM used) AS already_used
+            """, {'coupon_id': coupon_id, 'user_id': user_id, 'booking_id': booking_id})
+            row = cursor.fetchone()
+
+    # Activations changed (or the coupon turned out unusable): the cached preview is stale
+    coupon_cache.invalidate(coupon_id)
+    if row['reserved']:
+        return "reserved"
+    if row['already_used']:
+        return "already_used"
+    logger.info(f"Referral coupon {coupon_id} has no activations left for user {user_id}")
+    return "expired"
 
 def get_referral_stats():
     """Retrieves statistics for the most recent referral coupons."""
-    conn = get_db_connection()
-    try:
+    with get_connection() as conn:
         with conn.cursor(cursor_factory=DictCursor) as cursor:
             cursor.execute(f"""
                 SELECT code, discount_percent, max_activations, current_activations, is_active
                 FROM {config.REFERRAL_TABLE_NAME}
                 ORDER BY created_at DESC LIMIT 20
             """)
-            return cursor.fetchall()
-    finally:
-        conn.close()
\ No newline at end of file
+            return cursor.fetchall()
\ No newline at end of file
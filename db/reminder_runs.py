@@ -0,0 +1,45 @@
+# db/reminder_runs.py
+import logging
+from psycopg2.extras import DictCursor
+from db.base import get_connection
+
+logger = logging.getLogger(__name__)
+
+def record_run(run, instance_id):
+    """Stores a finished utils.delivery_lag.DeliveryRun."""
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                INSERT INTO reminder_delivery_runs (
+                    lesson_type, stage, job_key, instance_id, scheduled_at, started_at, finished_at,
+                    first_delivery_at, last_delivery_at, sent, failed, skipped, retries,
+                    send_seconds, lag_histogram, lag_max_seconds
+                ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+            """, (
+                run.lesson_type, run.stage, run.job_key, instance_id, run.scheduled_at, run.started_at,
+                run.finished_at, run.first_delivery_at, run.last_delivery_at, run.sent, run.failed,
+                run.skipped, run.retries, run.send_seconds, run.lag.counts, run.lag.max_value
+            ))
+            conn.commit()
+
+def get_recent_runs(limit=10):
+    """
+    Returns the rows of the `limit` latest reminder runs, a run being all
+    rows of one (lesson_type, stage, scheduled_at), newest first.
+    """
+    with get_connection() as conn:
+        with conn.cursor(cursor_factory=DictCursor) as cur:
+            cur.execute("""
+                WITH latest AS (
+                    SELECT lesson_type, stage, scheduled_at
+                    FROM reminder_delivery_runs
+                    GROUP BY lesson_type, stage, scheduled_at
+                    ORDER BY scheduled_at DESC
+                    LIMIT %s
+                )
+                SELECT r.*
+                FROM reminder_delivery_runs r
+                JOIN latest USING (lesson_type, stage, scheduled_at)
+                ORDER BY r.scheduled_at DESC, r.id
+            """, (limit,))
+            return [dict(row) for row in cur.fetchall()]
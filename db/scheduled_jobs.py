@@ -0,0 +1,172 @@
+# db/scheduled_jobs.py
+import json
+import logging
+from psycopg2.extras import DictCursor
+from db.base import get_connection, connection_scope
+
+logger = logging.getLogger(__name__)
+
+# Значения scheduled_jobs.status
+STATUS_PENDING = 'pending'
+STATUS_RUNNING = 'running'
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
+STATUS_SKIPPED = 'skipped'
+# Отменена до запуска (урок изменили в каталоге); повторное schedule_job ее возвращает
+STATUS_CANCELLED = 'cancelled'
+
+def schedule_job(job_type, job_key, run_at, payload=None, session=None):
+    """
+    Creates a pending job, or moves an existing pending one to the new run_at.
+    A cancelled job becomes pending again.
+
+    Jobs that already ran (done, failed, skipped) or are running are left
+    untouched, so scheduling the same reminder on every startup is safe.
+
+    Returns:
+        The job's status after the call.
+    """
+    with connection_scope(session) as conn:
+        with conn.cursor(cursor_factory=DictCursor) as cursor:
+            cursor.execute("""
+                INSERT INTO scheduled_jobs (job_type, job_key, payload, run_at)
+                VALUES (%s, %s, %s, %s)
+                ON CONFLICT (job_type, job_key) DO UPDATE SET
+                    run_at = EXCLUDED.run_at,
+                    payload = EXCLUDED.payload,
+                    status = 'pending'
+                WHERE scheduled_jobs.status IN ('pending', 'cancelled')
+                RETURNING status
+            """, (job_type, job_key, json.dumps(payload or {}), run_at))
+            row = cursor.fetchone()
+            if row:
+                return row['status']
+            cursor.execute(
+                "SELECT status FROM scheduled_jobs WHERE job_type = %s AND job_key = %s",
+                (job_type, job_key)
+            )
+            return cursor.fetchone()['status']
+
+def get_next_run_at(exclude_groups=()):
+    """Returns the run_at of the earliest pending job outside `exclude_groups`, or None."""
+    with get_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                SELECT MIN(run_at) FROM scheduled_jobs
+                WHERE status = 'pending'
+                  AND NOT (job_type || '|' || split_part(job_key, '#', 1)) = ANY(%s)
+            """, (list(exclude_groups),))
+            return cursor.fetchone()[0]
+
+def job_group(job_type, job_key):
+    """Jobs whose keys share the part before '#' form one group (e.g. parts of one fan-out)."""
+    return f"{job_type}|{job_key.split('#', 1)[0]}"
+
+def claim_due_jobs(owner, limit=10, exclude_groups=()):
+    """
+    Marks up to `limit` due pending jobs as running by `owner` and returns them, oldest first.
+
+    SKIP LOCKED lets several bot instances claim concurrently without taking
+    the same job twice. Jobs of the groups in `exclude_groups` are left for
+    other instances.
+    """
+    with get_connection() as conn:
+        with conn.cursor(cursor_factory=DictCursor) as cursor:
+            cursor.execute("""
+                UPDATE scheduled_jobs j
+                SET status = 'running', attempts = j.attempts + 1,
+                    started_at = CURRENT_TIMESTAMP, claimed_by = %s
+                FROM (
+                    SELECT id FROM scheduled_jobs
+                    WHERE status = 'pending' AND run_at <= CURRENT_TIMESTAMP
+                      AND NOT (job_type || '|' || split_part(job_key, '#', 1)) = ANY(%s)
+                    ORDER BY run_at
+                    LIMIT %s
+                    FOR UPDATE SKIP LOCKED
+                ) due
+                WHERE j.id = due.id
+                RETURNING j.id, j.job_type, j.job_key, j.payload, j.run_at, j.attempts
+            """, (owner, list(exclude_groups), limit))
+            jobs = [dict(row) for row in cursor.fetchall()]
+            conn.commit()
+    jobs.sort(key=lambda job: job['run_at'])
+    return jobs
+
+def touch_job(job_id):
+    """
+    Heartbeat of a long-running job: moves its started_at forward so other
+    instances do not requeue it as stale while it is still being worked on.
+    """
+    with get_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                "UPDATE scheduled_jobs SET started_at = CURRENT_TIMESTAMP WHERE id = %s AND status = 'running'",
+                (job_id,)
+            )
+            conn.commit()
+
+def finish_job(job_id, status=STATUS_DONE, error=None):
+    """Records the final status of a claimed job."""
+    with get_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                UPDATE scheduled_jobs
+                SET status = %s, last_error = %s, completed_at = CURRENT_TIMESTAMP
+                WHERE id = %s
+            """, (status, error, job_id))
+            conn.commit()
+
+def retry_job(job_id, run_at, error):
+    """Puts a claimed job back to pending for another attempt at run_at."""
+    with get_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                UPDATE scheduled_jobs
+                SET status = 'pending', run_at = %s, last_error = %s
+                WHERE id = %s
+            """, (run_at, error, job_id))
+            conn.commit()
+
+def cancel_pending_jobs(job_type, job_keys, reason):
+    """
+    Cancels pending jobs with the given keys (and their '#' parts), e.g.
+    reminders of a lesson that was moved or disabled. Returns their number.
+    """
+    with get_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                UPDATE scheduled_jobs
+                SET status = 'cancelled', last_error = %s, completed_at = CURRENT_TIMESTAMP
+                WHERE status = 'pending' AND job_type = %s
+                  AND split_part(job_key, '#', 1) = ANY(%s)
+            """, (reason, job_type, list(job_keys)))
+            cancelled = cursor.rowcount
+            conn.commit()
+            return cancelled
+
+def requeue_interrupted_jobs(owner, stale_after, exclude_ids=()):
+    """
+    Returns jobs left 'running' by a process that died mid-job to pending,
+    due immediately: those of any instance running for longer than
+    `stale_after` seconds since they started or last called touch_job and,
+    with an `owner` (this instance right after a restart), those it claimed
+    and those without an owner. Jobs in `exclude_ids` (running in this
+    process) are never requeued.
+    Job handlers must therefore be safe to run again.
+    """
+    owned = "claimed_by = %(owner)s OR claimed_by IS NULL OR" if owner is not None else ""
+    with get_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(f"""
+                UPDATE scheduled_jobs
+                SET status = 'pending', run_at = LEAST(run_at, CURRENT_TIMESTAMP)
+                WHERE status = 'running'
+                  AND NOT id = ANY(%(exclude_ids)s)
+                  AND ({owned}
+                       started_at < CURRENT_TIMESTAMP - %(stale_after)s * INTERVAL '1 second')
+            """, {'owner': owner, 'stale_after': stale_after, 'exclude_ids': list(exclude_ids)})
+            requeued = cursor.rowcount
+            conn.commit()
+    if requeued:
+        logger.warning(f"Requeued {requeued} scheduled jobs interrupted by a restart or a dead instance")
+    return requeued
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+EXPLAIN-based check that the hot queries can use the managed indexes.
+
+For each key query the script runs EXPLAIN (FORMAT JSON) and looks for the
+expected indexes anywhere in the plan. Sequential scans are disabled for the
+session: on a small or freshly created database the planner rightly prefers
+a seq scan, and the question here is whether the index is usable at all.
+
+Exits with status 1 if any query does not use its index.
+
+Usage:
+    python db_management/check_indexes.py
+"""
+
+import json
+import logging
+import sys
+import os
+
+# Add parent directory to path to import config
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import config
+from db.base import get_connection
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# (description, expected index or tuple of indexes that must all be used, query, params) —
+# WHERE/ORDER BY shapes mirror the db modules
+KEY_QUERIES = [
+    (
+        "bookings.get_active_booking_by_user",
+        "idx_bookings_user_active",
+        """SELECT b.id FROM bookings b
+           WHERE b.user_id = %s AND b.confirmed IN (0, 1, 2)
+           ORDER BY b.created_at DESC LIMIT 1""",
+        (1,),
+    ),
+    (
+        "bookings.get_pending_booking_by_user",
+        "idx_bookings_user_pending",
+        """SELECT b.id FROM bookings b
+           WHERE b.user_id = %s AND b.confirmed = 0
+           ORDER BY b.created_at DESC LIMIT 1""",
+        (1,),
+    ),
+    (
+        "events.get_stats_summary (users this week)",
+        "idx_events_created_at_user",
+        """SELECT COUNT(DISTINCT user_id) FROM events
+           WHERE created_at >= CURRENT_DATE - INTERVAL '7 days'""",
+        (),
+    ),
+    (
+        "events.get_stats_summary (approved this week)",
+        "idx_bookings_approved_created_at",
+        """SELECT COUNT(*) FROM bookings
+           WHERE confirmed = 2 AND created_at >= CURRENT_DATE - INTERVAL '7 days'""",
+        (),
+    ),
+    (
+        "free_lessons.claim_pending_reminders",
+        ("idx_free_lessons_type_date_registered", "lesson_reminder_deliveries_pkey"),
+        """WITH claimable AS (
+               SELECT r.id FROM free_lesson_registrations r
+               LEFT JOIN lesson_reminder_deliveries d
+                   ON d.registration_id = r.id AND d.stage = %(stage)s
+               WHERE r.lesson_type = %(lesson_type)s
+                 AND r.lesson_date = %(lesson_date)s
+                 AND (d.registration_id IS NULL
+                      OR (d.sent_at IS NULL AND d.failed_at IS NULL
+                          AND d.claimed_at < CURRENT_TIMESTAMP - 300 * INTERVAL '1 second'))
+               ORDER BY r.registered_at
+               LIMIT 100
+               FOR UPDATE OF r SKIP LOCKED
+           ), claimed AS (
+               INSERT INTO lesson_reminder_deliveries (registration_id, stage, claimed_by, claimed_at)
+               SELECT id, %(stage)s, 'check', CURRENT_TIMESTAMP FROM claimable
+               ON CONFLICT (registration_id, stage) DO NOTHING
+               RETURNING registration_id
+           )
+           SELECT r.id, r.user_id FROM claimed
+           JOIN free_lesson_registrations r ON r.id = claimed.registration_id
+           ORDER BY r.registered_at""",
+        {'lesson_type': "vibecoding_lesson", 'lesson_date': "2025-01-01", 'stage': "default"},
+    ),
+    (
+        "free_lessons.count_reminder_recipients",
+        ("idx_free_lessons_type_date_registered", "lesson_reminder_deliveries_pkey"),
+        """SELECT COUNT(*) AS recipients, COUNT(b.chat_id) AS blocked
+           FROM free_lesson_registrations r
+           LEFT JOIN blocked_chats b ON b.chat_id = r.user_id
+           WHERE r.lesson_type = %(lesson_type)s
+             AND r.lesson_date = %(lesson_date)s
+             AND NOT EXISTS (
+                 SELECT 1 FROM lesson_reminder_deliveries d
+                 WHERE d.registration_id = r.id AND d.stage = %(stage)s
+                   AND (d.sent_at IS NOT NULL OR d.failed_at IS NOT NULL)
+             )""",
+        {'lesson_type': "vibecoding_lesson", 'lesson_date': "2025-01-01", 'stage': "default"},
+    ),
+    (
+        "referrals.get_referral_stats",
+        "idx_referral_coupons_created_at",
+        f"""SELECT code FROM {config.REFERRAL_TABLE_NAME}
+            ORDER BY created_at DESC LIMIT 20""",
+        (),
+    ),
+]
+
+def _plan_indexes(plan):
+    """Collects every index name referenced anywhere in a JSON plan tree."""
+    found = set()
+    if 'Index Name' in plan:
+        found.add(plan['Index Name'])
+    for child in plan.get('Plans', []):
+        found |= _plan_indexes(child)
+    return found
+
+def check_indexes():
+    """Runs EXPLAIN for every key query and returns the list of failures."""
+    failures = []
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SET LOCAL enable_seqscan = off")
+            for description, expected, query, params in KEY_QUERIES:
+                expected = (expected,) if isinstance(expected, str) else expected
+                cur.execute(f"EXPLAIN (FORMAT JSON) {query}", params)
+                plan = cur.fetchone()[0]
+                if isinstance(plan, str):
+                    plan = json.loads(plan)
+                used = _plan_indexes(plan[0]['Plan'])
+                missing = [name for name in expected if name not in used]
+                if not missing:
+                    logger.info(f"OK    {description}: uses {', '.join(expected)}")
+                else:
+                    logger.error(f"FAIL  {description}: expected {', '.join(missing)}, plan uses {sorted(used) or 'no index'}")
+                    failures.append(description)
+    return failures
+
+if __name__ == "__main__":
+    failures = check_indexes()
+    if failures:
+        logger.error(f"{len(failures)} queries do not use their index")
+        sys.exit(1)
+    logger.info("All key queries use their indexes")
@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+"""
+Command-line access to the versioned migrations in db/migrations.
+
+The bot applies pending migrations on startup; this script is for checking
+the schema version or migrating ahead of a deploy.
+
+Usage:
+    python db_management/migrate.py [upgrade|status]
+"""
+
+import logging
+import sys
+import os
+
+# Add parent directory to path to import config
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from db.migrations import migrate, get_migration_status
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+def show_status():
+    """Logs applied and pending migrations."""
+    applied, pending = get_migration_status()
+    logger.info("Migration status:")
+    for migration in applied:
+        logger.info(f"  [applied] {migration.version:04d}_{migration.name}")
+    for migration in pending:
+        logger.info(f"  [pending] {migration.version:04d}_{migration.name}")
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python migrate.py [upgrade|status]")
+        sys.exit(1)
+
+    command = sys.argv[1].lower()
+
+    if command == "upgrade":
+        migrate()
+    elif command == "status":
+        show_status()
+    else:
+        print("Invalid command. Use 'upgrade' or 'status'")
+        sys.exit(1)
@@ -1,18 +1,24 @@
 import logging
+import psycopg2
+from datetime import datetime, timezone
 from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
 from telegram.ext import ContextTypes
+from telegram.error import Forbidden
 from telegram.constants import ParseMode
 
 import config
 from handlers.callbacks import *
 from locales.ru import get_text
 from utils import get_approval_timestamp
-from utils.lessons import get_lesson_by_id, get_lesson_by_type
+from utils.lessons import get_lesson_by_id, get_lesson_by_type, get_lesson_times
 from utils.courses import get_course_by_id
-from db import bookings as db_bookings
-from db import events as db_events
-from db import referrals as db_referrals
-from db import free_lessons as db_free_lessons
+from utils.fanout import record_blocked
+from db import aio as db_aio
+from db.aio import blocked_chats as db_blocked
+from db.aio import bookings as db_bookings
+from db.aio import events as db_events
+from db.aio import referrals as db_referrals
+from db.aio import free_lessons as db_free_lessons
 
 logger = logging.getLogger(__name__)
 
@@ -111,29 +117,49 @@ async def handle_confirm_selection(query, context):
     referral_info = context.user_data.get('pending_referral_info')
     discount_percent = referral_info['discount_percent'] if referral_info else 0
 
-    booking_id = db_bookings.create_booking(
-        user_id,
-        context.user_data['username'],
-        context.user_data['first_name'],
-        course_id,
-        referral_code,
-        discount_percent
-    )
+    # Бронь, событие и использование купона фиксируются одной транзакцией
+    try:
+        async with db_aio.transaction() as session:
+            booking_id = await db_bookings.create_booking(
+                user_id,
+                context.user_data['username'],
+                context.user_data['first_name'],
+                course_id,
+                referral_code,
+                discount_percent,
+                session=session
+            )
+            db_events.log_event(
+                user_id, 
+                'booking_created', 
+                details={'course_id': course_id, 'booking_id': booking_id},
+                username=context.user_data['username'],
+                first_name=context.user_data['first_name'],
+                session=session
+            )
+            if referral_info:
+                # Последним шагом: блокировка строки купона держится до коммита
+                referral_status = await db_referrals.reserve_referral_activation(
+                    referral_info['id'], user_id, booking_id, session=session
+                )
+                if referral_status != "reserved":
+                    raise db_referrals.ReferralUnavailable(referral_status)
+    except db_referrals.ReferralUnavailable as e:
+        # Активации купона закончились, пока пользователь выбирал курс — бронь откатывается
+        logger.info(f"Referral coupon {referral_info['id']} unavailable for user {user_id} at booking: {e.status}")
+        context.user_data.pop('pending_referral_code', None)
+        context.user_data.pop('pending_referral_info', None)
+        reason = get_text("REFERRAL", "ALREADY_USED" if e.status == "already_used" else "EXPIRED")
+        await query.edit_message_text(f"{reason}\n{get_text('REFERRAL', 'BOOKING_NOT_CREATED')}")
+        return
+    except psycopg2.Error as e:
+        logger.error(f"Error creating booking for user {user_id}: {e}")
+        booking_id = None
 
     if not booking_id:
         await query.edit_message_text(get_text("BOOKING_FLOW", "BOOKING_FAILED"))
         return
 
-    db_events.log_event(
-        user_id, 
-        'booking_created', 
-        details={'course_id': course_id, 'booking_id': booking_id},
-        username=context.user_data['username'],
-        first_name=context.user_data['first_name']
-    )
-    if referral_info:
-        db_referrals.apply_referral_discount(referral_info['id'], user_id, booking_id)
-
     price_usd = course['price_usd_cents'] / 100
     discounted_price_usd = price_usd * (1 - discount_percent / 100)
     
@@ -182,7 +208,8 @@ async def handle_cancel_reservation(query, context):
         logger.error(f"Invalid cancel callback data: {query.data}")
         return
 
-    if db_bookings.update_booking_status(booking_id, -1):
+    result, _ = await db_bookings.transition_booking_status(booking_id, db_bookings.STATUS_CANCELLED)
+    if result is db_bookings.TransitionResult.APPLIED:
         logger.info(f"User {user_id} cancelled booking {booking_id}")
         # Логируем отмену бронирования
         db_events.log_event(
@@ -193,6 +220,8 @@ async def handle_cancel_reservation(query, context):
             first_name=context.user_data['first_name']
         )
         await query.edit_message_text(get_text("BOOKING_FLOW", "BOOKING_CANCELLED"))
+    elif result is db_bookings.TransitionResult.ALREADY:
+        await query.edit_message_text(get_text("BOOKING_FLOW", "BOOKING_CANCELLED"))
     else:
         await query.edit_message_text(get_text("BOOKING_FLOW", "CANCELLATION_FAILED"))
 
@@ -206,7 +235,13 @@ async def handle_admin_approve(query, context):
         logger.error(f"Invalid admin approve callback: {query.data}")
         return
 
-    if db_bookings.update_booking_status(booking_id, 2):
+    result, booking_details = await db_bookings.transition_booking_status(booking_id, db_bookings.STATUS_APPROVED)
+    if result is db_bookings.TransitionResult.ALREADY:
+        # Повторное нажатие: подтверждение пользователю уже отправлено первым нажатием
+        logger.info(f"Booking {booking_id} is already approved, ignoring repeated approval by admin {query.from_user.id}")
+        return
+
+    if result is db_bookings.TransitionResult.APPLIED:
         logger.info(f"Admin {query.from_user.id} approved payment for booking {booking_id}")
         # Логируем подтверждение админом
         db_events.log_event(
@@ -250,7 +285,6 @@ async def handle_admin_approve(query, context):
             except Exception as fallback_error:
                 logger.error(f"Fallback message edit also failed for booking {booking_id}: {fallback_error}")
         
-        booking_details = db_bookings.get_booking_details(booking_id)
         is_consultation = False # Placeholder, add logic if consultation courses exist
         if booking_details:
             # Example: check if course ID corresponds to a consultation
@@ -259,28 +293,43 @@ async def handle_admin_approve(query, context):
 
         # Получаем информацию о пользователе для персонализации
         user_first_name = booking_details.get('first_name', 'Друг') if booking_details else 'Друг'
+        # Настройки подтверждения курса из каталога: один поиск на все поля
+        confirmation = (get_course_by_id(booking_details['course_id']) or {}).get('confirmation', {}) if booking_details else None
         
         confirmation_text = get_text(
             "ADMIN",
             "CONFIRMATION_MESSAGE",
             first_name=user_first_name,
-            stream_title=(get_course_by_id(booking_details['course_id']).get('confirmation', {}).get('stream_title') if booking_details else 'Поток HashSlash School'),
-            dates_text=(get_course_by_id(booking_details['course_id']).get('confirmation', {}).get('dates_text') if booking_details else ''),
-            first_live_calendar_link=(get_course_by_id(booking_details['course_id']).get('confirmation', {}).get('first_live_calendar_link') if booking_details else get_text('BOOKING', 'CALENDAR_LINK')),
-            group_invite_link=(get_course_by_id(booking_details['course_id']).get('confirmation', {}).get('group_invite_link') if booking_details else ''),
-            support_contact=(get_course_by_id(booking_details['course_id']).get('confirmation', {}).get('support_contact') if booking_details else '@serejaris')
+            stream_title=(confirmation.get('stream_title') if confirmation is not None else 'Поток HashSlash School'),
+            dates_text=(confirmation.get('dates_text') if confirmation is not None else ''),
+            first_live_calendar_link=(confirmation.get('first_live_calendar_link') if confirmation is not None else get_text('BOOKING', 'CALENDAR_LINK')),
+            group_invite_link=(confirmation.get('group_invite_link') if confirmation is not None else ''),
+            support_contact=(confirmation.get('support_contact') if confirmation is not None else '@serejaris')
         )
         
         if is_consultation:
             confirmation_text += f"\n\nПожалуйста, выберите время для консультации: {get_text('BOOKING', 'CALENDAR_LINK')}"
         
         # Отправляем фото с текстом
-        photo_file_id = (get_course_by_id(booking_details['course_id']).get('confirmation', {}).get('approval_photo_file_id') if booking_details else "AgACAgIAAxkBAAE5FuNolBevwD24uQRSmq28gsyV6FWTnQACdvsxG81-oUhX08cmOnTLeQEAAwIAA3kAAzYE")
-        await context.bot.send_photo(
-            chat_id=target_user_id, 
-            photo=photo_file_id,
-            caption=confirmation_text
-        )
+        photo_file_id = (confirmation.get('approval_photo_file_id') if confirmation is not None else "AgACAgIAAxkBAAE5FuNolBevwD24uQRSmq28gsyV6FWTnQACdvsxG81-oUhX08cmOnTLeQEAAwIAA3kAAzYE")
+        delivered = False
+        if not db_blocked.is_blocked(target_user_id):
+            try:
+                await context.bot.send_photo(
+                    chat_id=target_user_id, 
+                    photo=photo_file_id,
+                    caption=confirmation_text
+                )
+                delivered = True
+            except Forbidden as e:
+                logger.warning(f"Approval for booking {booking_id} not delivered, user {target_user_id} blocked the bot: {e}")
+                await record_blocked(target_user_id, e)
+        if not delivered:
+            # Сообщаем админу, что студент не получит подтверждение
+            await context.bot.send_message(
+                chat_id=query.message.chat_id,
+                text=get_text("ADMIN", "STUDENT_UNREACHABLE", booking_id=booking_id, user_id=target_user_id)
+            )
     else:
         await query.edit_message_text(get_text("ADMIN", "APPROVAL_FAILED", booking_id=booking_id))
 
@@ -315,7 +364,7 @@ async def handle_free_lesson_by_id(query, context):
     )
     
     # Проверяем, зарегистрирован ли пользователь на этот конкретный урок
-    is_registered = db_free_lessons.is_user_registered_for_lesson_type(user_id, lesson_type)
+    is_registered = await db_free_lessons.is_user_registered_for_lesson_type(user_id, lesson_type)
     
     text = f"<b>{lesson_data['title']}</b>\n\n{lesson_data['description']}"
     
@@ -359,34 +408,20 @@ async def handle_free_lesson_register_by_id(query, context):
         await query.edit_message_text(f"Урок не найден (ID: {lesson_id})")
         return
     
-    # Проверяем, что урок еще не прошел (с учетом grace period)
-    from datetime import datetime, timedelta, timezone
-    lesson_datetime = lesson_data.get('datetime')
-    if lesson_datetime:
-        # Используем timezone-aware datetime для сравнения
-        current_time = datetime.now(timezone.utc)
-        
-        # Преобразуем lesson_datetime в UTC если у него есть временная зона
-        if lesson_datetime.tzinfo is None:
-            # Если нет временной зоны, считаем что это UTC
-            lesson_datetime = lesson_datetime.replace(tzinfo=timezone.utc)
-        else:
-            # Конвертируем в UTC для сравнения
-            lesson_datetime = lesson_datetime.astimezone(timezone.utc)
-        
-        grace_period = timedelta(hours=2)
-        if current_time > lesson_datetime + grace_period:
-            await query.edit_message_text(
-                "🕐 К сожалению, этот воркшоп уже прошел.\n\n"
-                "Следите за новыми мероприятиями в нашем боте!",
-                parse_mode='HTML'
-            )
-            return
+    # Проверяем, что урок еще не прошел (с учетом grace period, посчитанного при загрузке каталога)
+    lesson_times = get_lesson_times(lesson_type)
+    if lesson_times and datetime.now(timezone.utc) > lesson_times.visible_until:
+        await query.edit_message_text(
+            "🕐 К сожалению, этот воркшоп уже прошел.\n\n"
+            "Следите за новыми мероприятиями в нашем боте!",
+            parse_mode='HTML'
+        )
+        return
     
     user_id = context.user_data['user_id']
     
     # Проверяем, не записан ли пользователь уже на этот урок
-    if db_free_lessons.is_user_registered_for_lesson_type(user_id, lesson_type):
+    if await db_free_lessons.is_user_registered_for_lesson_type(user_id, lesson_type):
         message = get_text("FREE_LESSON", "ALREADY_REGISTERED").format(
             date=lesson_data.get('date_text', 'Дата уточняется')  # Use date_text field instead of full description
         )
@@ -1,4 +1,8 @@
+import csv
+import html
+import io
 import logging
+from datetime import datetime, timezone
 from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
 from telegram.ext import ContextTypes
 from telegram.constants import ParseMode
@@ -7,10 +11,16 @@ import config
 from handlers.callbacks import *
 from locales.ru import get_text
 # Removed escape_markdown_v2 import - using HTML now
-from utils.lessons import get_active_lessons
-from utils.courses import get_active_courses
-from db import events as db_events
-from db import referrals as db_referrals
+from utils.catalog import get_catalog
+from utils.notifications import get_reminder_capacity_plan
+from utils.delivery_lag import merge_run_rows
+from utils.fanout import format_duration
+from utils.broadcasts import segment_label, start_broadcast
+from db import aio as db_aio
+from db.aio import broadcasts as db_broadcasts
+from db.aio import events as db_events
+from db.aio import referrals as db_referrals
+from db.aio import reminder_runs as db_reminder_runs
 
 logger = logging.getLogger(__name__)
 
@@ -29,7 +39,7 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         start_param = context.args[0]
         if start_param.startswith(config.REFERRAL_START_PARAMETER):
             referral_code = start_param[len(config.REFERRAL_START_PARAMETER):]
-            coupon, status = db_referrals.validate_referral_code(referral_code, user.id)
+            coupon, status = await db_referrals.validate_referral_code(referral_code, user.id)
 
             logger.info(f"Referral attempt by user {user.id} with code {referral_code}. Status: {status}")
             if status == "valid":
@@ -52,16 +62,20 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 discount_msg += f"\n📊 Осталось активаций: {remaining}"
                 
                 await update.message.reply_text(discount_msg)
+            elif status == "already_used":
+                await update.message.reply_text(get_text("REFERRAL", "ALREADY_USED"))
             else:
                 await update.message.reply_text(get_text("REFERRAL", "EXPIRED"))
 
-    active_courses = get_active_courses()
-    
+    message_text, reply_markup = _start_screen()
+    await update.message.reply_text(message_text, reply_markup=reply_markup, parse_mode='HTML', disable_web_page_preview=True)
+
+def _render_start_screen(catalog, now):
+    """Текст и клавиатура /start для снимка каталога в момент now."""
     keyboard = []
     
     # Добавляем кнопки бесплатных уроков, если они активны
-    active_lessons = get_active_lessons()
-    for lesson_type, lesson_data in active_lessons.items():
+    for lesson_type, lesson_data in catalog.active_lessons(now).items():
         callback_data = f"{CALLBACK_FREE_LESSON_PREFIX}{lesson_data['id']}"
         keyboard.append([InlineKeyboardButton(
             lesson_data['button_text'], 
@@ -69,8 +83,8 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )])
     
     # Добавляем кнопки курсов
-    if active_courses:
-        for course in active_courses:
+    if catalog.active_courses:
+        for course in catalog.active_courses:
             callback_data = f"{CALLBACK_SELECT_COURSE_PREFIX}{course['id']}"
             keyboard.append([InlineKeyboardButton(course['button_text'], callback_data=callback_data)])
         message_text = get_text("START", "WELCOME_WITH_COURSES")
@@ -78,7 +92,23 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         message_text = get_text("START", "WELCOME_NO_COURSES")
 
     reply_markup = InlineKeyboardMarkup(keyboard) if keyboard else None
-    await update.message.reply_text(message_text, reply_markup=reply_markup, parse_mode='HTML', disable_web_page_preview=True)
+    return message_text, reply_markup
+
+# Экран /start меняется только с каталогом или с наступлением перехода его timeline:
+# ((версия каталога, epoch), (текст, клавиатура)). Объекты Telegram неизменяемы, их можно отдавать всем
+_start_screen_cache = None
+
+def _start_screen():
+    global _start_screen_cache
+    catalog = get_catalog()
+    now = datetime.now(timezone.utc)
+    key = (catalog.version, catalog.epoch(now))
+    cached = _start_screen_cache
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    screen = _render_start_screen(catalog, now)
+    _start_screen_cache = (key, screen)
+    return screen
 
 async def reset_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Clears all user data for the current chat session."""
@@ -94,8 +124,42 @@ async def reset_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     logger.info(f"User {user.id} reset their session.")
     await update.message.reply_text(get_text("RESET", "SESSION_CLEARED"))
 
+def _referral_link(bot_username, code):
+    return f"https://t.me/{bot_username}?start={config.REFERRAL_START_PARAMETER}{code}"
+
+def _build_referral_codes_csv(codes, discount, activations, bot_username):
+    """Builds the CSV document (UTF-8 with BOM, so Excel opens it correctly) for bulk-created codes."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(["code", "link", "discount_percent", "max_activations"])
+    for code in codes:
+        writer.writerow([code, _referral_link(bot_username, code), discount, activations])
+    return buffer.getvalue().encode('utf-8-sig')
+
+async def _send_bulk_referral_codes(update, context, user, discount, activations, count):
+    """Creates `count` coupons in one transaction and replies with them as a CSV document."""
+    async with db_aio.transaction() as session:
+        codes = await db_referrals.generate_referral_codes(count, discount, activations, user.id, session=session)
+        db_events.log_event(
+            user.id,
+            'referral_bulk_created',
+            details={'count': len(codes), 'discount': discount, 'activations': activations},
+            username=user.username,
+            first_name=user.first_name,
+            session=session
+        )
+    logger.info(f"Admin {user.id} created {len(codes)} referral codes ({discount}%, {activations} activations)")
+
+    document = _build_referral_codes_csv(codes, discount, activations, context.bot.username)
+    filename = f"referral_codes_{discount}pct_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+    await update.message.reply_document(
+        document=document,
+        filename=filename,
+        caption=get_text("REFERRAL_ADMIN", "BULK_CREATED_OK", count=len(codes), discount=discount, activations=activations)
+    )
+
 async def create_referral_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Admin command to create a new referral coupon."""
+    """Admin command to create a new referral coupon, or a batch of them with an `x<count>` argument."""
     user = update.message.from_user
     if config.REFERRAL_ADMIN_IDS and user.id not in config.REFERRAL_ADMIN_IDS:
         await update.message.reply_text(get_text("REFERRAL_ADMIN", "NO_RIGHTS"))
@@ -113,18 +177,34 @@ async def create_referral_command(update: Update, context: ContextTypes.DEFAULT_
             await update.message.reply_text(get_text("REFERRAL_ADMIN", "INVALID_FORMAT"))
             return
 
-        code = db_referrals.generate_and_save_referral_code(discount, activations, user.id)
-        bot_username = context.bot.username
-        link = f"https://t.me/{bot_username}?start={config.REFERRAL_START_PARAMETER}{code}"
+        count = 1
+        if len(context.args) > 2:
+            count_arg = context.args[2].lower()
+            if not count_arg.startswith('x'):
+                raise ValueError(f"Invalid count argument: {context.args[2]}")
+            count = int(count_arg[1:])
+        if not 1 <= count <= config.REFERRAL_BULK_MAX_CODES:
+            await update.message.reply_text(
+                get_text("REFERRAL_ADMIN", "BULK_LIMIT", max_codes=config.REFERRAL_BULK_MAX_CODES)
+            )
+            return
+        if count > 1:
+            await _send_bulk_referral_codes(update, context, user, discount, activations, count)
+            return
+
+        async with db_aio.transaction() as session:
+            code = await db_referrals.generate_and_save_referral_code(discount, activations, user.id, session=session)
+            # Логируем создание реферального кода
+            db_events.log_event(
+                user.id, 
+                'referral_created',
+                details={'code': code, 'discount': discount, 'activations': activations},
+                username=user.username,
+                first_name=user.first_name,
+                session=session
+            )
+        link = _referral_link(context.bot.username, code)
 
-        # Логируем создание реферального кода
-        db_events.log_event(
-            user.id, 
-            'referral_created',
-            details={'code': code, 'discount': discount, 'activations': activations},
-            username=user.username,
-            first_name=user.first_name
-        )
         logger.info(f"Admin {user.id} created a new referral code: {code}")
         message_text = get_text(
             "REFERRAL_ADMIN",
@@ -155,7 +235,7 @@ async def referral_stats_command(update: Update, context: ContextTypes.DEFAULT_T
         await update.message.reply_text(get_text("REFERRAL_STATS", "NO_RIGHTS"))
         return
 
-    coupons = db_referrals.get_referral_stats()
+    coupons = await db_referrals.get_referral_stats()
     if not coupons:
         await update.message.reply_text(get_text("REFERRAL_STATS", "EMPTY"))
         return
@@ -184,7 +264,7 @@ async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         first_name=user.first_name
     )
     try:
-        stats = db_events.get_stats_summary()
+        stats = await db_events.get_stats_summary()
         message = get_text(
             "STATS",
             "TEMPLATE",
@@ -196,4 +276,237 @@ async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text(message, parse_mode='HTML')
     except Exception as e:
         logger.error(f"Error getting stats: {e}")
-        await update.message.reply_text("Не удалось получить статистику.")
\ No newline at end of file
+        await update.message.reply_text("Не удалось получить статистику.")
+
+def _is_admin(update: Update) -> bool:
+    """
+    Права на рассылки и отчеты по напоминаниям. В отличие от реферальных
+    команд доступ закрыт по умолчанию: пользователь из REFERRAL_ADMIN_IDS,
+    а если список пуст — только команды из чата админов TARGET_CHAT_ID.
+    """
+    if config.REFERRAL_ADMIN_IDS:
+        return update.message.from_user.id in config.REFERRAL_ADMIN_IDS
+    return config.TARGET_CHAT_ID != 0 and update.effective_chat.id == config.TARGET_CHAT_ID
+
+async def reminders_plan_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Admin command: projected duration of the upcoming reminder fan-outs."""
+    user = update.message.from_user
+    db_events.log_event(
+        user.id,
+        'reminders_plan_requested',
+        username=user.username,
+        first_name=user.first_name
+    )
+    if not _is_admin(update):
+        await update.message.reply_text(get_text("REMINDER_PLAN", "NO_RIGHTS"))
+        return
+
+    try:
+        plan = await get_reminder_capacity_plan()
+    except Exception as e:
+        logger.error(f"Error building reminder capacity plan: {e}")
+        await update.message.reply_text("Не удалось построить прогноз рассылки.")
+        return
+    if not plan:
+        await update.message.reply_text(get_text("REMINDER_PLAN", "EMPTY"))
+        return
+
+    lines = [get_text("REMINDER_PLAN", "HEADER", rate=config.TELEGRAM_GLOBAL_RATE)]
+    for lesson_status in plan.values():
+        lines.append(get_text("REMINDER_PLAN", "LESSON",
+                              title=html.escape(lesson_status['lesson_title']),
+                              lesson_datetime=lesson_status['lesson_datetime']))
+        stages = [stage for stage in lesson_status['stages'] if not stage['outdated']]
+        if not stages:
+            lines.append(get_text("REMINDER_PLAN", "NO_STAGES"))
+        for stage in stages:
+            minutes = stage['minutes_before_lesson']
+            margin = (get_text("REMINDER_PLAN", "MARGIN_BEFORE", minutes=minutes) if minutes >= 0
+                      else get_text("REMINDER_PLAN", "MARGIN_AFTER", minutes=-minutes))
+            lines.append(get_text(
+                "REMINDER_PLAN",
+                "STAGE",
+                stage=stage['stage'],
+                notification_datetime=stage['notification_datetime'],
+                recipients=stage['recipients'],
+                blocked=stage['blocked'],
+                duration=format_duration(stage['send_seconds']),
+                last_recipient=stage['last_recipient_at'].strftime('%Y-%m-%d %H:%M:%S'),
+                margin=margin
+            ))
+            if stage['misses_lesson']:
+                lines.append(get_text("REMINDER_PLAN", "MISSES_LESSON"))
+    await update.message.reply_text("\n".join(lines), parse_mode='HTML')
+
+async def reminder_lag_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Admin command: delivery lag percentiles of the latest reminder runs (/reminder_lag [N])."""
+    user = update.message.from_user
+    db_events.log_event(
+        user.id,
+        'reminder_lag_requested',
+        username=user.username,
+        first_name=user.first_name
+    )
+    if not _is_admin(update):
+        await update.message.reply_text(get_text("REMINDER_LAG", "NO_RIGHTS"))
+        return
+
+    limit = 5
+    if context.args and context.args[0].isdigit():
+        limit = min(max(int(context.args[0]), 1), 20)
+    try:
+        runs = merge_run_rows(await db_reminder_runs.get_recent_runs(limit))
+    except Exception as e:
+        logger.error(f"Error loading reminder delivery runs: {e}")
+        await update.message.reply_text("Не удалось получить задержки рассылок.")
+        return
+    if not runs:
+        await update.message.reply_text(get_text("REMINDER_LAG", "EMPTY"))
+        return
+
+    lines = [get_text("REMINDER_LAG", "HEADER", count=len(runs))]
+    for run in runs:
+        first, last = run['first_delivery_at'], run['last_delivery_at']
+        lines.append(get_text(
+            "REMINDER_LAG",
+            "RUN",
+            lesson_type=html.escape(run['lesson_type']),
+            stage=html.escape(run['stage']),
+            scheduled_at=run['scheduled_at'].strftime('%Y-%m-%d %H:%M'),
+            sent=run['sent'],
+            failed=run['failed'],
+            skipped=run['skipped'],
+            retries=run['retries'],
+            instances=run['instances'],
+            p50=format_duration(run['lag_p50']),
+            p95=format_duration(run['lag_p95']),
+            p99=format_duration(run['lag_p99']),
+            max=format_duration(run['lag_max']),
+            first_delivery=first.strftime('%H:%M:%S') if first else '—',
+            last_delivery=last.strftime('%H:%M:%S') if last else '—',
+            avg_send=run['avg_send_seconds']
+        ))
+    await update.message.reply_text("\n".join(lines), parse_mode='HTML')
+
+def _segments_help():
+    return "\n".join(
+        get_text(
+            "BROADCAST",
+            "SEGMENT_LINE",
+            name=name,
+            arg=f" &lt;{segment.arg_name}&gt;" if segment.arg_name else "",
+            description=segment.description
+        )
+        for name, segment in db_broadcasts.SEGMENTS.items()
+    )
+
+async def broadcast_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Admin command: creates a draft broadcast of the replied-to message (/broadcast <segment> [arg])."""
+    user = update.message.from_user
+    db_events.log_event(
+        user.id,
+        'broadcast_requested',
+        details={'args': context.args},
+        username=user.username,
+        first_name=user.first_name
+    )
+    if not _is_admin(update):
+        await update.message.reply_text(get_text("BROADCAST", "NO_RIGHTS"))
+        return
+
+    if not context.args:
+        await update.message.reply_text(get_text("BROADCAST", "USAGE_HINT", segments=_segments_help()), parse_mode='HTML')
+        return
+    segment_name = context.args[0]
+    segment = db_broadcasts.SEGMENTS.get(segment_name)
+    if segment is None:
+        await update.message.reply_text(get_text("BROADCAST", "UNKNOWN_SEGMENT", segments=_segments_help()), parse_mode='HTML')
+        return
+    arg = context.args[1] if len(context.args) > 1 else None
+    if segment.arg_name and not arg:
+        await update.message.reply_text(
+            get_text("BROADCAST", "MISSING_ARG", segment=html.escape(segment_name), arg_name=segment.arg_name),
+            parse_mode='HTML'
+        )
+        return
+    source = update.message.reply_to_message
+    if source is None:
+        await update.message.reply_text(get_text("BROADCAST", "NO_MESSAGE"))
+        return
+
+    try:
+        broadcast = await db_broadcasts.create_broadcast(
+            segment_name, arg if segment.arg_name else None, source.chat_id, source.message_id, user.id
+        )
+    except Exception as e:
+        logger.error(f"Error creating broadcast: {e}")
+        await update.message.reply_text("Не удалось создать рассылку.")
+        return
+    await update.message.reply_text(
+        get_text(
+            "BROADCAST",
+            "CREATED",
+            id=broadcast['id'],
+            segment=html.escape(segment_label(broadcast['segment'], broadcast['segment_arg'])),
+            total=broadcast['total_recipients']
+        ),
+        parse_mode='HTML'
+    )
+
+async def _broadcast_from_args(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Loads the broadcast whose id is the command's argument, answering the admin if there is none."""
+    if not context.args or not context.args[0].isdigit():
+        await update.message.reply_text(get_text("BROADCAST", "ID_HINT"))
+        return None
+    broadcast_id = int(context.args[0])
+    broadcast = await db_broadcasts.get_broadcast(broadcast_id)
+    if broadcast is None:
+        await update.message.reply_text(get_text("BROADCAST", "NOT_FOUND", id=broadcast_id))
+    return broadcast
+
+async def broadcast_start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Admin command: starts a draft broadcast (/broadcast_start <id>)."""
+    user = update.message.from_user
+    db_events.log_event(
+        user.id,
+        'broadcast_start_requested',
+        details={'args': context.args},
+        username=user.username,
+        first_name=user.first_name
+    )
+    if not _is_admin(update):
+        await update.message.reply_text(get_text("BROADCAST", "NO_RIGHTS"))
+        return
+
+    broadcast = await _broadcast_from_args(update, context)
+    if broadcast is None:
+        return
+    if not await start_broadcast(broadcast['id']):
+        await update.message.reply_text(get_text("BROADCAST", "NOT_DRAFT", id=broadcast['id'], status=broadcast['status']))
+        return
+    await update.message.reply_text(get_text("BROADCAST", "STARTED", id=broadcast['id']))
+
+async def broadcast_cancel_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Admin command: cancels a draft or running broadcast (/broadcast_cancel <id>)."""
+    user = update.message.from_user
+    db_events.log_event(
+        user.id,
+        'broadcast_cancel_requested',
+        details={'args': context.args},
+        username=user.username,
+        first_name=user.first_name
+    )
+    if not _is_admin(update):
+        await update.message.reply_text(get_text("BROADCAST", "NO_RIGHTS"))
+        return
+
+    broadcast = await _broadcast_from_args(update, context)
+    if broadcast is None:
+        return
+    # Запущенная рассылка останавливается после текущей порции получателей
+    if not await db_broadcasts.set_broadcast_status(
+            broadcast['id'], db_broadcasts.STATUS_CANCELLED,
+            [db_broadcasts.STATUS_DRAFT, db_broadcasts.STATUS_RUNNING]):
+        await update.message.reply_text(get_text("BROADCAST", "NOT_CANCELLABLE", id=broadcast['id'], status=broadcast['status']))
+        return
+    await update.message.reply_text(get_text("BROADCAST", "CANCELLED", id=broadcast['id']))
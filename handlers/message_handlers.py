@@ -9,9 +9,10 @@ from locales.ru import get_text
 from utils import get_user_identification, get_course_flow_info
 from utils.courses import get_course_by_id
 from utils.lessons import get_lesson_by_type
-from db import bookings as db_bookings
-from db import events as db_events
-from db import free_lessons as db_free_lessons
+from db import aio as db_aio
+from db.aio import bookings as db_bookings
+from db.aio import events as db_events
+from db.aio import free_lessons as db_free_lessons
 
 logger = logging.getLogger(__name__)
 
@@ -84,7 +85,7 @@ async def photo_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
     logger.info(f"Photo received from user {user.id} ({user.first_name})")
 
-    booking_record = db_bookings.get_pending_booking_by_user(user.id)
+    booking_record = await db_bookings.get_pending_booking_by_user(user.id)
 
     if not booking_record:
         logger.warning(f"Photo from user {user.id} received, but no active booking found.")
@@ -95,7 +96,8 @@ async def photo_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     course_name = booking_record['course_name']
     course_stream = booking_record.get('course_stream', '4th_stream')
     
-    if not db_bookings.update_booking_status(booking_id, 1):
+    result, _ = await db_bookings.transition_booking_status(booking_id, db_bookings.STATUS_PAYMENT_UPLOADED)
+    if result is db_bookings.TransitionResult.INVALID:
         await update.message.reply_text("Произошла ошибка при обновлении статуса заявки.")
         return
 
@@ -144,7 +146,7 @@ async def any_message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE
         return
     
     # Check if user has any active booking (pending, uploaded, or approved)
-    booking_record = db_bookings.get_active_booking_by_user(user.id)
+    booking_record = await db_bookings.get_active_booking_by_user(user.id)
     
     if not booking_record:
         # User doesn't have active booking, ignore the message
@@ -175,7 +177,8 @@ async def any_message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE
     
     # Update booking status only if it's pending (0)
     if booking_status == 0:
-        if not db_bookings.update_booking_status(booking_id, 1):
+        result, _ = await db_bookings.transition_booking_status(booking_id, db_bookings.STATUS_PAYMENT_UPLOADED)
+        if result is db_bookings.TransitionResult.INVALID:
             await update.message.reply_text("Произошла ошибка при обновлении статуса заявки.")
             return
         logger.info(f"Booking {booking_id} for user {user.id} updated to 'payment uploaded' status (1).")
@@ -269,15 +272,31 @@ async def handle_email_input(update: Update, context: ContextTypes.DEFAULT_TYPE)
         if lesson_datetime:
             lesson_date = lesson_datetime.date()  # Извлекаем только дату из datetime объекта
     
-    # Создаём регистрацию с указанием lesson_type и lesson_date
-    registration_id = db_free_lessons.create_free_lesson_registration(
-        user.id,
-        user.username,
-        user.first_name,
-        email,
-        lesson_type=lesson_type,
-        lesson_date=lesson_date
-    )
+    # Создаём регистрацию с указанием lesson_type и lesson_date; событие пишется в той же транзакции
+    try:
+        async with db_aio.transaction() as session:
+            registration_id = await db_free_lessons.create_free_lesson_registration(
+                user.id,
+                user.username,
+                user.first_name,
+                email,
+                lesson_type=lesson_type,
+                lesson_date=lesson_date,
+                session=session
+            )
+            if registration_id:
+                # Логируем успешную регистрацию
+                db_events.log_event(
+                    user.id, 
+                    'free_lesson_registered',
+                    details={'email': email, 'registration_id': registration_id, 'lesson_type': lesson_type},
+                    username=user.username,
+                    first_name=user.first_name,
+                    session=session
+                )
+    except Exception as e:
+        logger.error(f"Error creating free lesson registration for user {user.id}: {e}")
+        registration_id = False
     
     if registration_id:
         # Успешная регистрация
@@ -285,15 +304,6 @@ async def handle_email_input(update: Update, context: ContextTypes.DEFAULT_TYPE)
         context.user_data.pop('awaiting_free_lesson_email', None)
         context.user_data.pop('pending_lesson_type', None)
         
-        # Логируем успешную регистрацию
-        db_events.log_event(
-            user.id, 
-            'free_lesson_registered',
-            details={'email': email, 'registration_id': registration_id, 'lesson_type': lesson_type},
-            username=user.username,
-            first_name=user.first_name
-        )
-        
         # Формируем сообщение об успешной регистрации
         if lesson_data:
             date_info = lesson_data.get('date_text', 'информация о дате будет отправлена дополнительно')
@@ -7,16 +7,21 @@
 FREE_LESSON = {
     "EMAIL_REQUEST": "📧 Для записи на бесплатный урок введите ваш email адрес:",
     "EMAIL_INVALID": "❌ Неверный формат email. Пожалуйста, введите корректный email адрес (например: example@mail.com)",
-    "REGISTRATION_SUCCESS": "✅ Отлично! Вы записаны на бесплатный урок.\n\n📅 Дата: {date}\n📧 Email: {email}\n\n🔔 Ссылка на видеовстречу будет отправлена сюда за 15 минут перед началом урока.",
+    "REGISTRATION_SUCCESS": "✅ Отлично! Вы записаны на бесплатный урок.\n\n📅 Дата: {date}\n📧 Email: {email}\n\n🔔 Напоминания и ссылка на видеовстречу придут сюда перед началом урока.",
     "ALREADY_REGISTERED": "ℹ️ Вы уже зарегистрированы на бесплатный урок.\n\n📅 Дата: {date}\n🔔 Ссылка будет отправлена перед началом.",
-    "REMINDER": "🎯 Бесплатный урок уже скоро!\n\n📅 {date}\n🔗 Ссылка: {link}\n\nУвидимся на уроке! 👋"
+    "REMINDER": "🎯 Бесплатный урок уже скоро!\n\n📅 {date}\n🔗 Ссылка: {link}\n\nУвидимся на уроке! 👋",
+    # Одно сообщение вместо нескольких напоминаний об уроках, идущих друг за другом
+    "COALESCED_REMINDER_HEADER": "⏰ Скоро начинаются ваши уроки:",
+    "COALESCED_REMINDER_LINE": "• <b>{title}</b> — {when}",
+    "COALESCED_REMINDER_FOOTER": "Кнопки ниже ведут на каждый урок. Увидимся! 👋"
 }
 
 # Сообщения реферальной системы
 REFERRAL = {
     "APPLIED": "🎉 Применен купон на {discount}% скидку!",
     "EXPIRED": "❌ К сожалению, этот купон больше не активен.",
-    "ALREADY_USED": "❌ Вы уже использовали этот купон ранее."
+    "ALREADY_USED": "❌ Вы уже использовали этот купон ранее.",
+    "BOOKING_NOT_CREATED": "Бронь не создана. Выберите курс заново через /start — цена будет без скидки."
 }
 
 # Общие сообщения
@@ -53,8 +58,13 @@ RESET = {
 # Админские команды для рефералов (HTML)
 REFERRAL_ADMIN = {
     "NO_RIGHTS": "❌ У вас нет прав для выполнения этой команды.",
-    "USAGE_HINT": "Использование: /create_referral <процент> <активации>",
-    "INVALID_FORMAT": "❌ Неверный формат. Пример: /create_referral 20 10",
+    "USAGE_HINT": (
+        "Использование: /create_referral <процент> <активации> [x<количество>]\n"
+        "Например, /create_referral 20 1 x500 создаст 500 одноразовых купонов и пришлёт их CSV-файлом."
+    ),
+    "INVALID_FORMAT": "❌ Неверный формат. Пример: /create_referral 20 10 или /create_referral 20 1 x500",
+    "BULK_LIMIT": "❌ За один раз можно создать от 1 до {max_codes} купонов.",
+    "BULK_CREATED_OK": "✅ Создано купонов: {count}\nСкидка: {discount}%\nАктиваций у каждого: {activations}",
     "CREATED_OK": (
         "✅ Купон создан!\n"
         "Код: <code>{code}</code>\n"
@@ -85,6 +95,75 @@ STATS = {
     )
 }
 
+# Прогноз рассылки напоминаний (HTML)
+REMINDER_PLAN = {
+    "NO_RIGHTS": "❌ У вас нет прав для просмотра прогноза рассылок.",
+    "EMPTY": "📭 Нет активных уроков с напоминаниями.",
+    "HEADER": "📈 <b>Прогноз рассылки напоминаний</b>\nЛимит: {rate:g} сообщений/с",
+    "LESSON": "\n<b>{title}</b> — начало {lesson_datetime} UTC",
+    "STAGE": (
+        "  • Этап <b>{stage}</b> ({notification_datetime} UTC): получателей {recipients}, "
+        "заблокировали бота {blocked}\n"
+        "    Рассылка ≈ {duration}, последний получит в {last_recipient} UTC ({margin})"
+    ),
+    "MARGIN_BEFORE": "за {minutes:.0f} мин до начала",
+    "MARGIN_AFTER": "через {minutes:.0f} мин после начала",
+    "MISSES_LESSON": "    ⚠️ Рассылка не успевает к началу урока!",
+    "NO_STAGES": "  Все напоминания уже отправлены или устарели."
+}
+
+# Фактическая задержка доставки напоминаний (HTML)
+REMINDER_LAG = {
+    "NO_RIGHTS": "❌ У вас нет прав для просмотра задержек рассылок.",
+    "EMPTY": "📭 Рассылок напоминаний еще не было.",
+    "HEADER": "⏱ <b>Задержка доставки напоминаний</b> (последние {count})",
+    "RUN": (
+        "\n<b>{lesson_type}</b> / {stage} — по плану {scheduled_at} UTC\n"
+        "  Отправлено {sent}, ошибок {failed}, пропущено {skipped}, повторов {retries} (экземпляров: {instances})\n"
+        "  Задержка p50 {p50} · p95 {p95} · p99 {p99} · max {max}\n"
+        "  Доставка: {first_delivery} → {last_delivery} UTC, в среднем {avg_send:.2f} с на сообщение"
+    )
+}
+
+# Рассылки админа по сегментам пользователей (HTML)
+BROADCAST = {
+    "NO_RIGHTS": "❌ У вас нет прав для рассылок.",
+    "USAGE_HINT": (
+        "Использование: ответьте на сообщение для рассылки командой\n"
+        "/broadcast <сегмент> [аргумент]\n\nСегменты:\n{segments}\n\n"
+        "Затем /broadcast_start <номер> или /broadcast_cancel <номер>."
+    ),
+    "SEGMENT_LINE": "• <code>{name}</code>{arg} — {description}",
+    "UNKNOWN_SEGMENT": "❌ Неизвестный сегмент. Доступные:\n{segments}",
+    "MISSING_ARG": "❌ Для сегмента {segment} нужен аргумент: {arg_name}",
+    "NO_MESSAGE": "❌ Ответьте этой командой на сообщение, которое нужно разослать.",
+    "CREATED": (
+        "📝 Рассылка №{id} создана: сегмент {segment}, получателей {total}.\n"
+        "Запуск: /broadcast_start {id}"
+    ),
+    "ID_HINT": "Укажите номер рассылки, например: /broadcast_start 3",
+    "NOT_FOUND": "❌ Рассылка №{id} не найдена.",
+    "NOT_DRAFT": "❌ Рассылку №{id} нельзя запустить: статус {status}.",
+    "STARTED": "🚀 Рассылка №{id} запущена, прогресс будет в следующем сообщении.",
+    "NOT_CANCELLABLE": "❌ Рассылку №{id} нельзя отменить: статус {status}.",
+    "CANCELLED": "⛔ Рассылка №{id} отменена.",
+    "REPORT_PROGRESS": (
+        "📣 <b>Рассылка №{id}</b> ({segment})\n"
+        "Обработано {processed} из {total} ({percent}%): отправлено {sent}, ошибок {failed}, "
+        "заблокировали бота {skipped}\n{speed}"
+    ),
+    "REPORT_STARTING": "Скорость и оставшееся время появятся после первой порции.",
+    "REPORT_SPEED": "Скорость {rate:.1f} сообщений/с, осталось ≈ {eta}",
+    "REPORT_DONE": (
+        "✅ <b>Рассылка №{id}</b> ({segment}) завершена за {duration}\n"
+        "Отправлено {sent}, ошибок {failed}, заблокировали бота {skipped}"
+    ),
+    "REPORT_CANCELLED": (
+        "⛔ <b>Рассылка №{id}</b> ({segment}) отменена\n"
+        "Отправлено {sent}, ошибок {failed}, заблокировали бота {skipped}"
+    )
+}
+
 # Поток бронирования / общий пользовательский флоу
 BOOKING_FLOW = {
     "COURSE_UNAVAILABLE": "Извините, этот курс больше не доступен.",
@@ -122,6 +201,7 @@ BOOKING_FLOW = {
 ADMIN = {
     "APPROVED_BADGE": "✅ ОДОБРЕНО - {timestamp}",
     "APPROVAL_FAILED": "⚠️ Не удалось подтвердить заявку №{booking_id}. Возможно, она уже обработана.",
+    "STUDENT_UNREACHABLE": "⚠️ Заявка №{booking_id} подтверждена, но пользователь {user_id} заблокировал бота — подтверждение не доставлено.",
     # Шаблон подтверждения оплаты пользователю после одобрения
     "CONFIRMATION_MESSAGE": (
         "Привет, {first_name}!\n\n"
@@ -154,6 +234,9 @@ def get_text(category: str, key: str, **kwargs) -> str:
         "REFERRAL_ADMIN": REFERRAL_ADMIN,
         "REFERRAL_STATS": REFERRAL_STATS,
         "STATS": STATS,
+        "REMINDER_PLAN": REMINDER_PLAN,
+        "REMINDER_LAG": REMINDER_LAG,
+        "BROADCAST": BROADCAST,
         "BOOKING_FLOW": BOOKING_FLOW,
         "ADMIN": ADMIN
     }
@@ -0,0 +1,140 @@
+# utils/broadcasts.py
+"""
+Runner of admin broadcasts (see db.broadcasts).
+
+A started broadcast is a BROADCAST_JOB_TYPE job of the scheduler keyed by
+the broadcast id. The job streams the segment's recipients after the last
+checkpoint, copies the admin's message to them chunk by chunk with fan_out
+and checkpoints every chunk, so after a restart the requeued job resumes
+where it stopped, re-sending at most the chunk that was in flight.
+Throughput and ETA are kept up to date in one message in the admin chat.
+"""
+import html
+import logging
+import time
+from contextlib import aclosing
+from datetime import datetime, timezone
+from telegram.ext import Application
+from telegram.error import BadRequest, TelegramError
+
+import config
+from locales.ru import get_text
+from utils.fanout import LayeredBucket, TokenBucket, fan_out, format_duration, telegram_bucket
+from utils.scheduler import scheduler
+from db.aio import broadcasts as db_broadcasts
+from db.aio import scheduled_jobs as db_jobs
+
+logger = logging.getLogger(__name__)
+
+# Тип задачи в scheduled_jobs для рассылок, job_key — id рассылки
+BROADCAST_JOB_TYPE = 'broadcast'
+
+# Собственный лимит рассылок внутри общего лимита бота: напоминаниям остается запас
+broadcast_bucket = LayeredBucket(TokenBucket(config.BROADCAST_RATE), telegram_bucket)
+
+def segment_label(segment, arg=None):
+    return f"{segment} {arg}" if arg else segment
+
+async def start_broadcast(broadcast_id):
+    """Moves a draft to running and schedules its job. Returns False if it is not a draft."""
+    if not await db_broadcasts.set_broadcast_status(
+            broadcast_id, db_broadcasts.STATUS_RUNNING, [db_broadcasts.STATUS_DRAFT]):
+        return False
+    await scheduler.schedule(BROADCAST_JOB_TYPE, str(broadcast_id), datetime.now(timezone.utc))
+    return True
+
+def _report_text(broadcast, rate=None):
+    processed = broadcast['sent'] + broadcast['failed'] + broadcast['skipped']
+    total = max(broadcast['total_recipients'], processed)
+    counters = dict(
+        id=broadcast['id'],
+        segment=html.escape(segment_label(broadcast['segment'], broadcast['segment_arg'])),
+        sent=broadcast['sent'],
+        failed=broadcast['failed'],
+        skipped=broadcast['skipped'],
+    )
+    if broadcast['status'] == db_broadcasts.STATUS_CANCELLED:
+        return get_text("BROADCAST", "REPORT_CANCELLED", **counters)
+    if broadcast['status'] == db_broadcasts.STATUS_DONE:
+        started_at = broadcast['started_at'] or datetime.now(timezone.utc)
+        return get_text("BROADCAST", "REPORT_DONE",
+                        duration=format_duration((datetime.now(timezone.utc) - started_at).total_seconds()),
+                        **counters)
+    if rate:
+        speed = get_text("BROADCAST", "REPORT_SPEED", rate=rate,
+                         eta=format_duration((total - processed) / rate))
+    else:
+        speed = get_text("BROADCAST", "REPORT_STARTING")
+    return get_text("BROADCAST", "REPORT_PROGRESS", processed=processed, total=total,
+                    percent=processed * 100 // total if total else 100, speed=speed, **counters)
+
+async def _report(bot, broadcast, rate=None):
+    """Edits the broadcast's report message in the admin chat, or sends it the first time."""
+    text = _report_text(broadcast, rate)
+    try:
+        if broadcast['report_message_id']:
+            await bot.edit_message_text(text, chat_id=broadcast['source_chat_id'],
+                                        message_id=broadcast['report_message_id'], parse_mode='HTML')
+            return
+        message = await bot.send_message(broadcast['source_chat_id'], text, parse_mode='HTML')
+        broadcast['report_message_id'] = message.message_id
+        await db_broadcasts.set_report_message(broadcast['id'], message.message_id)
+    except BadRequest as e:
+        # "message is not modified" или отчет удален админом — рассылка продолжается
+        logger.warning(f"Could not update report of broadcast {broadcast['id']}: {e}")
+    except TelegramError as e:
+        logger.warning(f"Could not send report of broadcast {broadcast['id']}: {e}")
+
+async def run_broadcast_job(application: Application, job: dict):
+    """
+    Обработчик задачи BROADCAST_JOB_TYPE для планировщика.
+    Продолжает рассылку с последней сохраненной точки; отмененная или уже
+    завершенная рассылка пропускается.
+    """
+    broadcast_id = int(job['job_key'])
+    broadcast = await db_broadcasts.get_broadcast(broadcast_id)
+    if broadcast is None or broadcast['status'] != db_broadcasts.STATUS_RUNNING:
+        logger.info(f"Broadcast {broadcast_id} is not running, skipping")
+        return db_jobs.STATUS_SKIPPED
+
+    bot = application.bot
+    if broadcast['last_user_id']:
+        logger.info(f"Resuming broadcast {broadcast_id} after user {broadcast['last_user_id']}")
+    else:
+        logger.info(f"Starting broadcast {broadcast_id} to {broadcast['total_recipients']} recipients")
+    await _report(bot, broadcast)
+
+    async def send(user_id):
+        await bot.copy_message(chat_id=user_id, from_chat_id=broadcast['source_chat_id'],
+                               message_id=broadcast['source_message_id'])
+
+    started = time.monotonic()
+    last_report = started
+    processed_here = 0
+    recipients = db_broadcasts.iter_segment_recipients(
+        broadcast['segment'], broadcast['segment_arg'], broadcast['last_user_id'])
+    async with aclosing(recipients):
+        async for chunk in recipients:
+            stats = await fan_out(chunk, send, lambda user_id: user_id, bucket=broadcast_bucket)
+            status = await db_broadcasts.save_progress(
+                broadcast_id, chunk[-1], stats.sent, stats.failed, stats.skipped)
+            await db_jobs.touch_job(job['id'])
+            for counter in ('sent', 'failed', 'skipped'):
+                broadcast[counter] += getattr(stats, counter)
+            processed_here += len(chunk)
+
+            if status != db_broadcasts.STATUS_RUNNING:
+                logger.info(f"Broadcast {broadcast_id} was cancelled, stopping")
+                broadcast['status'] = status
+                await _report(bot, broadcast)
+                return
+            now = time.monotonic()
+            if now - last_report >= config.BROADCAST_REPORT_INTERVAL:
+                last_report = now
+                await _report(bot, broadcast, rate=processed_here / (now - started))
+
+    await db_broadcasts.set_broadcast_status(broadcast_id, db_broadcasts.STATUS_DONE, [db_broadcasts.STATUS_RUNNING])
+    broadcast['status'] = db_broadcasts.STATUS_DONE
+    logger.info(f"Broadcast {broadcast_id} finished: {broadcast['sent']} sent, "
+                f"{broadcast['failed']} failed, {broadcast['skipped']} skipped as blocked")
+    await _report(bot, broadcast)
@@ -2,59 +2,36 @@
 Утилиты для работы с курсами
 Загрузка из YAML и helper функции
 """
-import os
-import yaml
-from typing import List, Optional, Dict
+from typing import Dict, Optional, Tuple
+from utils.catalog import get_catalog, reload_catalog
 from utils.course_validation import validate_course_id
 
-# Путь к файлу с данными курсов
-COURSES_FILE = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'courses.yaml')
-
-# Кэш для хранения загруженных курсов
-_courses_cache = None
-
-def load_courses() -> List[Dict]:
+def load_courses() -> Tuple[Dict, ...]:
     """
-    Загружает курсы из YAML файла
+    Курсы текущего снимка каталога (см. utils.catalog)
     
     Returns:
-        Список курсов
+        Кортеж курсов в порядке файла
     """
-    global _courses_cache
-    
-    if _courses_cache is not None:
-        return _courses_cache
-    
-    with open(COURSES_FILE, 'r', encoding='utf-8') as f:
-        data = yaml.safe_load(f)
-        courses = data.get('courses', [])
-        
-        # Автоматически вычисляем price_usd_cents если не указано
-        for course in courses:
-            if 'price_usd_cents' not in course:
-                course['price_usd_cents'] = int(course['price_usd'] * 100)
-        
-        _courses_cache = courses
-        return courses
+    return get_catalog().courses
 
-def get_all_courses() -> List[Dict]:
+def get_all_courses() -> Tuple[Dict, ...]:
     """
     Получить все курсы
     
     Returns:
-        Список всех курсов
+        Кортеж всех курсов
     """
-    return load_courses()
+    return get_catalog().courses
 
-def get_active_courses() -> List[Dict]:
+def get_active_courses() -> Tuple[Dict, ...]:
     """
     Получить только активные курсы
     
     Returns:
-        Список активных курсов
+        Кортеж активных курсов, посчитанный при загрузке каталога
     """
-    courses = load_courses()
-    return [c for c in courses if c.get('is_active', True)]
+    return get_catalog().active_courses
 
 def get_course_by_id(course_id) -> Optional[Dict]:
     """
@@ -71,15 +48,10 @@ def get_course_by_id(course_id) -> Optional[Dict]:
     if validated_id is None:
         return None
     
-    courses = load_courses()
-    for course in courses:
-        if course.get('id') == validated_id:
-            return course
-    return None
+    return get_catalog().course_by_id(validated_id)
 
 def reload_courses():
     """
-    Перезагрузить курсы из файла (сбросить кэш)
+    Перезагрузить курсы из файла (собирает новый снимок каталога вместе с уроками)
     """
-    global _courses_cache
-    _courses_cache = None
\ No newline at end of file
+    reload_catalog()
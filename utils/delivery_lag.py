@@ -0,0 +1,154 @@
+# utils/delivery_lag.py
+"""
+Delivery lag of reminder fan-outs.
+
+Lag is the time from the moment a reminder was scheduled for to the moment
+Telegram accepted the message. A run keeps it in a histogram with
+logarithmic buckets instead of a list of samples: a few hundred bytes per
+run whatever the number of recipients, and the histograms of several
+instances sending parts of one run simply add up. Percentiles read from it
+are the upper bound of the bucket they fall in, i.e. at most
+LAG_BUCKET_GROWTH times the true value.
+"""
+import bisect
+import math
+from datetime import datetime, timezone
+
+# Bucket 0 holds lags below LAG_BUCKET_BASE seconds, bucket i lags up to
+# LAG_BUCKET_BASE * LAG_BUCKET_GROWTH ** i; the last one everything beyond (~10 h)
+LAG_BUCKET_BASE = 0.1
+LAG_BUCKET_GROWTH = 1.2
+LAG_BUCKET_COUNT = 70
+
+_BOUNDS = [LAG_BUCKET_BASE * LAG_BUCKET_GROWTH ** i for i in range(LAG_BUCKET_COUNT - 1)]
+
+class LagHistogram:
+    """Fixed-size histogram of lags in seconds."""
+
+    def __init__(self, counts=None, max_value=0.0):
+        self.counts = list(counts) if counts else [0] * LAG_BUCKET_COUNT
+        self.max_value = max_value or 0.0
+
+    @property
+    def total(self):
+        return sum(self.counts)
+
+    def add(self, seconds):
+        seconds = max(0.0, seconds)
+        self.counts[bisect.bisect_left(_BOUNDS, seconds)] += 1
+        self.max_value = max(self.max_value, seconds)
+
+    def merge(self, other):
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.max_value = max(self.max_value, other.max_value)
+
+    def percentile(self, percentile):
+        """Upper bound of the bucket holding the given percentile (never above the observed max)."""
+        total = self.total
+        if not total:
+            return 0.0
+        rank = max(1, math.ceil(percentile / 100 * total))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                bound = _BOUNDS[index] if index < len(_BOUNDS) else self.max_value
+                return min(bound, self.max_value)
+        return self.max_value
+
+class DeliveryRun:
+    """
+    Aggregates the SendRecords of one reminder run (one stage of one lesson
+    on one instance) against the time the reminder was scheduled for.
+    """
+
+    def __init__(self, lesson_type, stage, scheduled_at, job_key=None):
+        self.lesson_type = lesson_type
+        self.stage = stage
+        self.scheduled_at = scheduled_at
+        self.job_key = job_key
+        self.started_at = datetime.now(timezone.utc)
+        self.finished_at = None
+        self.sent = 0
+        self.failed = 0
+        self.skipped = 0
+        self.retries = 0
+        self.send_seconds = 0.0
+        self.first_delivery_at = None
+        self.last_delivery_at = None
+        self.lag = LagHistogram()
+
+    def add(self, stats):
+        """Takes in the counters and records of a FanOutStats."""
+        scheduled = self.scheduled_at.timestamp()
+        self.skipped += stats.skipped
+        for record in stats.records:
+            self.retries += record.retries
+            self.send_seconds += record.completed_at - record.dequeued_at
+            if not record.delivered:
+                self.failed += 1
+                continue
+            self.sent += 1
+            self.lag.add(record.completed_at - scheduled)
+            delivered_at = datetime.fromtimestamp(record.completed_at, timezone.utc)
+            if self.first_delivery_at is None or delivered_at < self.first_delivery_at:
+                self.first_delivery_at = delivered_at
+            if self.last_delivery_at is None or delivered_at > self.last_delivery_at:
+                self.last_delivery_at = delivered_at
+
+    def finish(self):
+        self.finished_at = datetime.now(timezone.utc)
+
+    @property
+    def attempted(self):
+        return self.sent + self.failed + self.skipped
+
+    def summary(self):
+        return (f"lag p50 {self.lag.percentile(50):.1f} s, p95 {self.lag.percentile(95):.1f} s, "
+                f"p99 {self.lag.percentile(99):.1f} s, max {self.lag.max_value:.1f} s, {self.retries} retries")
+
+def merge_run_rows(rows):
+    """
+    Merges reminder_delivery_runs rows of the same run (one per instance)
+    into summaries with lag percentiles, keeping the order of first appearance.
+    """
+    runs = {}
+    for row in rows:
+        key = (row['lesson_type'], row['stage'], row['scheduled_at'])
+        run = runs.get(key)
+        if run is None:
+            run = runs[key] = {
+                'lesson_type': row['lesson_type'],
+                'stage': row['stage'],
+                'scheduled_at': row['scheduled_at'],
+                'instances': 0,
+                'sent': 0,
+                'failed': 0,
+                'skipped': 0,
+                'retries': 0,
+                'send_seconds': 0.0,
+                'first_delivery_at': None,
+                'last_delivery_at': None,
+                'lag': LagHistogram(),
+            }
+        run['instances'] += 1
+        for counter in ('sent', 'failed', 'skipped', 'retries', 'send_seconds'):
+            run[counter] += row[counter]
+        for moment, pick in (('first_delivery_at', min), ('last_delivery_at', max)):
+            if row[moment] is not None:
+                run[moment] = row[moment] if run[moment] is None else pick(run[moment], row[moment])
+        run['lag'].merge(LagHistogram(row['lag_histogram'], row['lag_max_seconds']))
+
+    summaries = []
+    for run in runs.values():
+        lag = run.pop('lag')
+        attempts = run['sent'] + run['failed']
+        run.update(
+            lag_p50=lag.percentile(50),
+            lag_p95=lag.percentile(95),
+            lag_p99=lag.percentile(99),
+            lag_max=lag.max_value,
+            avg_send_seconds=run['send_seconds'] / attempts if attempts else 0.0,
+        )
+        summaries.append(run)
+    return summaries
@@ -0,0 +1,279 @@
+# utils/fanout.py
+"""
+Rate-limited concurrent delivery of one message to many chats.
+
+fan_out() runs a bounded number of workers over a list of items. Every send
+waits for the chat's own interval and for a token from the bucket shared by
+the whole bot, so concurrent fan-outs together stay within Telegram's limits.
+RetryAfter pauses that shared bucket and retries; delivered items are handed
+to an `on_delivered` callback in batches so bookkeeping costs one database
+round trip per batch instead of per message. Chats known to have blocked the
+bot are skipped without an API call, and a Forbidden answer records the chat
+as blocked.
+"""
+import asyncio
+import logging
+import math
+import time
+from collections import namedtuple
+from datetime import timedelta
+
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+
+import config
+from db.aio import blocked_chats as db_blocked
+
+logger = logging.getLogger(__name__)
+
+class TokenBucket:
+    """
+    Async token bucket: `rate` tokens per second, bursts of up to `capacity`.
+
+    The default capacity of 1 paces sends evenly; a larger burst would let
+    a one-second window see up to rate + capacity messages.
+    """
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds):
+        """Stops handing out tokens for `seconds` (e.g. after a RetryAfter) and drops the burst."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0
+        # Refill restarts when the pause ends, not from before it
+        self._updated = self._paused_until
+
+    async def acquire(self):
+        # The lock makes waiters queue in FIFO order instead of racing for each token
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.capacity, self._tokens + max(0.0, now - self._updated) * self.rate)
+                self._updated = max(now, self._updated)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+class LayeredBucket:
+    """
+    Takes a token from each of several buckets in turn, so a fan-out keeps to
+    its own rate and to the shared one. List the narrower bucket first: while
+    a send waits for it, it holds no token of the shared bucket.
+    """
+
+    def __init__(self, *buckets):
+        self.buckets = buckets
+
+    def pause(self, seconds):
+        for bucket in self.buckets:
+            bucket.pause(seconds)
+
+    async def acquire(self):
+        for bucket in self.buckets:
+            await bucket.acquire()
+
+class ChatLimiter:
+    """Spaces consecutive sends to the same chat at least `interval` seconds apart."""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._next_allowed = {}
+
+    async def wait(self, chat_id):
+        now = time.monotonic()
+        next_allowed = self._next_allowed.get(chat_id, now)
+        self._next_allowed[chat_id] = max(now, next_allowed) + self.interval
+        if next_allowed > now:
+            await asyncio.sleep(next_allowed - now)
+
+# Shared by every fan-out of the process: the global limit is per bot, not per call
+telegram_bucket = TokenBucket(config.TELEGRAM_GLOBAL_RATE)
+
+# One attempted item: wall-clock (time.time()) moments it left the queue and its
+# last API call returned, retries it needed and whether it was delivered
+SendRecord = namedtuple('SendRecord', 'dequeued_at completed_at retries delivered')
+
+class FanOutStats:
+    """
+    Counters, per-message delivery lag (seconds since the fan-out started)
+    and a SendRecord per attempted item.
+    """
+
+    def __init__(self, total):
+        self.total = total
+        self.sent = 0
+        self.failed = 0
+        self.skipped = 0
+        self.retries = 0
+        self.lags = []
+        self.records = []
+        self.elapsed = 0.0
+
+    @property
+    def rate(self):
+        return self.sent / self.elapsed if self.elapsed else 0.0
+
+    def lag_percentile(self, percentile):
+        if not self.lags:
+            return 0.0
+        ordered = sorted(self.lags)
+        return ordered[min(len(ordered) - 1, math.ceil(percentile / 100 * len(ordered)) - 1)]
+
+    def summary(self):
+        return (f"{self.sent}/{self.total} sent, {self.failed} failed, {self.skipped} skipped as blocked, "
+                f"{self.retries} retries "
+                f"in {self.elapsed:.1f} s ({self.rate:.1f} msg/s, p99 lag {self.lag_percentile(99):.1f} s)")
+
+async def record_blocked(chat_id, error):
+    """Records a chat that answered with Forbidden; a failure to record is only logged."""
+    try:
+        await db_blocked.mark_blocked(chat_id, str(error))
+    except Exception as e:
+        logger.error(f"Failed to record blocked chat {chat_id}: {e}")
+
+def format_duration(seconds):
+    """Длительность рассылки для админа: 45 с, 3 мин 20 с, 1 ч 5 мин."""
+    seconds = int(round(seconds))
+    if seconds < 60:
+        return f"{seconds} с"
+    minutes, seconds = divmod(seconds, 60)
+    if minutes < 60:
+        return f"{minutes} мин {seconds} с"
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours} ч {minutes} мин"
+
+def _retry_after_seconds(error):
+    retry_after = error.retry_after
+    if isinstance(retry_after, timedelta):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+async def fan_out(items, send, chat_id_of, on_delivered=None, *,
+                  concurrency=None, bucket=None, chat_interval=None, max_retries=None,
+                  batch_size=None, flush_interval=None):
+    """
+    Delivers `send(item)` for every item with bounded concurrency and rate limits.
+
+    Args:
+        items: Items to deliver, in priority order
+        send: Coroutine function performing one Telegram call for an item
+        chat_id_of: Returns the chat id an item is sent to
+        on_delivered: Optional coroutine function called with lists of
+            delivered items, at most `batch_size` long and at least every
+            `flush_interval` seconds. Its errors are logged, not retried.
+        concurrency, bucket, chat_interval, max_retries, batch_size,
+            flush_interval: Override the FANOUT_* / TELEGRAM_* settings
+
+    Returns:
+        FanOutStats
+    """
+    concurrency = concurrency or config.FANOUT_CONCURRENCY
+    bucket = bucket or telegram_bucket
+    chat_limiter = ChatLimiter(config.TELEGRAM_PER_CHAT_INTERVAL if chat_interval is None else chat_interval)
+    max_retries = config.FANOUT_MAX_RETRIES if max_retries is None else max_retries
+    batch_size = batch_size or config.FANOUT_BATCH_SIZE
+    flush_interval = flush_interval or config.FANOUT_FLUSH_INTERVAL
+
+    items = list(items)
+    stats = FanOutStats(len(items))
+    queue = asyncio.Queue()
+    for item in items:
+        queue.put_nowait(item)
+    delivered = []
+    flushes = set()
+    started = time.monotonic()
+
+    async def run_flush(batch):
+        try:
+            await on_delivered(batch)
+        except Exception as e:
+            logger.error(f"Failed to record {len(batch)} delivered messages: {e}")
+
+    def flush():
+        if not delivered or on_delivered is None:
+            delivered.clear()
+            return
+        batch = delivered[:]
+        delivered.clear()
+        task = asyncio.create_task(run_flush(batch))
+        flushes.add(task)
+        task.add_done_callback(flushes.discard)
+
+    async def deliver(item):
+        """Returns (delivered, retries used)."""
+        chat_id = chat_id_of(item)
+        for attempt in range(max_retries + 1):
+            await chat_limiter.wait(chat_id)
+            await bucket.acquire()
+            try:
+                await send(item)
+                return True, attempt
+            except RetryAfter as e:
+                seconds = _retry_after_seconds(e)
+                logger.warning(f"Flood control hit while sending to {chat_id}, pausing sends for {seconds:.0f} s")
+                bucket.pause(seconds)
+            except Forbidden as e:
+                # The user blocked the bot or deleted the account: later sends are skipped
+                logger.warning(f"Chat {chat_id} is unreachable: {e}")
+                await record_blocked(chat_id, e)
+                return False, attempt
+            except BadRequest as e:
+                # Bad chat id or message: retrying will not help
+                logger.warning(f"Permanent delivery failure for chat {chat_id}: {e}")
+                return False, attempt
+            except NetworkError as e:
+                logger.warning(f"Network error sending to chat {chat_id} (attempt {attempt + 1}): {e}")
+                await asyncio.sleep(min(2 ** attempt, 30))
+            except Exception as e:
+                logger.error(f"Failed to send to chat {chat_id}: {e}")
+                return False, attempt
+            if attempt < max_retries:
+                stats.retries += 1
+        logger.error(f"Giving up on chat {chat_id} after {max_retries + 1} attempts")
+        return False, max_retries
+
+    async def worker():
+        while True:
+            try:
+                item = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            if db_blocked.is_blocked(chat_id_of(item)):
+                stats.skipped += 1
+                continue
+            dequeued_at = time.time()
+            ok, retries = await deliver(item)
+            stats.records.append(SendRecord(dequeued_at, time.time(), retries, ok))
+            if ok:
+                stats.sent += 1
+                stats.lags.append(time.monotonic() - started)
+                delivered.append(item)
+                if len(delivered) >= batch_size:
+                    flush()
+            else:
+                stats.failed += 1
+
+    async def periodic_flush():
+        while True:
+            await asyncio.sleep(flush_interval)
+            flush()
+
+    flusher = asyncio.create_task(periodic_flush())
+    try:
+        await asyncio.gather(*(worker() for _ in range(min(concurrency, len(items)) or 1)))
+    finally:
+        flusher.cancel()
+        flush()
+        if flushes:
+            await asyncio.gather(*flushes)
+        stats.elapsed = time.monotonic() - started
+    return stats
@@ -2,89 +2,50 @@
 Утилиты для работы с бесплатными уроками
 Загрузка из YAML и helper функции
 """
-import os
-import yaml
-from datetime import datetime
-from typing import Dict, Optional, Tuple
+import re
+from datetime import timedelta
+from types import MappingProxyType
+from typing import Dict, FrozenSet, List, Optional, Tuple
 
-# Путь к файлу с данными уроков
-LESSONS_FILE = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'lessons.yaml')
+import config
+from utils.catalog import LessonTimes, get_catalog, reload_catalog
 
-# Кэш для хранения загруженных уроков
-_lessons_cache = None
+# Этап напоминания урока без списка reminders (единственное напоминание с reminder_text)
+DEFAULT_REMINDER_STAGE = 'default'
 
-def load_lessons() -> Dict:
+_DURATION_PATTERN = re.compile(r'^(\d+)\s*([dhm])$')
+_DURATION_UNITS = {'d': 'days', 'h': 'hours', 'm': 'minutes'}
+_STAGE_NAME_PATTERN = re.compile(r'^[\w-]+$')
+
+def load_lessons() -> MappingProxyType:
     """
-    Загружает уроки из YAML файла
+    Уроки текущего снимка каталога (см. utils.catalog)
     
     Returns:
-        Словарь с уроками
-    """
-    global _lessons_cache
-    
-    if _lessons_cache is not None:
-        return _lessons_cache
-    
-    with open(LESSONS_FILE, 'r', encoding='utf-8') as f:
-        data = yaml.safe_load(f)
-        lessons = data.get('lessons', {})
-        
-        # Преобразуем строковые datetime в объекты datetime
-        for lesson_key, lesson_data in lessons.items():
-            if 'datetime' in lesson_data and isinstance(lesson_data['datetime'], str):
-                lesson_data['datetime'] = datetime.fromisoformat(lesson_data['datetime'])
-        
-        _lessons_cache = lessons
-        return lessons
+        Словарь с уроками (только чтение)
+    """
+    return get_catalog().lessons
 
-def get_all_lessons() -> Dict:
+def get_all_lessons() -> MappingProxyType:
     """
     Получить все уроки
     
     Returns:
-        Словарь всех уроков
+        Словарь всех уроков (только чтение)
     """
-    return load_lessons()
+    return get_catalog().lessons
 
-def get_active_lessons() -> Dict:
+def get_active_lessons() -> MappingProxyType:
     """
     Получить только активные уроки (is_active=True и время еще не прошло)
     
+    Урок показывается еще LESSON_GRACE_PERIOD (2 часа) после начала; урок
+    без datetime показывается всегда (для обратной совместимости).
+    
     Returns:
-        Словарь активных уроков, которые еще не прошли
-    """
-    from datetime import datetime, timedelta, timezone
-    lessons = load_lessons()
-    
-    # Получаем текущее время с учетом временной зоны
-    current_time = datetime.now(timezone.utc)
-    
-    active_lessons = {}
-    for k, v in lessons.items():
-        # Проверяем что урок активен
-        if not v.get('is_active', False):
-            continue
-        
-        # Проверяем что время урока еще не прошло (с буфером в 2 часа после начала)
-        lesson_datetime = v.get('datetime')
-        if lesson_datetime:
-            # Преобразуем lesson_datetime в UTC если у него есть временная зона
-            if lesson_datetime.tzinfo is None:
-                # Если нет временной зоны, считаем что это UTC
-                lesson_datetime = lesson_datetime.replace(tzinfo=timezone.utc)
-            else:
-                # Конвертируем в UTC для сравнения
-                lesson_datetime = lesson_datetime.astimezone(timezone.utc)
-            
-            # Даем 2 часа после начала урока перед тем как скрыть его
-            grace_period = timedelta(hours=2)
-            if current_time <= lesson_datetime + grace_period:
-                active_lessons[k] = v
-        else:
-            # Если нет datetime, показываем урок (для обратной совместимости)
-            active_lessons[k] = v
-    
-    return active_lessons
+        Словарь активных уроков, которые еще не прошли (только чтение)
+    """
+    return get_catalog().active_lessons()
 
 def get_lesson_by_id(lesson_id: int) -> Tuple[Optional[str], Optional[Dict]]:
     """
@@ -96,11 +57,7 @@ def get_lesson_by_id(lesson_id: int) -> Tuple[Optional[str], Optional[Dict]]:
     Returns:
         Кортеж (lesson_type, lesson_data) или (None, None) если не найден
     """
-    lessons = load_lessons()
-    for lesson_type, lesson_data in lessons.items():
-        if lesson_data.get('id') == lesson_id:
-            return lesson_type, lesson_data
-    return None, None
+    return get_catalog().lesson_by_id(lesson_id)
 
 def get_lesson_by_type(lesson_type: str) -> Optional[Dict]:
     """
@@ -112,22 +69,86 @@ def get_lesson_by_type(lesson_type: str) -> Optional[Dict]:
     Returns:
         Данные урока или None
     """
-    lessons = load_lessons()
-    return lessons.get(lesson_type)
+    return get_catalog().lessons.get(lesson_type)
 
-def get_all_lesson_types() -> list:
+def get_lesson_times(lesson_type: str) -> Optional[LessonTimes]:
+    """
+    Моменты урока, посчитанные при загрузке каталога
+    
+    Returns:
+        LessonTimes (starts_at, visible_until, reminders) в UTC или None,
+        если урока нет или у него нет даты
+    """
+    return get_catalog().lesson_times(lesson_type)
+
+def get_all_lesson_types() -> FrozenSet[str]:
     """
     Получить все доступные типы уроков
     
     Returns:
-        Список всех lesson_type (ключей) из YAML файла
+        Множество всех lesson_type (ключей) из YAML файла
     """
-    lessons = load_lessons()
-    return list(lessons.keys())
+    return get_catalog().lesson_types
 
 def reload_lessons():
     """
-    Перезагрузить уроки из файла (сбросить кэш)
+    Перезагрузить уроки из файла (собирает новый снимок каталога вместе с курсами)
+    """
+    reload_catalog()
+
+def parse_duration(value) -> timedelta:
+    """
+    Разбирает длительность из YAML: '24h', '90m', '1d' или число минут
+    
+    Raises:
+        ValueError: если формат не распознан
+    """
+    if isinstance(value, int) and not isinstance(value, bool):
+        return timedelta(minutes=value)
+    match = _DURATION_PATTERN.match(str(value).strip())
+    if not match:
+        raise ValueError(f"Invalid duration '{value}', expected e.g. 24h, 90m or 1d")
+    amount, unit = match.groups()
+    return timedelta(**{_DURATION_UNITS[unit]: int(amount)})
+
+def get_reminder_stages(lesson_data: Dict) -> List[Dict]:
     """
-    global _lessons_cache
-    _lessons_cache = None
\ No newline at end of file
+    Этапы напоминаний урока, от самого раннего к самому позднему
+    
+    Этапы задаются списком reminders в YAML (before, необязательные name и
+    text; без text используется reminder_text). Без списка — один этап
+    DEFAULT_REMINDER_STAGE за LESSON_REMINDER_LEAD_MINUTES до урока.
+    
+    Returns:
+        Список словарей с ключами name, before (timedelta) и text
+    
+    Raises:
+        ValueError: если этапы описаны некорректно
+    """
+    reminders = lesson_data.get('reminders')
+    if not reminders:
+        return [{
+            'name': DEFAULT_REMINDER_STAGE,
+            'before': timedelta(minutes=config.LESSON_REMINDER_LEAD_MINUTES),
+            'text': lesson_data.get('reminder_text', ''),
+        }]
+    
+    stages = []
+    for reminder in reminders:
+        if 'before' not in reminder:
+            raise ValueError(f"Reminder stage without 'before': {reminder}")
+        name = str(reminder.get('name', reminder['before']))
+        if not _STAGE_NAME_PATTERN.match(name):
+            raise ValueError(f"Invalid reminder stage name '{name}'")
+        stages.append({
+            'name': name,
+            'before': parse_duration(reminder['before']),
+            'text': reminder.get('text', lesson_data.get('reminder_text', '')),
+        })
+    
+    if len({stage['name'] for stage in stages}) != len(stages):
+        raise ValueError("Reminder stage names must be unique")
+    if len({stage['before'] for stage in stages}) != len(stages):
+        raise ValueError("Reminder stages must have different 'before' values")
+    stages.sort(key=lambda stage: stage['before'], reverse=True)
+    return stages
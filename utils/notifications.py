@@ -1,21 +1,66 @@
 # utils/notifications.py
+import html
 import logging
-import asyncio
 from datetime import datetime, timedelta, timezone
 from telegram import InlineKeyboardMarkup, InlineKeyboardButton
 from telegram.ext import Application
+from telegram.error import Forbidden
+import config
 from locales.ru import get_text
 from handlers.callbacks import CALLBACK_LESSON_LINK_PREFIX
-from utils.lessons import get_active_lessons, get_lesson_by_type
-from db import free_lessons as db_free_lessons
-from db import events as db_events
+from utils.catalog import get_catalog
+from utils.lessons import (
+    get_active_lessons, get_lesson_by_type, get_lesson_times, get_reminder_stages, DEFAULT_REMINDER_STAGE
+)
+from utils.fanout import fan_out, record_blocked
+from utils.delivery_lag import DeliveryRun
+from utils.scheduler import scheduler
+from db import aio as db_aio
+from db.aio import blocked_chats as db_blocked
+from db.aio import free_lessons as db_free_lessons
+from db.aio import reminder_runs as db_reminder_runs
+from db.aio import events as db_events
+from db.aio import scheduled_jobs as db_jobs
 
 logger = logging.getLogger(__name__)
 
+# Тип задачи в scheduled_jobs для напоминаний об уроках
+REMINDER_JOB_TYPE = 'lesson_reminder'
+
+def _as_utc(moment):
+    """Наивные datetime из YAML считаются UTC."""
+    if moment.tzinfo is None:
+        return moment.replace(tzinfo=timezone.utc)
+    return moment.astimezone(timezone.utc)
+
+def _reminder_job_key(lesson_type, lesson_datetime, stage_name=DEFAULT_REMINDER_STAGE):
+    # Одна задача на урок, дату и этап: перенос времени в тот же день двигает существующую задачу.
+    # Ключ этапа по умолчанию совпадает с ключом единственного напоминания до появления этапов
+    key = f"{lesson_type}:{lesson_datetime.date().isoformat()}"
+    return key if stage_name == DEFAULT_REMINDER_STAGE else f"{key}:{stage_name}"
+
+def _stage_windows(lesson_data):
+    """
+    Возвращает (этап, время отправки, крайний срок) для каждого этапа урока.
+    Этап устаревает, когда подходит время следующего: после простоя бота
+    уходит только актуальное напоминание, а не все пропущенные подряд.
+    Последний этап можно догнать до LESSON_REMINDER_LATE_LIMIT_MINUTES после начала урока.
+    """
+    lesson_datetime = _as_utc(lesson_data['datetime'])
+    stages = get_reminder_stages(lesson_data)
+    windows = []
+    for index, stage in enumerate(stages):
+        if index + 1 < len(stages):
+            deadline = lesson_datetime - stages[index + 1]['before']
+        else:
+            deadline = lesson_datetime + timedelta(minutes=config.LESSON_REMINDER_LATE_LIMIT_MINUTES)
+        windows.append((stage, lesson_datetime - stage['before'], deadline))
+    return windows
+
 async def schedule_all_lesson_notifications(application: Application):
     """
-    Планирует уведомления для всех активных уроков при старте бота.
-    Не использует force_send - только точное планирование по времени.
+    Ставит в очередь scheduled_jobs напоминания для всех активных уроков при старте бота.
+    Повторный вызов безопасен: уже отправленные напоминания не пересоздаются.
     """
     active_lessons = get_active_lessons()
     
@@ -33,212 +78,429 @@ async def schedule_all_lesson_notifications(application: Application):
 
 async def schedule_lesson_notification(application: Application, lesson_type: str, lesson_data: dict):
     """
-    Планирует уведомление за 15 минут до урока для конкретного типа урока.
+    Сохраняет по задаче на каждый этап напоминаний урока (см. get_reminder_stages).
+    Все этапы всех уроков исполняет один цикл планировщика в порядке run_at.
+    Если время этапа прошло, но следующий этап еще не наступил, задача
+    становится срочной и напоминание уходит сразу (догоняющая отправка).
     """
-    lesson_datetime = lesson_data['datetime']
-    notification_time = lesson_datetime - timedelta(minutes=15)
+    lesson_datetime = _as_utc(lesson_data['datetime'])
     current_time = datetime.now(timezone.utc)
     
-    # Преобразуем lesson_datetime и notification_time в UTC если нужно
-    if lesson_datetime.tzinfo is None:
-        lesson_datetime = lesson_datetime.replace(tzinfo=timezone.utc)
-    else:
-        lesson_datetime = lesson_datetime.astimezone(timezone.utc)
-    
-    if notification_time.tzinfo is None:
-        notification_time = notification_time.replace(tzinfo=timezone.utc)
-    else:
-        notification_time = notification_time.astimezone(timezone.utc)
-    
-    if notification_time <= current_time:
-        logger.info(f"Notification time for {lesson_type} has already passed (was at {notification_time})")
-        return
-    
-    delay_seconds = (notification_time - current_time).total_seconds()
-    delay_minutes = delay_seconds / 60
-    
-    logger.info(f"Scheduled notification for {lesson_type} in {delay_minutes:.1f} minutes "
-                f"(at {notification_time.strftime('%Y-%m-%d %H:%M')})")
-    
-    # Создаем асинхронную задачу для отправки уведомления
-    asyncio.create_task(delayed_notification(application, lesson_type, lesson_data, delay_seconds))
+    for stage, notification_time, deadline in _stage_windows(lesson_data):
+        stage_name = stage['name']
+        if current_time >= deadline:
+            logger.info(f"Reminder {stage_name} for {lesson_type} is outdated (deadline {deadline}), not scheduling")
+            continue
+        
+        status = await scheduler.schedule(
+            REMINDER_JOB_TYPE,
+            _reminder_job_key(lesson_type, lesson_datetime, stage_name),
+            notification_time,
+            payload={
+                'lesson_type': lesson_type,
+                'lesson_datetime': lesson_datetime.isoformat(),
+                'stage': stage_name
+            }
+        )
+        if status != db_jobs.STATUS_PENDING:
+            logger.info(f"Reminder {stage_name} for {lesson_type} on {lesson_datetime.date()} is already {status}")
+        elif notification_time <= current_time:
+            logger.info(f"Reminder {stage_name} for {lesson_type} is late (was due at {notification_time}), sending now")
+        else:
+            delay_minutes = (notification_time - current_time).total_seconds() / 60
+            logger.info(f"Scheduled reminder {stage_name} for {lesson_type} in {delay_minutes:.1f} minutes "
+                        f"(at {notification_time.strftime('%Y-%m-%d %H:%M')})")
 
-async def delayed_notification(application: Application, lesson_type: str, lesson_data: dict, delay_seconds: float):
+def _reminder_schedule(lesson_type, lesson_data):
     """
-    Отправляет уведомления через заданное время.
+    То, от чего зависят задачи напоминаний урока: {ключ задачи: время отправки}.
+    Пусто для выключенного урока или урока без даты. Тексты сюда не входят —
+    задача берет их из каталога в момент отправки.
     """
-    try:
-        await asyncio.sleep(delay_seconds)
-        logger.info(f"Sending notifications for lesson {lesson_type}")
-        await send_notifications_for_lesson(application, lesson_type, lesson_data)
-    except asyncio.CancelledError:
-        logger.info(f"Notification task for {lesson_type} was cancelled")
-    except Exception as e:
-        logger.error(f"Error in delayed notification for {lesson_type}: {e}")
+    if not lesson_data or not lesson_data.get('is_active', False) or not lesson_data.get('datetime'):
+        return {}
+    lesson_datetime = _as_utc(lesson_data['datetime'])
+    return {
+        _reminder_job_key(lesson_type, lesson_datetime, stage['name']): run_at
+        for stage, run_at, _ in _stage_windows(lesson_data)
+    }
 
-async def send_notifications_for_lesson(application: Application, lesson_type: str, lesson_data: dict):
+def _lesson_date(lesson_data):
+    """Дата урока в том виде, в каком ее хранят регистрации (из YAML, без перевода в UTC)."""
+    lesson_datetime = (lesson_data or {}).get('datetime')
+    return lesson_datetime.date() if isinstance(lesson_datetime, datetime) else None
+
+async def reschedule_changed_lessons(application: Application, old_lessons, new_lessons) -> int:
     """
-    Отправляет уведомления всем зарегистрированным пользователям на конкретный тип урока.
+    Сравнивает уроки двух снимков каталога и переставляет напоминания только
+    тех, у кого изменились дата, этапы или активность: задачи, которых больше
+    нет в расписании, отменяются, остальные ставятся заново или сдвигаются.
+    Записавшиеся на урок, перенесенный на другой день, переносятся вместе с ним.
+
+    Returns:
+        Число уроков с измененным расписанием
     """
-    # Получаем всех зарегистрированных пользователей для данного типа урока
-    registrations = db_free_lessons.get_registrations_by_type(lesson_type)
+    changed = 0
+    for lesson_type in set(old_lessons) | set(new_lessons):
+        old_data, new_data = old_lessons.get(lesson_type), new_lessons.get(lesson_type)
+        try:
+            old_schedule = _reminder_schedule(lesson_type, old_data)
+        except ValueError:
+            # Прежний снимок мог быть загружен без проверки при старте
+            old_schedule = {}
+        new_schedule = _reminder_schedule(lesson_type, new_data)
+        if old_schedule == new_schedule:
+            continue
+        changed += 1
+        try:
+            old_date, new_date = _lesson_date(old_data), _lesson_date(new_data)
+            if old_date and new_date and old_date != new_date:
+                # Напоминания выбирают записавшихся по дате урока: переносим их вместе с уроком
+                moved = await db_free_lessons.move_lesson_date(lesson_type, old_date, new_date)
+                logger.info(f"Lesson {lesson_type} moved from {old_date} to {new_date}: moved {moved} registrations")
+            removed = set(old_schedule) - set(new_schedule)
+            if removed:
+                cancelled = await db_jobs.cancel_pending_jobs(REMINDER_JOB_TYPE, removed, "lesson changed in catalog")
+                logger.info(f"Lesson {lesson_type} changed: cancelled {cancelled} pending reminders")
+            if new_schedule:
+                await schedule_lesson_notification(application, lesson_type, new_data)
+        except Exception as e:
+            logger.error(f"Error rescheduling reminders for lesson {lesson_type}: {e}")
+    return changed
+
+async def run_lesson_reminder_job(application: Application, job: dict):
+    """
+    Обработчик задачи REMINDER_JOB_TYPE для планировщика.
+    Актуальные данные урока берутся из YAML: если урок отключен, перенесен
+    на другую дату или этап убран из списка напоминаний, задача пропускается.
+    """
+    lesson_type = job['payload']['lesson_type']
+    stage_name = job['payload'].get('stage', DEFAULT_REMINDER_STAGE)
+    lesson_data = get_lesson_by_type(lesson_type)
+    if not lesson_data or not lesson_data.get('is_active', False):
+        logger.info(f"Lesson {lesson_type} is no longer active, skipping reminder")
+        return db_jobs.STATUS_SKIPPED
     
-    if not registrations:
-        logger.info(f"No registrations found for lesson {lesson_type}")
-        return
+    window = next((w for w in _stage_windows(lesson_data) if w[0]['name'] == stage_name), None)
+    if window is None:
+        logger.info(f"Lesson {lesson_type} has no reminder stage {stage_name} anymore, skipping {job['job_key']}")
+        return db_jobs.STATUS_SKIPPED
+    stage, notification_time, deadline = window
     
-    logger.info(f"Found {len(registrations)} registrations for lesson {lesson_type}")
+    lesson_datetime = _as_utc(lesson_data['datetime'])
+    base_key = job['job_key'].split('#', 1)[0]
+    if _reminder_job_key(lesson_type, lesson_datetime, stage_name) != base_key:
+        logger.info(f"Lesson {lesson_type} was moved to {lesson_datetime.date()}, skipping reminder {job['job_key']}")
+        return db_jobs.STATUS_SKIPPED
     
-    # Фильтруем только тех, кому еще не отправили уведомления
-    pending_registrations = [reg for reg in registrations if not reg.get('notification_sent', False)]
+    if datetime.now(timezone.utc) >= deadline:
+        logger.info(f"Reminder {stage_name} for {lesson_type} is outdated (deadline {deadline}), skipping")
+        return db_jobs.STATUS_SKIPPED
     
-    if not pending_registrations:
-        logger.info(f"All users for lesson {lesson_type} have already received notifications")
-        return
+    if base_key == job['job_key'] and config.REMINDER_PARALLEL_JOBS > 1:
+        # Части одной рассылки: планировщик не берет две части в один процесс,
+        # поэтому их подхватывают другие экземпляры бота
+        for part in range(2, config.REMINDER_PARALLEL_JOBS + 1):
+            await scheduler.schedule(REMINDER_JOB_TYPE, f"{base_key}#{part}", datetime.now(timezone.utc), job['payload'])
     
-    logger.info(f"Sending notifications to {len(pending_registrations)} users for lesson {lesson_type}")
+    logger.info(f"Sending reminder {stage_name} for lesson {lesson_type}")
+    await send_notifications_for_lesson(application, lesson_type, lesson_data, stage,
+                                        scheduled_at=notification_time, job_key=job['job_key'], job_id=job['id'])
+
+def _reminder_text(lesson_data: dict, stage: dict) -> str:
+    return stage['text'].format(description=lesson_data['description'])
+
+def _lesson_link_button(lesson_type: str, lesson_data: dict, text: str = "🔗 Присоединиться к уроку"):
+    """Кнопка перехода к уроку или None, если у урока нет ссылки на встречу."""
+    if not lesson_data.get('meeting_url'):
+        return None
+    return InlineKeyboardButton(text, callback_data=f"{CALLBACK_LESSON_LINK_PREFIX}{lesson_type}")
+
+def _coalesced_companions(lesson_type: str) -> list:
+    """
+    Этапы напоминаний других активных уроков, которые наступают в пределах
+    REMINDER_COALESCE_WINDOW_MINUTES и еще не устарели: их получатели,
+    записанные и на этот урок, получат одно общее сообщение.
+    Возвращает список (lesson_type, lesson_data, stage).
+    """
+    if config.REMINDER_COALESCE_WINDOW_MINUTES <= 0:
+        return []
+    current_time = datetime.now(timezone.utc)
+    horizon = current_time + timedelta(minutes=config.REMINDER_COALESCE_WINDOW_MINUTES)
+    companions = []
+    for other_type, other_data in get_active_lessons().items():
+        if other_type == lesson_type or not other_data.get('datetime'):
+            continue
+        for stage, notification_time, deadline in _stage_windows(other_data):
+            if notification_time <= horizon and current_time < deadline:
+                companions.append((other_type, other_data, stage))
+    return companions
+
+def _coalesced_message(parts: list):
+    """Текст и клавиатура одного сообщения о нескольких уроках (по кнопке на урок)."""
+    lines = [get_text("FREE_LESSON", "COALESCED_REMINDER_HEADER"), ""]
+    buttons = []
+    for part in sorted(parts, key=lambda part: part['lesson_data']['datetime']):
+        lesson_data = part['lesson_data']
+        when = lesson_data.get('date_text') or _as_utc(lesson_data['datetime']).strftime('%d.%m %H:%M UTC')
+        lines.append(get_text("FREE_LESSON", "COALESCED_REMINDER_LINE",
+                              title=html.escape(lesson_data['title']), when=html.escape(when)))
+        button = _lesson_link_button(part['lesson_type'], lesson_data, f"🔗 {lesson_data['title']}")
+        if button:
+            buttons.append([button])
+    lines.extend(["", get_text("FREE_LESSON", "COALESCED_REMINDER_FOOTER")])
+    return "\n".join(lines), InlineKeyboardMarkup(buttons) if buttons else None
+
+async def send_notifications_for_lesson(application: Application, lesson_type: str, lesson_data: dict,
+                                        stage: dict = None, scheduled_at: datetime = None, job_key: str = None,
+                                        job_id: int = None):
+    """
+    Отправляет этап напоминания всем зарегистрированным на конкретный тип и дату урока,
+    кому этот этап еще не отправлен (по умолчанию — последний этап перед уроком).
+    Получатели захватываются пачками через SKIP LOCKED, поэтому несколько
+    экземпляров бота делят одну рассылку без дублей.
+
+    Если у других уроков этап напоминания наступает в пределах
+    REMINDER_COALESCE_WINDOW_MINUTES, пользователи, записанные на несколько
+    таких уроков, получают одно сообщение с кнопкой на каждый урок; их
+    напоминания по остальным урокам отмечаются отправленными.
+
+    Задержка каждой доставки относительно scheduled_at (по умолчанию — момент
+    вызова) собирается в гистограмму и сохраняется в reminder_delivery_runs.
+
+    Если рассылку ведет задача планировщика job_id, после каждой пачки
+    отмечаемся в ней (touch_job), чтобы долгую рассылку не сочли брошенной.
+    """
+    if stage is None:
+        stage = get_reminder_stages(lesson_data)[-1]
+    stage_name = stage['name']
     
     # Формируем текст уведомления
-    reminder_text = lesson_data['reminder_text'].format(
-        description=lesson_data['description']
-    )
+    reminder_text = _reminder_text(lesson_data, stage)
     
     # Создаем inline keyboard с кнопкой для перехода к уроку
-    keyboard = None
-    if lesson_data.get('meeting_url'):
-        callback_data = f"{CALLBACK_LESSON_LINK_PREFIX}{lesson_type}"
-        keyboard = InlineKeyboardMarkup([[
-            InlineKeyboardButton("🔗 Присоединиться к уроку", callback_data=callback_data)
-        ]])
+    button = _lesson_link_button(lesson_type, lesson_data)
+    keyboard = InlineKeyboardMarkup([[button]]) if button else None
     
-    successful_sends = 0
-    failed_sends = 0
-    
-    for registration in pending_registrations:
-        try:
+    async def send(recipient):
+        parts = recipient['parts']
+        if len(parts) == 1:
             # Отправляем уведомление с inline keyboard
-            await application.bot.send_message(
-                chat_id=registration['user_id'],
-                text=reminder_text,
-                parse_mode='HTML',
-                disable_web_page_preview=True,
-                reply_markup=keyboard
-            )
-            
-            # Помечаем уведомление как отправленное
-            db_free_lessons.mark_notification_sent(registration['id'])
-            
-            # Логируем успешную отправку
-            db_events.log_event(
-                registration['user_id'],
-                'free_lesson_reminder_sent',
-                details={
-                    'lesson_type': lesson_type,
-                    'registration_id': registration['id']
-                },
-                username=registration.get('username'),
-                first_name=registration.get('first_name')
+            text, markup = reminder_text, keyboard
+        else:
+            text, markup = _coalesced_message(parts)
+        await application.bot.send_message(
+            chat_id=recipient['user_id'],
+            text=text,
+            parse_mode='HTML',
+            disable_web_page_preview=True,
+            reply_markup=markup
+        )
+
+    delivered_users = set()
+
+    async def record_delivered(batch):
+        # Отмечаем этапы доставленными для пачки и логируем отправку одной транзакцией
+        delivered_by_stage = {}
+        for recipient in batch:
+            delivered_users.add(recipient['user_id'])
+        for recipient in batch:
+            for part in recipient['parts']:
+                delivered_by_stage.setdefault(part['stage']['name'], []).append(part['registration']['id'])
+        async with db_aio.transaction() as session:
+            for delivered_stage, registration_ids in delivered_by_stage.items():
+                await db_free_lessons.mark_reminders_sent(delivered_stage, registration_ids, session=session)
+            for recipient in batch:
+                for part in recipient['parts']:
+                    details = {
+                        'lesson_type': part['lesson_type'],
+                        'registration_id': part['registration']['id'],
+                        'stage': part['stage']['name']
+                    }
+                    if len(recipient['parts']) > 1:
+                        details['coalesced'] = True
+                    db_events.log_event(
+                        recipient['user_id'],
+                        'free_lesson_reminder_sent',
+                        details=details,
+                        username=recipient.get('username'),
+                        first_name=recipient.get('first_name'),
+                        session=session
+                    )
+
+    # Регистрации хранят дату урока из YAML без перевода в UTC — фильтруем по ней же
+    lesson_date = _lesson_date(lesson_data)
+    companions = _coalesced_companions(lesson_type)
+    if companions:
+        companion_names = ', '.join(f"{other_type}/{other_stage['name']}" for other_type, _, other_stage in companions)
+        logger.info(f"Reminder {stage_name} for {lesson_type} is coalesced with {companion_names}")
+    run = DeliveryRun(lesson_type, stage_name, scheduled_at or datetime.now(timezone.utc), job_key)
+    coalesced_sends = 0
+    while True:
+        claimed = await db_free_lessons.claim_pending_reminders(
+            lesson_type, lesson_date, stage_name,
+            config.INSTANCE_ID, config.NOTIFICATION_CLAIM_BATCH, config.NOTIFICATION_CLAIM_LEASE
+        )
+        if not claimed:
+            break
+        logger.info(f"Claimed {len(claimed)} recipients of reminder {stage_name} for lesson {lesson_type}")
+        recipients = {}
+        for registration in claimed:
+            recipients[registration['user_id']] = {
+                'user_id': registration['user_id'],
+                'username': registration.get('username'),
+                'first_name': registration.get('first_name'),
+                'parts': [{'lesson_type': lesson_type, 'lesson_data': lesson_data,
+                           'stage': stage, 'registration': registration}]
+            }
+        for other_type, other_data, other_stage in companions:
+            # Захватываем напоминания других уроков только для получателей этой пачки
+            companion_claims = await db_free_lessons.claim_pending_reminders(
+                other_type, other_data['datetime'].date(), other_stage['name'],
+                config.INSTANCE_ID, len(claimed), config.NOTIFICATION_CLAIM_LEASE,
+                user_ids=list(recipients)
             )
-            
-            successful_sends += 1
-            logger.info(f"Sent notification for {lesson_type} to user {registration['user_id']}")
-            
-        except Exception as e:
-            logger.error(f"Failed to send notification for {lesson_type} to user {registration['user_id']}: {e}")
-            failed_sends += 1
+            for registration in companion_claims:
+                recipients[registration['user_id']]['parts'].append({
+                    'lesson_type': other_type, 'lesson_data': other_data,
+                    'stage': other_stage, 'registration': registration
+                })
+                coalesced_sends += 1
+        stats = await fan_out(
+            list(recipients.values()),
+            send,
+            chat_id_of=lambda recipient: recipient['user_id'],
+            on_delivered=record_delivered
+        )
+        logger.info(f"Reminder {stage_name} chunk for {lesson_type}: {stats.summary()}")
+        run.add(stats)
+        await _record_failed(recipients.values(), delivered_users)
+        if job_id is not None:
+            await db_jobs.touch_job(job_id)
+    run.finish()
     
-    logger.info(f"Notification summary for {lesson_type}: {successful_sends} successful, {failed_sends} failed")
+    if not run.attempted:
+        logger.info(f"No recipients left for reminder {stage_name} of lesson {lesson_type} "
+                    f"(or another instance is sending them)")
+        return
+    logger.info(f"Reminder {stage_name} summary for {lesson_type}: {run.sent} successful, "
+                f"{run.failed} failed, {run.skipped} skipped (bot blocked by user), "
+                f"{coalesced_sends} reminders of other lessons merged into these messages; {run.summary()}")
+    try:
+        await db_reminder_runs.record_run(run, config.INSTANCE_ID)
+    except Exception as e:
+        # Замеры не должны ломать рассылку
+        logger.error(f"Failed to record delivery lag of reminder {stage_name} for {lesson_type}: {e}")
+
+async def _record_failed(recipients, delivered_users):
+    """
+    Захваченные, но не доставленные этапы (бот заблокирован, сообщение
+    отклонено, попытки исчерпаны) отмечаются неудачными, чтобы их не
+    захватывали снова по истечении аренды.
+    """
+    failed_by_stage = {}
+    for recipient in recipients:
+        if recipient['user_id'] in delivered_users:
+            continue
+        for part in recipient['parts']:
+            failed_by_stage.setdefault(part['stage']['name'], []).append(part['registration']['id'])
+    for failed_stage, registration_ids in failed_by_stage.items():
+        try:
+            await db_free_lessons.mark_reminders_failed(failed_stage, registration_ids)
+        except Exception as e:
+            # Не записали — получатели снова станут доступны после NOTIFICATION_CLAIM_LEASE
+            logger.error(f"Failed to record {len(registration_ids)} failed reminders {failed_stage}: {e}")
 
 def get_time_until_lesson(lesson_type: str) -> float:
     """
     Возвращает время до начала урока в минутах для конкретного типа урока.
-    Возвращает None, если урок не найден или уже прошел.
+    Возвращает None, если урок не найден (или у него нет даты); 0, если уже начался.
     """
-    lesson_data = get_lesson_by_type(lesson_type)
-    if not lesson_data:
+    lesson_times = get_lesson_times(lesson_type)
+    if lesson_times is None:
         return None
     
-    lesson_datetime = lesson_data['datetime']
-    current_time = datetime.now(timezone.utc)
-    
-    # Преобразуем lesson_datetime в UTC если нужно
-    if lesson_datetime.tzinfo is None:
-        lesson_datetime = lesson_datetime.replace(tzinfo=timezone.utc)
-    else:
-        lesson_datetime = lesson_datetime.astimezone(timezone.utc)
-    
-    time_until_lesson = lesson_datetime - current_time
-    minutes_until = time_until_lesson.total_seconds() / 60
-    
+    minutes_until = (lesson_times.starts_at - datetime.now(timezone.utc)).total_seconds() / 60
     return minutes_until if minutes_until > 0 else 0
 
 def is_lesson_active(lesson_type: str) -> bool:
     """
-    Проверяет, активен ли урок (не прошел ли он уже).
+    Проверяет, активен ли урок: флаг is_active и не прошло 2 часа с начала.
     """
-    lesson_data = get_lesson_by_type(lesson_type)
-    if not lesson_data:
-        return False
-    
-    # Проверяем флаг активности в константах
-    if not lesson_data.get('is_active', False):
-        return False
-    
-    # Проверяем, не прошло ли время урока
-    lesson_datetime = lesson_data['datetime']
-    current_time = datetime.now(timezone.utc)
-    
-    # Преобразуем lesson_datetime в UTC если нужно
-    if lesson_datetime.tzinfo is None:
-        lesson_datetime = lesson_datetime.replace(tzinfo=timezone.utc)
-    else:
-        lesson_datetime = lesson_datetime.astimezone(timezone.utc)
-    
-    # Урок считается активным, если он еще не начался или идет сейчас (+ 2 часа на проведение)
-    lesson_end_time = lesson_datetime + timedelta(hours=2)
-    
-    return current_time < lesson_end_time
+    return get_catalog().is_lesson_active(lesson_type)
 
 def get_notification_status() -> dict:
     """
-    Возвращает статус уведомлений для всех активных уроков.
+    Возвращает статус напоминаний (по этапам) для всех активных уроков.
     Полезно для мониторинга и отладки.
     """
     status = {}
     active_lessons = get_active_lessons()
+    current_time = datetime.now(timezone.utc)
     
     for lesson_type, lesson_data in active_lessons.items():
-        lesson_datetime = lesson_data['datetime']
-        notification_time = lesson_datetime - timedelta(minutes=15)
-        current_time = datetime.now(timezone.utc)
-        
-        # Преобразуем lesson_datetime и notification_time в UTC если нужно
-        if lesson_datetime.tzinfo is None:
-            lesson_datetime = lesson_datetime.replace(tzinfo=timezone.utc)
-        else:
-            lesson_datetime = lesson_datetime.astimezone(timezone.utc)
-        
-        if notification_time.tzinfo is None:
-            notification_time = notification_time.replace(tzinfo=timezone.utc)
-        else:
-            notification_time = notification_time.astimezone(timezone.utc)
-        
-        time_until_notification = (notification_time - current_time).total_seconds() / 60
+        lesson_datetime = _as_utc(lesson_data['datetime'])
         time_until_lesson = (lesson_datetime - current_time).total_seconds() / 60
         
+        stages = []
+        for stage, notification_time, deadline in _stage_windows(lesson_data):
+            time_until_notification = (notification_time - current_time).total_seconds() / 60
+            stages.append({
+                'stage': stage['name'],
+                'notification_datetime': notification_time.strftime('%Y-%m-%d %H:%M'),
+                'minutes_until_notification': max(0, time_until_notification),
+                'notification_passed': time_until_notification <= 0,
+                'outdated': current_time >= deadline
+            })
+        
         status[lesson_type] = {
             'lesson_title': lesson_data['title'],
             'lesson_datetime': lesson_datetime.strftime('%Y-%m-%d %H:%M'),
-            'notification_datetime': notification_time.strftime('%Y-%m-%d %H:%M'),
-            'minutes_until_notification': max(0, time_until_notification),
+            'stages': stages,
             'minutes_until_lesson': max(0, time_until_lesson),
-            'notification_passed': time_until_notification <= 0,
             'lesson_passed': time_until_lesson <= 0,
             'is_active': lesson_data.get('is_active', False)
         }
     
     return status
 
+async def get_reminder_capacity_plan() -> dict:
+    """
+    Прогноз рассылок: к get_notification_status добавляет по каждому
+    неустаревшему этапу число получателей (COUNT в SQL), сколько из них
+    заблокировали бота, ожидаемую длительность рассылки при TELEGRAM_GLOBAL_RATE
+    и время, когда напоминание дойдет до последнего получателя.
+    """
+    status = get_notification_status()
+    active_lessons = get_active_lessons()
+    current_time = datetime.now(timezone.utc)
+    
+    for lesson_type, lesson_status in status.items():
+        lesson_data = active_lessons[lesson_type]
+        lesson_datetime = _as_utc(lesson_data['datetime'])
+        notification_times = {stage['name']: notification_time
+                              for stage, notification_time, _ in _stage_windows(lesson_data)}
+        for stage_status in lesson_status['stages']:
+            if stage_status['outdated']:
+                continue
+            counts = await db_free_lessons.count_reminder_recipients(
+                lesson_type, lesson_data['datetime'].date(), stage_status['stage']
+            )
+            # Заблокировавшие бота пропускаются без запроса к Telegram
+            send_seconds = (counts['recipients'] - counts['blocked']) / config.TELEGRAM_GLOBAL_RATE
+            last_recipient_at = (max(current_time, notification_times[stage_status['stage']])
+                                 + timedelta(seconds=send_seconds))
+            stage_status.update(
+                recipients=counts['recipients'],
+                blocked=counts['blocked'],
+                send_seconds=send_seconds,
+                last_recipient_at=last_recipient_at,
+                minutes_before_lesson=(lesson_datetime - last_recipient_at).total_seconds() / 60,
+                misses_lesson=last_recipient_at > lesson_datetime
+            )
+    
+    return status
+
 # Admin function for manual notification testing
 async def send_test_notification(application: Application, lesson_type: str, user_id: int = None):
     """
@@ -252,10 +514,11 @@ async def send_test_notification(application: Application, lesson_type: str, use
     
     if user_id:
         # Отправка конкретному пользователю
+        if db_blocked.is_blocked(user_id):
+            logger.info(f"Test notification for lesson {lesson_type} skipped, user {user_id} blocked the bot")
+            return False
         try:
-            reminder_text = f"🧪 ТЕСТ: {lesson_data['reminder_text']}".format(
-                description=lesson_data['description']
-            )
+            reminder_text = "🧪 ТЕСТ: " + _reminder_text(lesson_data, get_reminder_stages(lesson_data)[-1])
             await application.bot.send_message(
                 chat_id=user_id,
                 text=reminder_text,
@@ -263,6 +526,10 @@ async def send_test_notification(application: Application, lesson_type: str, use
             )
             logger.info(f"Test notification sent to user {user_id} for lesson {lesson_type}")
             return True
+        except Forbidden as e:
+            logger.warning(f"Test notification not delivered, user {user_id} blocked the bot: {e}")
+            await record_blocked(user_id, e)
+            return False
         except Exception as e:
             logger.error(f"Failed to send test notification to user {user_id}: {e}")
             return False
@@ -0,0 +1,163 @@
+# utils/scheduler.py
+"""
+Single-loop scheduler for jobs stored in the scheduled_jobs table.
+
+One task sleeps until the earliest pending job is due (or until a new job is
+scheduled, or SCHEDULER_MAX_SLEEP at most), claims every due job and runs it
+with the handler registered for its job_type. Because jobs live in the
+database, a restart loses nothing: jobs that came due while the bot was down
+are claimed on the first iteration, and jobs interrupted mid-run are
+requeued on startup.
+
+Several bot instances can run schedulers against the same table: claims use
+SKIP LOCKED, and an instance never runs two jobs of one group (keys sharing
+the part before '#') at once, so the parts of a split job spread across
+instances. Jobs of an instance that died are requeued by the others after
+SCHEDULER_STALE_JOB_SECONDS.
+"""
+import time
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+
+import config
+from db.aio import scheduled_jobs as db_jobs
+
+logger = logging.getLogger(__name__)
+
+class JobScheduler:
+    """
+    Dispatches due scheduled_jobs rows to coroutine handlers.
+
+    A handler is called as `await handler(application, job)` where job is a
+    dict with id, job_type, job_key, payload, run_at and attempts. It may
+    return a final status (e.g. STATUS_SKIPPED); None means done. Handlers
+    must tolerate running twice for the same job after a crash.
+    """
+
+    def __init__(self):
+        self._handlers = {}
+        self._application = None
+        self._loop_task = None
+        self._wakeup = None
+        self._stopping = False
+        self._running = set()
+        # ids of the jobs those tasks run: never requeued by the periodic pass
+        self._running_ids = set()
+        # job group -> number of its jobs running in this process
+        self._running_groups = {}
+        self._last_requeue = 0.0
+
+    def register(self, job_type, handler):
+        self._handlers[job_type] = handler
+
+    async def schedule(self, job_type, job_key, run_at, payload=None):
+        """Persists a job (see db.scheduled_jobs.schedule_job) and wakes the loop. Returns its status."""
+        status = await db_jobs.schedule_job(job_type, job_key, run_at, payload)
+        self.wake()
+        return status
+
+    def wake(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def start(self, application):
+        if self._loop_task is not None:
+            return
+        self._application = application
+        self._stopping = False
+        self._wakeup = asyncio.Event()
+        # Свои задачи, прерванные перезапуском, возвращаются сразу — но только здесь:
+        # пока процесс работает, его задачи в статусе running действительно выполняются
+        await db_jobs.requeue_interrupted_jobs(config.INSTANCE_ID, config.SCHEDULER_STALE_JOB_SECONDS)
+        self._last_requeue = time.monotonic()
+        self._loop_task = asyncio.create_task(self._loop(), name="job-scheduler")
+        logger.info(f"Job scheduler started (handlers: {', '.join(sorted(self._handlers)) or 'none'})")
+
+    async def stop(self):
+        """Stops the loop and cancels running jobs; they stay 'running' and are requeued on next start."""
+        self._stopping = True
+        self.wake()
+        tasks = [task for task in (self._loop_task, *self._running) if task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._loop_task = None
+        logger.info("Job scheduler stopped")
+
+    async def _loop(self):
+        while not self._stopping:
+            # Cleared before querying so a wake() during the query is not lost
+            self._wakeup.clear()
+            try:
+                if time.monotonic() - self._last_requeue >= config.SCHEDULER_MAX_SLEEP:
+                    # Только задачи умерших экземпляров: без heartbeat дольше SCHEDULER_STALE_JOB_SECONDS
+                    await db_jobs.requeue_interrupted_jobs(None, config.SCHEDULER_STALE_JOB_SECONDS,
+                                                           exclude_ids=list(self._running_ids))
+                    self._last_requeue = time.monotonic()
+                # One claim at a time, so a group never gets two jobs in this process
+                while True:
+                    jobs = await db_jobs.claim_due_jobs(config.INSTANCE_ID, limit=1, exclude_groups=list(self._running_groups))
+                    if not jobs:
+                        break
+                    self._start_job(jobs[0])
+                delay = config.SCHEDULER_MAX_SLEEP
+                next_run_at = await db_jobs.get_next_run_at(exclude_groups=list(self._running_groups))
+                if next_run_at is not None:
+                    until_next = (next_run_at - datetime.now(timezone.utc)).total_seconds()
+                    delay = min(delay, max(0.0, until_next))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Job scheduler iteration failed: {e}")
+                delay = min(config.SCHEDULER_MAX_SLEEP, 5)
+            # asyncio.wait, unlike wait_for, never swallows a cancellation
+            waiter = asyncio.ensure_future(self._wakeup.wait())
+            try:
+                await asyncio.wait({waiter}, timeout=delay)
+            finally:
+                waiter.cancel()
+
+    def _start_job(self, job):
+        group = db_jobs.job_group(job['job_type'], job['job_key'])
+        self._running_groups[group] = self._running_groups.get(group, 0) + 1
+        task = asyncio.create_task(self._run_job(job), name=f"job-{job['id']}")
+        self._running.add(task)
+        self._running_ids.add(job['id'])
+
+        def on_done(finished):
+            self._running.discard(finished)
+            self._running_ids.discard(job['id'])
+            remaining = self._running_groups.pop(group, 1) - 1
+            if remaining:
+                self._running_groups[group] = remaining
+            # Jobs of this group held back for this process may be claimable now
+            self.wake()
+        task.add_done_callback(on_done)
+
+    async def _run_job(self, job):
+        handler = self._handlers.get(job['job_type'])
+        if handler is None:
+            logger.error(f"No handler for scheduled job {job['id']} of type {job['job_type']}")
+            await db_jobs.finish_job(job['id'], db_jobs.STATUS_FAILED, "no handler registered")
+            return
+        late = (datetime.now(timezone.utc) - job['run_at']).total_seconds()
+        logger.info(f"Running scheduled job {job['job_type']}:{job['job_key']} "
+                    f"(attempt {job['attempts']}, {max(0.0, late):.0f} s after its time)")
+        try:
+            status = await handler(self._application, job)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            if job['attempts'] < config.SCHEDULER_MAX_ATTEMPTS:
+                delay = config.SCHEDULER_RETRY_DELAY * 2 ** (job['attempts'] - 1)
+                logger.error(f"Scheduled job {job['id']} failed, retrying in {delay:.0f} s: {e}")
+                await db_jobs.retry_job(job['id'], datetime.now(timezone.utc) + timedelta(seconds=delay), str(e))
+                self.wake()
+            else:
+                logger.error(f"Scheduled job {job['id']} failed after {job['attempts']} attempts: {e}")
+                await db_jobs.finish_job(job['id'], db_jobs.STATUS_FAILED, str(e))
+            return
+        await db_jobs.finish_job(job['id'], status or db_jobs.STATUS_DONE)
+
+scheduler = JobScheduler()